@@ -0,0 +1,1030 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2017
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+A compact, array-based DAG used as the computational core of the schedulers
+
+Nodes are identified internally by their index (0 ... N-1), and externally by
+their node id (the networkx node key, which is the drop position + 1 for DAGs
+built from drop lists). Edges are numbered 0 ... E-1 in CSR order (i.e. sorted
+by source node), which is also the order in which they are exported to and
+imported from networkx.
+"""
+
+import ctypes
+import heapq
+import logging
+
+import networkx as nx
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+def _csr(keys, num_nodes):
+    """
+    Returns the (indptr, edge ids) CSR arrays for the given per-edge keys
+    """
+    order = np.argsort(keys, kind='mergesort')
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=num_nodes), out=indptr[1:])
+    return indptr, order
+
+def _gather(indptr, nodes):
+    """
+    Returns the positions of all CSR entries belonging to `nodes`
+    """
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    total = counts.sum()
+    if (total == 0):
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return offsets + np.arange(total)
+
+def _weights(values):
+    """
+    Integer weights are kept as integers, anything else becomes float64
+    """
+    arr = np.asarray(values)
+    if (arr.dtype.kind in 'biu'):
+        return arr.astype(np.int64)
+    return arr.astype(np.float64)
+
+class CompactDAG(object):
+    """
+    A DAG stored as CSR adjacency arrays plus per-node and per-edge arrays:
+
+        weight, num_cpus, dt    - per-node arrays
+        edge_src, edge_dst      - per-edge endpoints (node indices)
+        edge_weight             - per-edge weights
+
+    Successors of node i are ``edge_dst[succ_ptr[i]:succ_ptr[i + 1]]``, and
+    its predecessors are ``pred_idx[pred_ptr[i]:pred_ptr[i + 1]]`` (with
+    ``pred_eid`` holding the corresponding edge ids).
+
+    The topological order (and the level, or "generation", of each node) is
+    computed once and cached, so that longest path calculations under
+    different edge weights only cost a few vectorised passes over the edges.
+    """
+
+    def __init__(self, node_ids, edge_src, edge_dst, edge_weight,
+                 weight=None, num_cpus=None, dt=None, text=None):
+        num_nodes = len(node_ids)
+        self.node_ids = np.asarray(node_ids)
+        src = np.asarray(edge_src, dtype=np.int64)
+        dst = np.asarray(edge_dst, dtype=np.int64)
+
+        # Store edges in CSR order
+        self.succ_ptr, order = _csr(src, num_nodes)
+        self.edge_src = src[order]
+        self.edge_dst = dst[order]
+        self.edge_weight = _weights(edge_weight)[order] if len(order) else np.zeros(0, dtype=np.int64)
+        self.pred_ptr, self.pred_eid = _csr(self.edge_dst, num_nodes)
+        self.pred_idx = self.edge_src[self.pred_eid]
+
+        zeros = np.zeros(num_nodes, dtype=np.int64)
+        self.weight = _weights(weight) if weight is not None else zeros
+        self.num_cpus = _weights(num_cpus) if num_cpus is not None else zeros + 1
+        self.dt = np.asarray(dt, dtype=np.int8) if dt is not None else zeros.astype(np.int8)
+        self.text = text
+
+        self._id_index = None
+        self._id_rank = None
+        self._levels = None
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self):
+        return len(self.edge_src)
+
+    @property
+    def id_rank(self):
+        """
+        The position of each node id in the sorted list of node ids
+        """
+        if (self._id_rank is None):
+            rank = np.empty(self.num_nodes, dtype=np.int64)
+            rank[np.argsort(self.node_ids, kind='mergesort')] = np.arange(self.num_nodes)
+            self._id_rank = rank
+        return self._id_rank
+
+    @property
+    def out_degree(self):
+        return np.diff(self.succ_ptr)
+
+    @property
+    def in_degree(self):
+        return np.diff(self.pred_ptr)
+
+    def index(self, node_id):
+        """
+        Returns the node index of the given node id
+        """
+        if (self._id_index is None):
+            self._id_index = dict((nid, i) for i, nid in enumerate(self.node_ids.tolist()))
+        return self._id_index[node_id]
+
+    def successors(self, i):
+        return self.edge_dst[self.succ_ptr[i]:self.succ_ptr[i + 1]]
+
+    def predecessors(self, i):
+        return self.pred_idx[self.pred_ptr[i]:self.pred_ptr[i + 1]]
+
+    def edge_id(self, u, v):
+        """
+        Returns the id of the edge going from node index u to node index v
+        """
+        st = self.succ_ptr[u]
+        pos = np.flatnonzero(self.edge_dst[st:self.succ_ptr[u + 1]] == v)
+        if (len(pos) == 0):
+            raise KeyError((u, v))
+        return st + pos[0]
+
+    def edges_by_weight(self, edge_weight=None):
+        """
+        Returns the edge ids sorted by decreasing weight. Edges with the same
+        weight keep their relative (CSR) order
+        """
+        ew = self.edge_weight if edge_weight is None else edge_weight
+        return np.argsort(-ew, kind='mergesort')
+
+    def _compute_levels(self):
+        """
+        Kahn's algorithm, one whole generation of nodes at a time
+        """
+        n = self.num_nodes
+        indeg = self.in_degree.copy()
+        level = np.zeros(n, dtype=np.int64)
+        frontier = np.flatnonzero(indeg == 0)
+        generations = []
+        visited = 0
+        while (len(frontier) > 0):
+            level[frontier] = len(generations)
+            generations.append(frontier)
+            visited += len(frontier)
+            dsts = self.edge_dst[_gather(self.succ_ptr, frontier)]
+            if (len(dsts) == 0):
+                break
+            dec = np.bincount(dsts, minlength=n)
+            indeg -= dec
+            frontier = np.flatnonzero((dec > 0) & (indeg == 0))
+        if (visited != n):
+            raise nx.NetworkXUnfeasible("Graph contains a cycle.")
+
+        topo_order = np.concatenate(generations) if generations else np.empty(0, dtype=np.int64)
+        # edges grouped by the level of their destination node
+        # (and by destination node within each level)
+        dlevel = level[self.edge_dst]
+        lvl_edges = np.lexsort((self.edge_dst, dlevel))
+        lvl_eptr = np.searchsorted(dlevel[lvl_edges], np.arange(len(generations) + 1))
+        # and by the level of their source node (edges are already sorted
+        # by source node, so a stable sort keeps them grouped by it)
+        slevel = level[self.edge_src]
+        slvl_edges = np.argsort(slevel, kind='mergesort')
+        slvl_eptr = np.searchsorted(slevel[slvl_edges], np.arange(len(generations) + 1))
+        self._levels = (level, topo_order, lvl_edges, lvl_eptr, slvl_edges, slvl_eptr)
+
+    @property
+    def levels(self):
+        """
+        The level (generation) of each node in the DAG
+        """
+        if (self._levels is None):
+            self._compute_levels()
+        return self._levels[0]
+
+    @property
+    def topo_order(self):
+        """
+        Node indices in topological order
+        """
+        if (self._levels is None):
+            self._compute_levels()
+        return self._levels[1]
+
+    def _relax(self, node_val, edge_val, init):
+        """
+        Computes, in topological order,
+        ``dist[v] = max(init[v], max(dist[u] + node_val[u] + edge_val(u, v)))``
+        over all predecessors u of v, and returns `dist`
+        """
+        if (self._levels is None):
+            self._compute_levels()
+        lvl_edges, lvl_eptr = self._levels[2:4]
+        dist = init
+        for l in range(1, len(lvl_eptr) - 1):
+            eids = lvl_edges[lvl_eptr[l]:lvl_eptr[l + 1]]
+            if (len(eids) == 0):
+                continue
+            s = self.edge_src[eids]
+            d = self.edge_dst[eids]
+            cand = dist[s] + node_val[s] + edge_val[eids]
+            starts = np.flatnonzero(np.concatenate(([True], d[1:] != d[:-1])))
+            d = d[starts]
+            dist[d] = np.maximum(dist[d], np.maximum.reduceat(cand, starts))
+        return dist
+
+    def _relax_reverse(self, node_val, edge_val, init):
+        """
+        Computes, in reverse topological order,
+        ``dist[u] = max(init[u], max(node_val[u] + edge_val(u, v) + dist[v]))``
+        over all successors v of u, and returns `dist`
+        """
+        if (self._levels is None):
+            self._compute_levels()
+        slvl_edges, slvl_eptr = self._levels[4:6]
+        dist = init
+        for l in range(len(slvl_eptr) - 2, -1, -1):
+            eids = slvl_edges[slvl_eptr[l]:slvl_eptr[l + 1]]
+            if (len(eids) == 0):
+                continue
+            s = self.edge_src[eids]
+            d = self.edge_dst[eids]
+            cand = node_val[s] + edge_val[eids] + dist[d]
+            starts = np.flatnonzero(np.concatenate(([True], s[1:] != s[:-1])))
+            s = s[starts]
+            dist[s] = np.maximum(dist[s], np.maximum.reduceat(cand, starts))
+        return dist
+
+    def sink_weight(self):
+        """
+        The node weights of sink nodes (zero for all other nodes). Since the
+        weight of the last node of a path is only counted for sink nodes, it
+        is folded into the value of the edges pointing to them
+        """
+        return np.where(self.out_degree == 0, self.weight, 0)
+
+    def longest_path(self, edge_weight=None, show_path=True):
+        """
+        Array version of `DAGUtil.get_longest_path`, with the same definition
+        of path length: edge weights plus the weights of all nodes on the path,
+        except the first node of the path is only counted if it has successors
+        and the last node only if it has no successors.
+
+        Returns a tuple (path, path_length), where path is a list of node ids
+        (or None if show_path is False)
+        """
+        n = self.num_nodes
+        if (n == 0):
+            return ([] if show_path else None, 0)
+        ew = self.edge_weight if edge_weight is None else edge_weight
+        w = self.weight
+        edge_val = ew + self.sink_weight()[self.edge_dst]
+        dtype = np.result_type(w, edge_val)
+        dist = self._relax(w, edge_val, np.zeros(n, dtype=dtype))
+
+        # As in the networkx-based version, ties are broken in favour of the
+        # predecessor with the largest node id, and then of the first node.
+        # Node ids are compared through their rank so they can be of any type
+        rank = self.id_rank
+        tight = (dist[self.edge_src] + w[self.edge_src] + edge_val) == dist[self.edge_dst]
+        has_pred = self.in_degree > 0
+        best_pred = np.where(has_pred, -1, rank)
+        np.maximum.at(best_pred, self.edge_dst[tight], rank[self.edge_src[tight]])
+        lp = dist.max()
+        cands = np.flatnonzero(dist == lp)
+        end = cands[np.argmax(best_pred[cands])]
+        if (not show_path):
+            return (None, lp.item())
+
+        path = [end]
+        v = end
+        while (has_pred[v]):
+            preds = self.predecessors(v)
+            v = preds[rank[preds] == best_pred[v]][0]
+            path.append(v)
+        path.reverse()
+        return (self.node_ids[path].tolist(), lp.item())
+
+    def label_schedule(self, edge_weight=None):
+        """
+        Array version of `DAGUtil.label_schedule`. Returns the (stt, edt)
+        arrays with the start and end time of each node
+        """
+        ew = self.edge_weight if edge_weight is None else edge_weight
+        w = self.weight
+        dtype = np.result_type(w, ew)
+        stt = self._relax(w, ew, np.zeros(self.num_nodes, dtype=dtype))
+        return stt, stt + w
+
+    @staticmethod
+    def from_drops(drop_list):
+        """
+        Builds a CompactDAG from a list of drop specs, with the same node and
+        edge weights that `DAGUtil.build_dag_from_drops` uses
+
+        tw - task weight
+        dw - data weight / volume
+        """
+        # avoid a circular import
+        from dfms.dropmake.scheduler import SchedulerException
+        n = len(drop_list)
+        key_dict = dict() # {oid : node index}
+        for i, drop in enumerate(drop_list):
+            key_dict[drop['oid']] = i
+
+        weight = np.zeros(n, dtype=np.int64)
+        dt = np.zeros(n, dtype=np.int8)
+        num_cpus = np.ones(n, dtype=np.int64)
+        text = []
+        src = []
+        dst = []
+        ew = []
+        seen = set()
+        for i, drop in enumerate(drop_list):
+            tt = drop['type']
+            if ('plain' == tt):
+                obk = 'consumers' # outbound keyword
+            elif ('app' == tt):
+                obk = 'outputs'
+                weight[i] = int(drop['tw'])
+                dt[i] = 1
+            else:
+                raise SchedulerException("Drop Type '{0}' not supported".\
+                format(tt))
+            num_cpus[i] = drop.get('num_cpus', 1)
+            text.append(drop['nm'])
+            for oup in drop.get(obk, []):
+                j = key_dict[oup]
+                if ((i, j) in seen):
+                    continue
+                seen.add((i, j))
+                src.append(i)
+                dst.append(j)
+                if ('plain' == tt):
+                    ew.append(int(drop['dw']))
+                else:
+                    ew.append(int(drop_list[j].get('dw', 5)))
+
+        return CompactDAG(np.arange(1, n + 1), src, dst, np.array(ew, dtype=np.int64),
+                          weight=weight, num_cpus=num_cpus, dt=dt, text=text)
+
+    @staticmethod
+    def from_nx(G, weight='weight'):
+        """
+        Builds a CompactDAG from a networkx DiGraph. Only the weight,
+        num_cpus and dt node attributes are carried over
+        """
+        node_ids = G.nodes()
+        idx = dict((nid, i) for i, nid in enumerate(node_ids))
+        gnode = G.node
+        src = []
+        dst = []
+        ew = []
+        for u, v, data in G.edges_iter(data=True):
+            src.append(idx[u])
+            dst.append(idx[v])
+            ew.append(data.get(weight, 1))
+        cdag = CompactDAG(np.array(node_ids), src, dst, ew,
+                          weight=[gnode[n].get(weight, 0) for n in node_ids],
+                          num_cpus=[gnode[n].get('num_cpus', 1) for n in node_ids],
+                          dt=[gnode[n].get('dt', 0) for n in node_ids])
+        cdag._id_index = idx
+        return cdag
+
+    def to_nx(self, drop_list=None, embed_drop=True, edge_weight=None):
+        """
+        Returns the equivalent networkx DiGraph. If drop_list is given and
+        embed_drop is True each node also carries its drop spec
+        """
+        G = nx.DiGraph()
+        ids = self.node_ids.tolist()
+        weight = self.weight.tolist()
+        num_cpus = self.num_cpus.tolist()
+        dt = self.dt.tolist()
+        embed = (drop_list is not None) and embed_drop
+        nodes = []
+        for i, nid in enumerate(ids):
+            attrs = {'weight': weight[i], 'dt': dt[i], 'num_cpus': num_cpus[i]}
+            if (self.text is not None):
+                attrs['text'] = self.text[i]
+            if (embed):
+                attrs['drop_spec'] = drop_list[i]
+            nodes.append((nid, attrs))
+        G.add_nodes_from(nodes)
+        ew = self.edge_weight if edge_weight is None else edge_weight
+        node_ids = self.node_ids
+        G.add_weighted_edges_from(zip(node_ids[self.edge_src].tolist(),
+                                      node_ids[self.edge_dst].tolist(),
+                                      ew.tolist()))
+        return G
+
+class CriticalPath(object):
+    """
+    Incrementally maintained longest (critical) path of a CompactDAG under
+    changing edge weights.
+
+    For each node we keep its top level (the longest path ending at the node)
+    and its bottom level (the longest path starting from it), so that the
+    longest path going through a node is ``top + bottom`` and the critical
+    path length is the maximum of that over all nodes. Path lengths follow
+    the same definition as `CompactDAG.longest_path`.
+
+    When the weight of edge (u, v) changes only the top levels of v and its
+    descendants, and the bottom levels of u and its ancestors, can change.
+    These are updated in topological (resp. reverse topological) order, and
+    the propagation stops at nodes whose level did not change.
+    """
+
+    def __init__(self, cdag, edge_weight=None):
+        self._cdag = cdag
+        ew = cdag.edge_weight if edge_weight is None else edge_weight
+        w = cdag.weight
+        sinkw = cdag.sink_weight()
+        edge_val = ew + sinkw[cdag.edge_dst]
+        dtype = np.result_type(w, edge_val)
+        n = cdag.num_nodes
+        top = cdag._relax(w, edge_val, np.zeros(n, dtype=dtype))
+        bottom = cdag._relax_reverse(w, edge_val, np.zeros(n, dtype=dtype))
+
+        # scalar access is much faster on lists than on numpy arrays
+        self._top = top.tolist()
+        self._bottom = bottom.tolist()
+        self._ew = np.asarray(ew).tolist()
+        self._w = w.tolist()
+        self._sinkw = sinkw.tolist()
+        self._src = cdag.edge_src.tolist()
+        self._dst = cdag.edge_dst.tolist()
+        self._succ_ptr = cdag.succ_ptr.tolist()
+        self._pred_ptr = cdag.pred_ptr.tolist()
+        self._pred_eid = cdag.pred_eid.tolist()
+        pos = np.empty(n, dtype=np.int64)
+        pos[cdag.topo_order] = np.arange(n)
+        self._pos = pos.tolist()
+
+        through = top + bottom
+        self._length = through.max().item() if n else 0
+        self._num_critical = int(np.count_nonzero(through == self._length)) if n else 0
+
+    @property
+    def length(self):
+        """
+        The current critical path length
+        """
+        return self._length
+
+    def edge_weight(self, eid):
+        return self._ew[eid]
+
+    def top_level(self, i):
+        return self._top[i]
+
+    def bottom_level(self, i):
+        return self._bottom[i]
+
+    def _edge_val(self, eid):
+        return self._ew[eid] + self._sinkw[self._dst[eid]]
+
+    def _set_through(self, old, new):
+        length = self._length
+        if (old == length):
+            self._num_critical -= 1
+        if (new > length):
+            self._length = new
+            self._num_critical = 1
+        elif (new == length):
+            self._num_critical += 1
+
+    def set_edge_weight(self, eid, weight):
+        """
+        Changes the weight of edge `eid` and updates the affected top and
+        bottom levels. Returns the new critical path length
+        """
+        old = self._ew[eid]
+        if (old == weight):
+            return self._length
+        self._ew[eid] = weight
+        u = self._src[eid]
+        v = self._dst[eid]
+        top, bottom, w = self._top, self._bottom, self._w
+        pos = self._pos
+
+        # top levels, from v downwards
+        heap = [(pos[v], v)]
+        queued = set([v])
+        while heap:
+            _, x = heapq.heappop(heap)
+            queued.discard(x)
+            t = 0
+            for k in range(self._pred_ptr[x], self._pred_ptr[x + 1]):
+                e = self._pred_eid[k]
+                p = self._src[e]
+                c = top[p] + w[p] + self._edge_val(e)
+                if (c > t):
+                    t = c
+            if (t == top[x]):
+                continue
+            self._set_through(top[x] + bottom[x], t + bottom[x])
+            top[x] = t
+            for e in range(self._succ_ptr[x], self._succ_ptr[x + 1]):
+                y = self._dst[e]
+                if (y not in queued):
+                    queued.add(y)
+                    heapq.heappush(heap, (pos[y], y))
+
+        # bottom levels, from u upwards
+        heap = [(-pos[u], u)]
+        queued = set([u])
+        while heap:
+            _, x = heapq.heappop(heap)
+            queued.discard(x)
+            b = 0
+            for e in range(self._succ_ptr[x], self._succ_ptr[x + 1]):
+                c = w[x] + self._edge_val(e) + bottom[self._dst[e]]
+                if (c > b):
+                    b = c
+            if (b == bottom[x]):
+                continue
+            self._set_through(top[x] + bottom[x], top[x] + b)
+            bottom[x] = b
+            for k in range(self._pred_ptr[x], self._pred_ptr[x + 1]):
+                y = self._src[self._pred_eid[k]]
+                if (y not in queued):
+                    queued.add(y)
+                    heapq.heappush(heap, (-pos[y], y))
+
+        # the last critical node has gone, find the new critical path length
+        if (self._num_critical == 0):
+            through = [t + b for t, b in zip(top, bottom)]
+            self._length = max(through)
+            self._num_critical = through.count(self._length)
+        return self._length
+
+    def probe_edge_weight(self, eid, weight):
+        """
+        Returns the critical path length that setting the weight of edge
+        `eid` would produce, leaving the current weights untouched
+        """
+        old = self._ew[eid]
+        # an edge off all critical paths cannot make the DAG shorter
+        if (weight <= old):
+            u = self._src[eid]
+            through = (self._top[u] + self._w[u] + self._edge_val(eid) +
+                       self._bottom[self._dst[eid]])
+            if (through < self._length):
+                return self._length
+        length = self.set_edge_weight(eid, weight)
+        self.set_edge_weight(eid, old)
+        return length
+
+def _bits(x):
+    """
+    Yields the positions of the bits set in the (bitset) integer x
+    """
+    while x:
+        low = x & -x
+        yield low.bit_length() - 1
+        x ^= low
+
+class Reachability(object):
+    """
+    Reachability queries on a CompactDAG. Searches are pruned using the
+    topological position of the nodes: a node can only reach nodes that come
+    after it in topological order
+    """
+
+    def __init__(self, cdag):
+        self._cdag = cdag
+        self._succ_ptr = cdag.succ_ptr.tolist()
+        self._succ = cdag.edge_dst.tolist()
+        self._pred_ptr = cdag.pred_ptr.tolist()
+        self._pred = cdag.pred_idx.tolist()
+        pos = np.empty(cdag.num_nodes, dtype=np.int64)
+        pos[cdag.topo_order] = np.arange(cdag.num_nodes)
+        self._pos = pos.tolist()
+        self._node_ids = cdag.node_ids.tolist()
+
+    def _search(self, start, ptr, adj, keep, targets):
+        found = []
+        seen = set([start])
+        stack = [start]
+        while stack:
+            x = stack.pop()
+            for k in range(ptr[x], ptr[x + 1]):
+                y = adj[k]
+                if (y in seen or not keep(y)):
+                    continue
+                seen.add(y)
+                if (y in targets):
+                    found.append(y)
+                stack.append(y)
+        return found
+
+    def __call__(self, node, members):
+        """
+        Returns the (descendants, ancestors) of `node` amongst `members`
+        """
+        index = self._cdag.index
+        i = index(node)
+        targets = set(index(m) for m in members if m != node)
+        if (not targets):
+            return [], []
+        pos = self._pos
+        tpos = [pos[t] for t in targets]
+        ipos = pos[i]
+        hi = max(tpos)
+        lo = min(tpos)
+        ids = self._node_ids
+        desc = []
+        anc = []
+        if (hi > ipos):
+            desc = self._search(i, self._succ_ptr, self._succ,
+                                lambda y: pos[y] <= hi, targets)
+        if (lo < ipos):
+            anc = self._search(i, self._pred_ptr, self._pred,
+                               lambda y: pos[y] >= lo, targets)
+        return [ids[d] for d in desc], [ids[a] for a in anc]
+
+class NxReachability(object):
+    """
+    Reachability queries on a networkx DiGraph
+    """
+
+    def __init__(self, G):
+        self._G = G
+
+    def __call__(self, node, members):
+        G = self._G
+        if (node not in G):
+            return [], []
+        return ([m for m in nx.descendants(G, node) if m in members],
+                [m for m in nx.ancestors(G, node) if m in members])
+
+class MaxWeightedAntichain(object):
+    """
+    Incrementally maintains the maximum weighted antichain length (i.e. the
+    weighted width) of a set of nodes of a DAG.
+
+    By the weighted version of Dilworth's theorem the width is the total node
+    weight minus the maximum flow of the bipartite network
+
+        s -> x_i (capacity w_i), x_i -> y_j (if i reaches j), y_j -> t (w_j)
+
+    The comparability between member nodes is kept as bitsets (one bit per
+    member), and the current maximum flow is kept between updates: adding
+    nodes (or merging another instance in) only needs to augment the existing
+    flow, instead of solving the whole flow problem again.
+
+    Changes can be made tentatively with `begin()`, and then either kept with
+    `commit()` or undone with `rollback()`.
+    """
+
+    def __init__(self, reach):
+        """
+        reach:  a callable such that ``reach(node, members)`` returns the
+                (descendants, ancestors) of node amongst the members
+        """
+        self._reach = reach
+        self._nodes = []
+        self._slot = {} # {node : slot}
+        self._w = []
+        self._down = [] # slots reachable from each slot (bitset)
+        self._up = [] # slots that reach each slot (bitset)
+        self._out_s = [] # flow on s -> x_i
+        self._in_t = [] # flow on y_j -> t
+        self._flow = [] # {j : flow on x_i -> y_j} for each slot i
+        self._flow_in = [] # {i : flow on x_i -> y_j} for each slot j
+        self._total_weight = 0
+        self._flow_value = 0
+        self._undo = None
+        self._saved = None
+
+    @property
+    def nodes(self):
+        return self._nodes
+
+    @property
+    def width(self):
+        return self._total_weight - self._flow_value
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, node):
+        return node in self._slot
+
+    def begin(self):
+        self._undo = []
+        self._saved = (len(self._nodes), self._total_weight, self._flow_value)
+
+    def commit(self):
+        self._undo = None
+
+    def rollback(self):
+        for container, key, old in reversed(self._undo):
+            if (old is None):
+                del container[key]
+            else:
+                container[key] = old
+        n, self._total_weight, self._flow_value = self._saved
+        for node in self._nodes[n:]:
+            del self._slot[node]
+        for l in (self._nodes, self._w, self._down, self._up,
+                  self._out_s, self._in_t, self._flow, self._flow_in):
+            del l[n:]
+        self._undo = None
+
+    def _set(self, container, key, value):
+        if (self._undo is not None):
+            self._undo.append((container, key, container.get(key) if isinstance(container, dict) else container[key]))
+        if (isinstance(container, dict) and value == 0):
+            container.pop(key, None)
+        else:
+            container[key] = value
+
+    def _new_slot(self, node, weight):
+        i = len(self._nodes)
+        self._nodes.append(node)
+        self._slot[node] = i
+        self._w.append(weight)
+        self._down.append(0)
+        self._up.append(0)
+        self._out_s.append(0)
+        self._in_t.append(0)
+        self._flow.append({})
+        self._flow_in.append({})
+        self._total_weight += weight
+        return i
+
+    def _link(self, i, desc, anc):
+        """
+        Records that slot i reaches the `desc` slots and is reached by `anc`
+        """
+        bit = 1 << i
+        down, up = self._down, self._up
+        for j in desc:
+            down[i] |= 1 << j
+            self._set(up, j, up[j] | bit)
+        for j in anc:
+            up[i] |= 1 << j
+            self._set(down, j, down[j] | bit)
+
+    def add_nodes(self, nodes):
+        """
+        Adds the given (node, weight) pairs, and returns the new width
+        """
+        slot = self._slot
+        for node, weight in nodes:
+            if (node in slot):
+                continue
+            desc, anc = self._reach(node, slot)
+            i = self._new_slot(node, weight)
+            self._link(i, [slot[d] for d in desc], [slot[a] for a in anc])
+        self._augment()
+        return self.width
+
+    def merge(self, that):
+        """
+        Adds all nodes of another instance, reusing its flow, and returns the
+        new width. `that` should not be used afterwards
+        """
+        slot = self._slot
+        offset = len(self._nodes)
+        existing = dict(slot)
+        for k, node in enumerate(that._nodes):
+            self._new_slot(node, that._w[k])
+        for k, node in enumerate(that._nodes):
+            i = offset + k
+            self._down[i] |= that._down[k] << offset
+            self._up[i] |= that._up[k] << offset
+            # the comparability with our existing nodes
+            desc, anc = self._reach(node, existing)
+            self._link(i, [slot[d] for d in desc], [slot[a] for a in anc])
+            self._out_s[i] = that._out_s[k]
+            self._in_t[i] = that._in_t[k]
+            self._flow[i] = dict((j + offset, f) for j, f in that._flow[k].items())
+            self._flow_in[i] = dict((j + offset, f) for j, f in that._flow_in[k].items())
+        self._flow_value += that._flow_value
+        self._augment()
+        return self.width
+
+    def _augment(self):
+        """
+        Augments the current flow until it is maximum (Edmonds-Karp, with the
+        x -> y adjacency given by the reachability bitsets)
+        """
+        w, down = self._w, self._down
+        out_s, in_t = self._out_s, self._in_t
+        flow, flow_in = self._flow, self._flow_in
+        while True:
+            # BFS from s on the residual network
+            parent_x = {} # {x slot : y slot it was reached from (None for s)}
+            parent_y = {} # {y slot : x slot it was reached from}
+            queue = []
+            for i in range(len(w)):
+                if (out_s[i] < w[i]):
+                    parent_x[i] = None
+                    queue.append(i)
+            unseen_y = (1 << len(w)) - 1
+            end = None
+            qi = 0
+            while qi < len(queue) and end is None:
+                i = queue[qi]
+                qi += 1
+                reach = down[i] & unseen_y
+                unseen_y &= ~reach
+                for j in _bits(reach):
+                    parent_y[j] = i
+                    if (in_t[j] < w[j]):
+                        end = j
+                        break
+                    # back edges y_j -> x_k for k sending flow to y_j
+                    for k in flow_in[j]:
+                        if (k not in parent_x):
+                            parent_x[k] = j
+                            queue.append(k)
+            if (end is None):
+                return
+
+            # find the bottleneck, and push the flow along the path
+            b = w[end] - in_t[end]
+            j = end
+            while True:
+                i = parent_y[j]
+                pj = parent_x[i]
+                if (pj is None):
+                    b = min(b, w[i] - out_s[i])
+                    break
+                b = min(b, flow[i][pj])
+                j = pj
+            self._set(in_t, end, in_t[end] + b)
+            j = end
+            while True:
+                i = parent_y[j]
+                self._set(flow[i], j, flow[i].get(j, 0) + b)
+                self._set(flow_in[j], i, flow_in[j].get(i, 0) + b)
+                pj = parent_x[i]
+                if (pj is None):
+                    self._set(out_s, i, out_s[i] + b)
+                    break
+                self._set(flow[i], pj, flow[i][pj] - b)
+                self._set(flow_in[pj], i, flow_in[pj][i] - b)
+                j = pj
+            self._flow_value += b
+
+class CSRGraph(object):
+    """
+    An undirected graph in the CSR form consumed by METIS:
+
+        xadj, adjncy, adjwgt    - the adjacency structure and its edge weights
+        vwgt                    - node weights, one column per constraint
+        vsize                   - node sizes (for the total volume objective)
+
+    Nodes are numbered 0 ... N-1. Edges given more than once (in either
+    direction) are combined by `merge` ('sum' or 'last'), self-loops are
+    dropped and, since METIS does not allow zero edge weights, combined
+    weights below one are reset to one
+    """
+
+    def __init__(self, num_nodes, us, vs, ws, vwgt=None, vsize=None, merge='sum'):
+        us = np.asarray(us, dtype=np.int64)
+        vs = np.asarray(vs, dtype=np.int64)
+        ws = np.asarray(ws, dtype=np.int64)
+        lo = np.minimum(us, vs)
+        hi = np.maximum(us, vs)
+        keep = lo != hi # METIS does not take self-loops
+        lo, hi, ws = lo[keep], hi[keep], ws[keep]
+        keys = lo * num_nodes + hi
+        if (merge == 'sum'):
+            keys, inv = np.unique(keys, return_inverse=True)
+            ws = np.bincount(inv, weights=ws, minlength=len(keys)).astype(np.int64)
+        elif (merge == 'last'):
+            rkeys, ridx = np.unique(keys[::-1], return_index=True)
+            ws = ws[::-1][ridx]
+            keys = rkeys
+        else:
+            raise ValueError("Unknown merge mode: {0}".format(merge))
+        ws = np.maximum(ws, 1)
+        lo = keys // num_nodes if num_nodes else keys
+        hi = keys % num_nodes if num_nodes else keys
+
+        self.num_nodes = num_nodes
+        self.edge_u = lo
+        self.edge_v = hi
+        self.edge_weight = ws
+
+        # both directions of each edge, sorted by row
+        rows = np.concatenate((lo, hi))
+        cols = np.concatenate((hi, lo))
+        order = np.lexsort((cols, rows))
+        self.xadj = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=num_nodes), out=self.xadj[1:])
+        self.adjncy = cols[order]
+        self.adjwgt = np.concatenate((ws, ws))[order]
+
+        if (vwgt is not None):
+            vwgt = np.asarray(vwgt, dtype=np.int64)
+            if (vwgt.ndim == 1):
+                vwgt = vwgt.reshape(-1, 1)
+        self.vwgt = vwgt
+        self.vsize = None if vsize is None else np.asarray(vsize, dtype=np.int64)
+
+    @property
+    def num_edges(self):
+        return len(self.edge_u)
+
+    @property
+    def ncon(self):
+        """
+        Number of balancing constraints
+        """
+        return 1 if self.vwgt is None else self.vwgt.shape[1]
+
+    def to_metis(self, metis):
+        """
+        Returns the ``METIS_Graph`` of the given metis module, pointing
+        directly to (a copy in METIS' index type of) our arrays
+        """
+        idx_t = metis.idx_t
+        dtype = np.int64 if ctypes.sizeof(idx_t) == 8 else np.int32
+        ptr = ctypes.POINTER(idx_t)
+        arrays = []
+        def as_idx(arr):
+            if (arr is None):
+                return None
+            arr = np.ascontiguousarray(arr, dtype=dtype).ravel()
+            arrays.append(arr)
+            return arr.ctypes.data_as(ptr)
+        graph = metis.METIS_Graph(idx_t(self.num_nodes), idx_t(self.ncon),
+                                  as_idx(self.xadj), as_idx(self.adjncy),
+                                  as_idx(self.vwgt), as_idx(self.vsize),
+                                  as_idx(self.adjwgt))
+        # keep the converted arrays alive as long as the graph
+        self._metis_arrays = arrays
+        return graph
+
+    def part_graph(self, metis, nparts, **opts):
+        """
+        Partitions this graph with METIS (see ``metis.part_graph``)
+        """
+        if (self.num_nodes == 0):
+            return (0, [])
+        return metis.part_graph(self.to_metis(metis), nparts=nparts, **opts)
+
+    @staticmethod
+    def from_drops(drop_list, multi_constraint=False):
+        """
+        Builds the (undirected) METIS input of a list of drop specs. Node
+        weights are the task weight of app drops (and 1 for data drops),
+        node sizes the data weight of data drops (and 1 for app drops), and
+        edge weights the data weight of the data drop of each edge (at least
+        1). If multi_constraint is True the node sizes are also balanced
+        """
+        n = len(drop_list)
+        key_dict = dict() # {oid : node index}
+        for i, drop in enumerate(drop_list):
+            key_dict[drop['oid']] = i
+        tw = np.ones(n, dtype=np.int64)
+        sz = np.ones(n, dtype=np.int64)
+        dw = []
+        for i, drop in enumerate(drop_list):
+            if ('plain' == drop['type']):
+                sz[i] = drop.get('dw', 1)
+            elif ('app' == drop['type']):
+                tw[i] = drop['tw']
+            dw.append(drop.get('dw', 1))
+        us = []
+        vs = []
+        for i, drop in enumerate(drop_list):
+            tt = drop['type']
+            if ('plain' == tt):
+                keys = ('consumers', 'producers')
+            elif ('app' == tt):
+                keys = ('outputs', 'inputs')
+            else:
+                continue
+            for k in keys:
+                for oid in drop.get(k, []):
+                    us.append(i)
+                    vs.append(key_dict[oid])
+        us = np.array(us, dtype=np.int64)
+        vs = np.array(vs, dtype=np.int64)
+        # the data weight of an edge comes from its data drop, which is the
+        # drop itself for data drops and the other end for app drops
+        is_plain = np.array([d['type'] == 'plain' for d in drop_list], dtype=bool)
+        dw = np.array(dw, dtype=np.int64)
+        ws = np.where(is_plain[us], dw[us], dw[vs]) if len(us) else us
+        vwgt = np.column_stack((tw, sz)) if multi_constraint else tw
+        return CSRGraph(n, us, vs, ws, vwgt=vwgt, vsize=sz, merge='last')
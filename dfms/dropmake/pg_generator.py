@@ -48,9 +48,9 @@ Examples of logical graph node JSON representation
 
 """
 
-from collections import defaultdict
 import collections
 import datetime
+import functools
 import json
 import logging
 import math
@@ -66,6 +66,7 @@ import six
 
 from dfms.dropmake.utils.bash_parameter import BashCommand
 from dfms.drop import dropdict
+from dfms.dropmake.dag import CompactDAG, CSRGraph
 from dfms.dropmake.scheduler import MySarkarScheduler, DAGUtil, MinNumPartsScheduler, PSOScheduler
 from dfms.graph_loader import STORAGE_TYPES
 
@@ -86,6 +87,25 @@ class GPGTException(GraphException):
 class GPGTNoNeedMergeException(GraphException):
     pass
 
+def _hierarchy_query(func):
+    """
+    Memoizes an LGNode hierarchy query (keyed by its name and the ids of its
+    LGNode arguments) while the hierarchy is frozen, see LG.freeze_hierarchy
+    """
+    name = func.__name__
+    @functools.wraps(func)
+    def query(self, *args):
+        cache = self._hcache
+        if (cache is None):
+            return func(self, *args)
+        key = (name,) + tuple(lgn.id for lgn in args) if args else name
+        try:
+            return cache[key]
+        except KeyError:
+            ret = cache[key] = func(self, *args)
+            return ret
+    return query
+
 class LGNode():
     def __init__(self, jd, group_q, done_dict, ssid):
         """
@@ -98,16 +118,13 @@ class LGNode():
         self._children = []
         self._outs = [] # event flow target
         self._inputs = [] # event flow source
+        self._done_dict = done_dict
+        self._hcache = None # memoized hierarchy queries while frozen
         self.group = None
         self._id = jd['key']
         self._ssid = ssid
         self._isgrp = False
         self._converted = False
-        self._h_level = None
-        self._g_h = None
-        self._dop = None
-        self._gaw = None
-        self._grpw = None
         if 'isGroup' in jd and jd['isGroup'] == True:
             self._isgrp = True
             for wn in group_q[self.id]:
@@ -144,8 +161,25 @@ class LGNode():
 
     @group.setter
     def group(self, value):
+        self.thaw_hierarchy()
         self._grp = value
 
+    def freeze_hierarchy(self):
+        """
+        Starts memoizing the hierarchy queries of this node
+        """
+        if (self._hcache is None):
+            self._hcache = dict()
+
+    def thaw_hierarchy(self):
+        """
+        Forgets the memoized hierarchy queries of all the nodes of the
+        logical graph, since they are related to each other
+        """
+        if (self._hcache is not None):
+            for lgn in self._done_dict.values():
+                lgn._hcache = None
+
     def has_group(self):
         return self.group is not None
 
@@ -168,9 +202,11 @@ class LGNode():
             return self.group.id
 
     def add_output(self, lg_node):
+        self.thaw_hierarchy()
         self._outs.append(lg_node)
 
     def add_input(self, lg_node):
+        self.thaw_hierarchy()
         self._inputs.append(lg_node)
 
     def add_child(self, lg_node):
@@ -179,6 +215,7 @@ class LGNode():
         """
         if (lg_node.is_group() and (not (lg_node.is_scatter())) and (not (lg_node.is_loop())) and (not (lg_node.is_groupby()))):
             raise GInvalidNode("Only Scatters or Loops can be nested, but {0} is not Scatter".format(lg_node.id))
+        self.thaw_hierarchy()
         self._children.append(lg_node)
 
     @property
@@ -194,30 +231,43 @@ class LGNode():
         return self._inputs
 
     @property
+    @_hierarchy_query
     def h_level(self):
-        if (self._h_level is None):
-            l = 0
-            cg = self
-            while(cg.has_group()):
-                cg = cg.group
-                l += 1
-            if (self.is_mpi()):
-                l += 1
-            self._h_level = l
-        return self._h_level
+        l = 0
+        cg = self
+        while(cg.has_group()):
+            cg = cg.group
+            l += 1
+        if (self.is_mpi()):
+            l += 1
+        return l
 
     @property
+    @_hierarchy_query
     def group_hierarchy(self):
-        if (self._g_h is None):
-            glist = []
-            cg = self
-            while(cg.has_group()):
-                glist.append(str(cg.gid))
-                cg = cg.group
-            glist.append('0')
-            self._g_h = '/'.join(reversed(glist))
-        return self._g_h
+        glist = []
+        cg = self
+        while(cg.has_group()):
+            glist.append(str(cg.gid))
+            cg = cg.group
+        glist.append('0')
+        return '/'.join(reversed(glist))
+
+    @property
+    @_hierarchy_query
+    def enclosing_groups(self):
+        """
+        The groups around this node (tuple), from the outer most one
+        """
+        chain = []
+        grp = self.group
+        while (grp is not None):
+            chain.append(grp)
+            grp = grp.group
+        chain.reverse()
+        return tuple(chain)
 
+    @_hierarchy_query
     def dop_diff(self, that_lgn):
         """
         dop difference between inner node/group and outer group
@@ -255,6 +305,7 @@ class LGNode():
         #     pass
             #raise GInvalidLink("{0} and {1} are not hierarchically related".format(self.id, that_lgn.id))
 
+    @_hierarchy_query
     def h_related(self, that_lgn):
         that_gh = that_lgn.group_hierarchy
         this_gh = self.group_hierarchy
@@ -322,6 +373,7 @@ class LGNode():
         return (self._jd['category'] == 'mpi')
 
     @property
+    @_hierarchy_query
     def group_keys(self):
         """
         Return:
@@ -342,17 +394,16 @@ class LGNode():
         return (self._jd['category'] == 'Branch')
 
     @property
+    @_hierarchy_query
     def gather_width(self):
         """
         Gather width
         """
         if (self.is_gather()):
-            if (self._gaw is None):
-                try:
-                    self._gaw = int(self.jd['num_of_inputs'])
-                except:
-                    self._gaw = 1
-            return self._gaw
+            try:
+                return int(self.jd['num_of_inputs'])
+            except:
+                return 1
         else:
             """
             TODO: use OO style to replace all type-related statements!
@@ -360,24 +411,24 @@ class LGNode():
             raise GraphException("Non-Gather LGN {0} does not have gather_width".format(self.id))
 
     @property
+    @_hierarchy_query
     def groupby_width(self):
         """
         GroupBy count
         """
         if (self.is_groupby()):
-            if (self._grpw is None):
-                tlgn = self.inputs[0]
-                re_dop = 1
-                cg = tlgn.group # exclude its own group
-                while (cg.has_group()):
-                    re_dop *= cg.group.dop
-                    cg = cg.group
-                self._grpw = re_dop
-            return self._grpw
+            tlgn = self.inputs[0]
+            re_dop = 1
+            cg = tlgn.group # exclude its own group
+            while (cg.has_group()):
+                re_dop *= cg.group.dop
+                cg = cg.group
+            return re_dop
         else:
             raise GraphException("Non-GroupBy LGN {0} does not have groupby_width".format(self.id))
 
     @property
+    @_hierarchy_query
     def group_by_scatter_layers(self):
         """
         Return:
@@ -442,41 +493,38 @@ class LGNode():
         return (ret_dop, layer_index, layers)
 
     @property
+    @_hierarchy_query
     def dop(self):
         """
         Degree of Parallelism:  integer
         default:    1
         """
-        if (self._dop is None):
-            if (self.is_group()):
-                if (self.is_scatter()):
-                    for kw in ['num_of_copies', 'num_of_splits']:
-                        if kw in self.jd:
-                            self._dop = int(self.jd[kw])
-                            break
-                    if (self._dop is None):
-                        self._dop = 4 # dummy impl.
-                elif (self.is_gather()):
-                    try:
-                        tlgn = self.inputs[0]
-                    except IndexError:
-                        raise GInvalidLink("Gather '{0}' does not have input!".format(self.id))
-                    if (tlgn.is_groupby()):
-                        tt = tlgn.dop
-                    else:
-                        tt = self.dop_diff(tlgn)
-                    self._dop = int(math.ceil(tt / float(self.gather_width)))
-                elif (self.is_groupby()):
-                    self._dop = self.group_by_scatter_layers[0]
-                elif (self.is_loop()):
-                    self._dop = self.jd.get('num_of_iter', 1)
+        if (self.is_group()):
+            if (self.is_scatter()):
+                for kw in ['num_of_copies', 'num_of_splits']:
+                    if kw in self.jd:
+                        return int(self.jd[kw])
+                return 4 # dummy impl.
+            elif (self.is_gather()):
+                try:
+                    tlgn = self.inputs[0]
+                except IndexError:
+                    raise GInvalidLink("Gather '{0}' does not have input!".format(self.id))
+                if (tlgn.is_groupby()):
+                    tt = tlgn.dop
                 else:
-                    raise GInvalidNode("Unrecognised (Group) Logical Graph Node: '{0}'".format(self._jd['category']))
-            elif (self.is_mpi()):
-                self._dop = int(self.jd['num_of_procs'])
+                    tt = self.dop_diff(tlgn)
+                return int(math.ceil(tt / float(self.gather_width)))
+            elif (self.is_groupby()):
+                return self.group_by_scatter_layers[0]
+            elif (self.is_loop()):
+                return self.jd.get('num_of_iter', 1)
             else:
-                self._dop = 1
-        return self._dop
+                raise GInvalidNode("Unrecognised (Group) Logical Graph Node: '{0}'".format(self._jd['category']))
+        elif (self.is_mpi()):
+            return int(self.jd['num_of_procs'])
+        else:
+            return 1
 
     def make_oid(self, iid=0):
         """
@@ -766,11 +814,13 @@ class PGT(object):
                 G = self.dag
             else:
                 return None
+        # the DAG may have been (partially) zeroed, so convert it as it is now
+        cdag = CompactDAG.from_nx(G)
         if (app_drop_only):
-            lp = DAGUtil.get_longest_path(G, show_path=True)[0]
+            lp = cdag.longest_path(show_path=True)[0]
             return sum(G.node[u].get(wk, 0) for u in lp)
         else:
-            return DAGUtil.get_longest_path(G, show_path=False)[1]
+            return cdag.longest_path(show_path=False)[1]
 
     @property
     def json(self):
@@ -982,10 +1032,12 @@ class MetisPGTP(PGT):
     http://glaros.dtc.umn.edu/gkhome/metis/metis/overview
     """
     def __init__(self, drop_list, num_partitions=1, min_goal=0,
-                par_label="Partition", ptype=0, ufactor=10, merge_parts=False):
+                par_label="Partition", ptype=0, ufactor=10, merge_parts=False,
+                multi_constraint=False):
         """
         num_partitions:  number of partitions supplied by users (int)
-        TODO - integrate from within PYTHON module (using C API) soon!
+        multi_constraint:   whether to balance data sizes as well as
+                            task workloads (bool)
         """
         super(MetisPGTP, self).__init__(drop_list, build_dag=False)
         self._metis_path = "gpmetis" # assuming it is installed at the sys path
@@ -1006,71 +1058,42 @@ class MetisPGTP(PGT):
 
         self._par_label = par_label
         self._u_factor = ufactor
+        self._multi_constraint = multi_constraint
         self._metis_logs = []
         self._G = self.to_partition_input()
         self._metis = DAGUtil.import_metis()
         self._group_workloads = dict() # k - gid, v - a tuple of (tw, sz)
         self._merge_parts = merge_parts
         self._metis_out = None # initial internal partition result
+        self._node_gids = None # current partition of each DROP
+
+    def __getstate__(self):
+        # the METIS library cannot be pickled
+        state = dict(self.__dict__)
+        del state['_metis']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._metis = DAGUtil.import_metis()
 
     def to_partition_input(self, outf=None):
         """
         Convert to METIS format for mapping and decomposition
         NOTE - Since METIS only supports Undirected Graph, we have to produce
         both upstream and downstream nodes to fit its input format
-        """
-        key_dict = dict() # key - oid, value - GOJS key
-        droplist = self._drop_list
-
-        G = nx.Graph()
-        G.graph['edge_weight_attr'] = 'weight'
-        G.graph['node_weight_attr'] = 'tw'
-        G.graph['node_size_attr'] = 'sz'
-
-        for i, drop in enumerate(droplist):
-            oid = drop['oid']
-            key_dict[oid] = i + 1 #METIS index starts from 1
-
-        logger.info("Metis partition input progress - dropdict is built")
 
+        The result is kept in memory as CSR arrays (see CSRGraph), which are
+        handed over to the METIS library as they are. Node i is the i-th DROP
+        """
         if (self._drop_list_len > 1e7):
             import resource
             logger.info("self._drop_list, max RSS: %.2f GB"\
             %(resource.getrusage(resource.RUSAGE_SELF)[2] / 1024.0 ** 2))
 
-        for i, drop in enumerate(droplist):
-            oid = drop['oid']
-            myk = i + 1
-            tt = drop['type']
-            if ('plain' == tt):
-                dst = 'consumers' # outbound keyword
-                ust = 'producers'
-                tw = 1 # task weight is zero for a Data DROP
-                sz = drop.get('dw', 1) # size
-            elif ('app' == tt):
-                dst = 'outputs'
-                ust = 'inputs'
-                tw = drop['tw']
-                sz = 1
-            G.add_node(myk, tw=tw, sz=sz, oid=oid)
-            adj_drops = [] #adjacent drops (all neighbours)
-            if dst in drop:
-                adj_drops += drop[dst]
-            if ust in drop:
-                adj_drops += drop[ust]
-
-            for inp in adj_drops:
-                if ('plain' == tt):
-                    lw = drop['dw']
-                elif ('app' == tt):
-                    #lw = drop_dict[inp].get('dw', 1)
-                    lw = droplist[key_dict[inp] - 1].get('dw', 1)
-                if (lw <= 0):
-                    lw = 1
-                G.add_edge(myk, key_dict[inp], weight=lw)
-        # for e in G.edges(data=True):
-        #     if (e[2]['weight'] == 0):
-        #         e[2]['weight'] = 1
+        G = CSRGraph.from_drops(self._drop_list,
+                                multi_constraint=self._multi_constraint)
+
         if (self._drop_list_len > 1e7):
             import resource
             logger.info("Max RSS after creating the Graph: %.2f GB"\
@@ -1116,20 +1139,15 @@ class MetisPGTP(PGT):
         1. parse METIS result, and add group node into the GOJS json
         2. also update edge weight for self._dag
         """
-        #key_dict = dict() #k - gojs key, v - gojs group id
-        groups = set()
         ogm = self._oid_gid_map
         group_weight = self._group_workloads# k - gid, v - a tuple of (tw, sz)
         G = self._G
-        #start_k = len(self._drop_list) + 1
         start_k = self._drop_list_len + 1
-        gnodes = G.nodes(data=True)
-        stt = time.time()
-        for i, gid in enumerate(metis_out):
-            groups.add(gid)
-            gnode = gnodes[i][1]
-            ogm[gnode['oid']] = gid
-            gnode['gid'] = gid
+        gids = np.asarray(metis_out, dtype=np.int64)
+        for drop, gid in zip(self._drop_list, metis_out):
+            ogm[drop['oid']] = gid
+        self._node_gids = gids
+        groups = set(np.unique(gids).tolist())
 
         # house keeping after partitioning
         self._num_parts_done = len(groups)
@@ -1141,13 +1159,11 @@ class MetisPGTP(PGT):
                     e[2]['weight'] = 0
 
         # the following is for potential partition merging into islands
-        if (self._merge_parts):
+        if (self._merge_parts and len(gids)):
+            tws = np.bincount(gids, weights=G.vwgt[:, 0])
+            szs = np.bincount(gids, weights=G.vsize)
             for gid in groups:
-                group_weight[gid] = [0, 0]
-            for gnode in gnodes:
-                tt = group_weight[gnode[1]['gid']]
-                tt[0] += gnode[1]['tw']
-                tt[1] += gnode[1]['sz']
+                group_weight[gid] = [int(tws[gid]), int(szs[gid])]
         # the following is for visualisation using GOJS
         if (jsobj is not None):
             node_list = jsobj['nodeDataArray']
@@ -1175,7 +1191,7 @@ class MetisPGTP(PGT):
         """
         if (self._num_parts == 1):
             edgecuts = 0
-            metis_parts = [0] * len(self._G.nodes())
+            metis_parts = [0] * self._G.num_nodes
         else:
             # prepare METIS parameters
             recursive_param = False if self._ptype == 'kway' else True
@@ -1188,8 +1204,8 @@ class MetisPGTP(PGT):
                 logger.info("RSS before METIS partitioning: %.2f GB"\
                 %(resource.getrusage(resource.RUSAGE_SELF)[2] / 1024.0 ** 2))
 
-            # Call METIS C-lib
-            (edgecuts, metis_parts) = self._metis.part_graph(self._G,
+            # Call METIS C-lib directly with the in-memory CSR arrays
+            (edgecuts, metis_parts) = self._G.part_graph(self._metis,
             nparts=self._num_parts, recursive=recursive_param,
             objtype=self._obj_type, ufactor=self._u_factor)
 
@@ -1225,50 +1241,43 @@ class MetisPGTP(PGT):
             return
 
         GG = self._G
-        part_edges = defaultdict(int) #k: from_gid + to_gid, v: sum_of_weight
-        for e in GG.edges(data=True):
-            from_gid = GG.node[e[0]]['gid']
-            to_gid = GG.node[e[1]]['gid']
-            k = '{0}**{1}'.format(from_gid, to_gid)
-            part_edges[k] += e[2]['weight']
-
+        gids = self._node_gids
         # 1. build the bi-directional graph again
-        # with each partition being a node
-        G = nx.Graph()
-        G.graph['edge_weight_attr'] = 'weight'
-        G.graph['node_weight_attr'] = 'tw'
-        G.graph['node_size_attr'] = 'sz'
-        for gid, v in self._group_workloads.items():
+        # with each partition being a node, and the weight of each link
+        # being the sum of the edges between the two partitions
+        part_ids = sorted(self._group_workloads.keys())
+        part_idx = np.zeros(max(part_ids) + 1, dtype=np.int64)
+        part_idx[part_ids] = np.arange(len(part_ids))
+        tw = []
+        sz = []
+        for gid in part_ids:
+            v = self._group_workloads[gid]
             # for compute islands, we need to count the # of nodes instead of
             # the actual workload
-            twv = 1 if (island_type == 1) else v[0]
-            G.add_node(gid, tw=twv, sz=v[1])
-        for glinks, v in part_edges.items():
-            gl = glinks.split('**')
-            G.add_edge(int(gl[0]), int(gl[1]), weight=v)
+            tw.append(1 if (island_type == 1) else v[0])
+            sz.append(v[1])
+        G = CSRGraph(len(part_ids), part_idx[gids[GG.edge_u]],
+                     part_idx[gids[GG.edge_v]], GG.edge_weight,
+                     vwgt=tw, vsize=sz, merge='sum')
 
         if (new_num_parts == 1):
-            (edgecuts, metis_parts) = (0, [0] * len(G.nodes()))
+            (edgecuts, metis_parts) = (0, [0] * G.num_nodes)
         else:
-            (edgecuts, metis_parts) = self._metis.part_graph(G,
-                                            nparts=new_num_parts,
-                                            ufactor=1)
+            (edgecuts, metis_parts) = G.part_graph(self._metis,
+                                                   nparts=new_num_parts,
+                                                   ufactor=1)
         tmp_map = self._gid_island_id_map
         islands = set()
         for i, island_id in enumerate(metis_parts):
-            gid = G.nodes()[i]
+            gid = part_ids[i]
             tmp_map[gid] = island_id
             islands.add(island_id)
         if (not form_island):
             ogm = self._oid_gid_map
-            gnodes = GG.nodes(data=True)
-            for gnode in gnodes:
-                gnode = gnode[1]
-                oid = gnode['oid']
-                old_gid = gnode['gid']
-                new_gid = tmp_map[old_gid]
-                ogm[oid] = new_gid
-                gnode['gid'] = new_gid
+            new_gids = np.asarray(metis_parts, dtype=np.int64)[part_idx[gids]]
+            for drop, new_gid in zip(self._drop_list, new_gids.tolist()):
+                ogm[drop['oid']] = new_gid
+            self._node_gids = new_gids
             self._num_parts_done = new_num_parts
         else:
             if (island_type == 1 and
@@ -1519,13 +1528,16 @@ class MinNumPartsPGTP(MySarkarPGTP):
 
 class PSOPGTP(MySarkarPGTP):
     def __init__(self, drop_list, par_label="Partition", max_dop=8,
-    deadline=None, topk=30, swarm_size=40, merge_parts=False):
+    deadline=None, topk=30, swarm_size=40, merge_parts=False,
+    num_starts=1, num_workers=1):
         """
         PSO-based PGTP
         """
         self._deadline = deadline
         self._topk = topk
         self._swarm_size = swarm_size
+        self._num_starts = num_starts
+        self._num_workers = num_workers
         super(PSOPGTP, self).__init__(drop_list, 0, par_label, max_dop, merge_parts)
         self._extra_drops = None
 
@@ -1534,7 +1546,104 @@ class PSOPGTP(MySarkarPGTP):
 
     def init_scheduler(self):
         self._scheduler = PSOScheduler(self._drop_list, max_dop=self._max_dop,
-        deadline=self._deadline, dag=self.dag, topk=self._topk, swarm_size=self._swarm_size)
+        deadline=self._deadline, dag=self.dag, topk=self._topk, swarm_size=self._swarm_size,
+        num_starts=self._num_starts, num_workers=self._num_workers)
+
+class LinkRule(object):
+    """
+    How the instances of the two ends of a logical link are linked, given
+    as pairs of (source, target) instance indexes (see LG.instance_shape):
+
+        NONE    - no pairs
+        MAP     - source i is linked to target i // width
+        SPREAD  - target j is linked to source j // width
+        RELAY   - source i is linked to target i + 1, unless i is the last
+                  of a chunk of width instances (i.e. the last Loop iteration)
+        PAIRS   - an explicit list of pairs
+
+    gather_data: the source is the data drop of a Gather (rather than the
+    Gather drop itself)
+    """
+    NONE = 'none'
+    MAP = 'map'
+    SPREAD = 'spread'
+    RELAY = 'relay'
+    PAIRS = 'pairs'
+
+    def __init__(self, num_src, num_tgt, kind, width=1, pairs=None, gather_data=False):
+        self.num_src = num_src
+        self.num_tgt = num_tgt
+        self.kind = kind
+        self.width = width
+        self.pairs = pairs
+        self.gather_data = gather_data
+        self._src_dict = None
+        self._tgt_dict = None
+
+    def _check_tgt(self, j):
+        if (j >= self.num_tgt):
+            raise GraphException("Target instance {0} out of range ({1})".format(j, self.num_tgt))
+        return j
+
+    def __iter__(self):
+        """
+        Yields the (source, target) pairs, in linking order
+        """
+        kind = self.kind
+        w = self.width
+        if (kind == LinkRule.MAP):
+            for i in range(self.num_src):
+                yield i, self._check_tgt(i // w)
+        elif (kind == LinkRule.SPREAD):
+            for j in range(self.num_tgt):
+                yield j // w, j
+        elif (kind == LinkRule.RELAY):
+            for i in range(self.num_src):
+                if (i % w < w - 1):
+                    yield i, self._check_tgt(i + 1)
+        elif (kind == LinkRule.PAIRS):
+            for pair in self.pairs:
+                yield pair
+
+    def targets(self, i):
+        """
+        The target instances linked to source instance i
+        """
+        kind = self.kind
+        w = self.width
+        if (kind == LinkRule.MAP):
+            return [self._check_tgt(i // w)]
+        elif (kind == LinkRule.SPREAD):
+            return list(range(i * w, min((i + 1) * w, self.num_tgt)))
+        elif (kind == LinkRule.RELAY):
+            return [self._check_tgt(i + 1)] if (i % w < w - 1) else []
+        elif (kind == LinkRule.PAIRS):
+            if (self._src_dict is None):
+                self._src_dict = collections.defaultdict(list)
+                for si, tj in self.pairs:
+                    self._src_dict[si].append(tj)
+            return self._src_dict.get(i, [])
+        return []
+
+    def sources(self, j):
+        """
+        The source instances linked to target instance j
+        """
+        kind = self.kind
+        w = self.width
+        if (kind == LinkRule.MAP):
+            return list(range(j * w, min((j + 1) * w, self.num_src)))
+        elif (kind == LinkRule.SPREAD):
+            return [j // w]
+        elif (kind == LinkRule.RELAY):
+            return [j - 1] if (j > 0 and (j - 1) % w < w - 1) else []
+        elif (kind == LinkRule.PAIRS):
+            if (self._tgt_dict is None):
+                self._tgt_dict = collections.defaultdict(list)
+                for si, tj in self.pairs:
+                    self._tgt_dict[tj].append(si)
+            return self._tgt_dict.get(j, [])
+        return []
 
 class LG():
     """
@@ -1587,6 +1696,7 @@ class LG():
         # key - lgn id, val - a list of pgns associated with this lgn
         self._drop_dict = collections.defaultdict(list)
         self._lgn_list = all_list
+        self._grp_links_added = set() # ids of groups whose links were added
 
     def validate_link(self, src, tgt):
         if (src.is_scatter() or tgt.is_scatter()):
@@ -1662,105 +1772,241 @@ class LG():
         lpcxt:  Loop context
         """
         if (lgn.is_group()):
-            extra_links_drops = (not lgn.is_scatter())
-            if (extra_links_drops):
-                non_inputs = []
-                grp_starts = []
-                grp_ends = []
+            self._add_group_links(lgn)
+            make_drops = not (lgn.is_scatter() or lgn.is_loop())
+            for miid, child_lpcxt in self._iter_group_instances(lgn, iid, lpcxt):
+                if (make_drops): # make GroupBy and Gather drops
+                    self._add_drops(lgn, self._make_group_drop(lgn, miid))
                 for child in lgn.children:
-                    if (len(child.inputs) == 0):
-                        non_inputs.append(child)
-                    if (child.is_group_start()):
-                        grp_starts.append(child)
-                    elif (child.is_group_end()):
-                        grp_ends.append(child)
-                if (len(grp_starts) == 0):
-                    gs_list = non_inputs
-                else:
-                    gs_list = grp_starts
-                if (lgn.is_loop()):
-                    if (len(grp_starts) == 0 or len(grp_ends) == 0):
-                        raise GInvalidNode("Loop '{0}' should have at least one Start Component and one End Data".format(lgn.text))
-                    for ge in grp_ends:
-                        for gs in grp_starts: # make an artificial circle
-                            ge.add_output(gs)
-                            gs.add_input(ge)
-                            lk = dict()
-                            lk['from'] = ge.id
-                            lk['to'] = gs.id
-                            self._lg_links.append(lk)
-                else:
-                    for gs in gs_list: # add artificial logical links to the "first" children
-                        lgn.add_input(gs)
-                        gs.add_output(lgn)
-                        lk = dict()
-                        lk['from'] = lgn.id
-                        lk['to'] = gs.id
-                        self._lg_links.append(lk)
-
-            multikey_grpby = False
-            lgk = lgn.group_keys
-            if (lgk is not None and len(lgk) > 1):
-                multikey_grpby = True
-                scatters = lgn.group_by_scatter_layers[2] # inner most scatter to outer most scatter
-                shape = [x.dop for x in scatters] # inner most is also the slowest running index
-
-            lgn_is_loop = lgn.is_loop()
-            def get_child_lp_ctx(idx):
-                if (lgn_is_loop):
-                    if (lpcxt is None):
-                        return '{0}'.format(idx)
-                    else:
-                        return '{0}/{1}'.format(lpcxt, idx)
-                else:
-                    return None
+                    self.lgn_to_pgn(child, miid, child_lpcxt)
+        else:
+            self._add_drops(lgn, self._make_drops(lgn, iid, lpcxt))
 
-            for i in range(lgn.dop):
-                miid = '{0}/{1}'.format(iid, i)
-                if (multikey_grpby):
-                    #set up more refined hierarchical context for group by with multiple keys
-                    # recover multl-dimension indexes from i
-                    grp_h = np.unravel_index(i, shape)
-                    grp_h = [str(x) for x in grp_h]
-                    miid += "${0}".format('-'.join(grp_h))
-
-                if (extra_links_drops and not lgn.is_loop()): # make GroupBy and Gather drops
-                    src_gdrop = lgn.make_single_drop(miid)
-                    self._drop_dict[lgn.id].append(src_gdrop)
-                    if (lgn.is_groupby()):
-                        self._drop_dict['new_added'].append(src_gdrop['grp-data_drop'])
-                    elif (lgn.is_gather()):
-                        self._drop_dict['new_added'].append(src_gdrop['gather-data_drop'])
+    def _add_drops(self, lgn, new_drops):
+        for src_drop, extra_drop in new_drops:
+            self._drop_dict[lgn.id].append(src_drop)
+            if (extra_drop is not None):
+                self._drop_dict['new_added'].append(extra_drop)
+
+    def _add_group_links(self, lgn):
+        """
+        add the artificial logical links of a group (other than Scatter),
+        i.e. from the group to its "first" children, or from the end to the
+        start children of a Loop. This is done only once per group
+        """
+        if (lgn.is_scatter() or lgn.id in self._grp_links_added):
+            return
+        self._grp_links_added.add(lgn.id)
+        non_inputs = []
+        grp_starts = []
+        grp_ends = []
+        for child in lgn.children:
+            if (len(child.inputs) == 0):
+                non_inputs.append(child)
+            if (child.is_group_start()):
+                grp_starts.append(child)
+            elif (child.is_group_end()):
+                grp_ends.append(child)
+        if (len(grp_starts) == 0):
+            gs_list = non_inputs
+        else:
+            gs_list = grp_starts
+        if (lgn.is_loop()):
+            if (len(grp_starts) == 0 or len(grp_ends) == 0):
+                raise GInvalidNode("Loop '{0}' should have at least one Start Component and one End Data".format(lgn.text))
+            for ge in grp_ends:
+                for gs in grp_starts: # make an artificial circle
+                    ge.add_output(gs)
+                    gs.add_input(ge)
+                    lk = dict()
+                    lk['from'] = ge.id
+                    lk['to'] = gs.id
+                    self._lg_links.append(lk)
+        else:
+            for gs in gs_list: # add artificial logical links to the "first" children
+                lgn.add_input(gs)
+                gs.add_output(lgn)
+                lk = dict()
+                lk['from'] = lgn.id
+                lk['to'] = gs.id
+                self._lg_links.append(lk)
+
+    def freeze_hierarchy(self):
+        """
+        Computes the hierarchy queries (h_level, dop, gather_width, etc.) of
+        all the logical graph nodes, which are then memoized until the
+        logical graph is mutated (e.g. when a link is added)
+        """
+        for lgn in self._done_dict.values():
+            lgn.freeze_hierarchy()
+        for lgn in self._done_dict.values():
+            lgn.h_level, lgn.group_hierarchy, lgn.enclosing_groups, lgn.dop
+            if (lgn.is_gather()):
+                lgn.gather_width
+            elif (lgn.is_groupby()):
+                lgn.group_keys, lgn.groupby_width, lgn.group_by_scatter_layers
+
+    def _prepare_unroll(self):
+        """
+        Adds the artificial links of all the groups and freezes the hierarchy
+        of the logical graph, so it is not walked over and over again while
+        unrolling. Returns all the nodes lgn_to_pgn would visit
+        """
+        lgn_list = []
+        def add_lgn(lgn):
+            lgn_list.append(lgn)
+            if (lgn.is_group()):
                 for child in lgn.children:
-                    self.lgn_to_pgn(child, miid, get_child_lp_ctx(i))
-        elif (lgn.is_mpi()):
+                    add_lgn(child)
+        for lgn in self._start_list:
+            add_lgn(lgn)
+
+        for lgn in lgn_list:
+            if (lgn.is_group()):
+                self._add_group_links(lgn)
+        self.freeze_hierarchy()
+        return lgn_list
+
+    def _group_instance(self, lgn, iid, lpcxt, i):
+        """
+        Returns the instance id and the Loop context of the children of the
+        i-th instance of group lgn
+        """
+        miid = '{0}/{1}'.format(iid, i)
+        lgk = lgn.group_keys
+        if (lgk is not None and len(lgk) > 1):
+            #set up more refined hierarchical context for group by with multiple keys
+            # recover multl-dimension indexes from i
+            scatters = lgn.group_by_scatter_layers[2] # inner most scatter to outer most scatter
+            shape = [x.dop for x in scatters] # inner most is also the slowest running index
+            grp_h = np.unravel_index(i, shape)
+            grp_h = [str(x) for x in grp_h]
+            miid += "${0}".format('-'.join(grp_h))
+        if (lgn.is_loop()):
+            if (lpcxt is None):
+                child_lpcxt = '{0}'.format(i)
+            else:
+                child_lpcxt = '{0}/{1}'.format(lpcxt, i)
+        else:
+            child_lpcxt = None
+        return miid, child_lpcxt
+
+    def _iter_group_instances(self, lgn, iid, lpcxt):
+        """
+        Yields the instance id and the Loop context of the children of each
+        of the lgn.dop instances of group lgn
+        """
+        for i in range(lgn.dop):
+            yield self._group_instance(lgn, iid, lpcxt, i)
+
+    def _make_group_drop(self, lgn, miid):
+        """
+        Returns the (GroupBy or Gather) drop of one group instance together
+        with its embedded data drop
+        """
+        src_gdrop = lgn.make_single_drop(miid)
+        if (lgn.is_groupby()):
+            return [(src_gdrop, src_gdrop['grp-data_drop'])]
+        elif (lgn.is_gather()):
+            return [(src_gdrop, src_gdrop['gather-data_drop'])]
+        return [(src_gdrop, None)]
+
+    def _make_drops(self, lgn, iid, lpcxt):
+        """
+        Returns the drops of non-group lgn for one instance of its enclosing
+        groups, each with its embedded extra drop (or None)
+        """
+        if (lgn.is_mpi()):
+            ret = []
             for i in range(lgn.dop):
                 miid = '{0}/{1}'.format(iid, i)
                 src_drop = lgn.make_single_drop(miid, loop_cxt=lpcxt, proc_index=i)
-                self._drop_dict[lgn.id].append(src_drop)
-        else:
-            #TODO !!
-            src_drop = lgn.make_single_drop(iid, loop_cxt=lpcxt)
-            self._drop_dict[lgn.id].append(src_drop)
-            if (lgn.is_branch()):
-                self._drop_dict['new_added'].append(src_drop['null_drop'])
-            elif (lgn.is_start_listener()):
-                self._drop_dict['new_added'].append(src_drop['listener_drop'])
+                ret.append((src_drop, None))
+            return ret
+        #TODO !!
+        src_drop = lgn.make_single_drop(iid, loop_cxt=lpcxt)
+        if (lgn.is_branch()):
+            return [(src_drop, src_drop['null_drop'])]
+        elif (lgn.is_start_listener()):
+            return [(src_drop, src_drop['listener_drop'])]
+        return [(src_drop, None)]
 
-    def _split_list(self, l, n):
+    def _make_lgn_drops(self, lgn):
         """
-        Yield successive n-sized chunks from l.
+        Returns all the drops of a single lgn (and their extra drops), i.e.
+        what lgn_to_pgn would produce for it, without touching other nodes
         """
-        for i in range(0, len(l), n):
-            yield l[i:i+n]
+        chain = lgn.enclosing_groups
+        ret = []
+        def visit(level, iid, lpcxt):
+            if (level < len(chain)):
+                for miid, child_lpcxt in self._iter_group_instances(chain[level], iid, lpcxt):
+                    visit(level + 1, miid, child_lpcxt)
+            elif (lgn.is_group()):
+                for miid, _ in self._iter_group_instances(lgn, iid, lpcxt):
+                    ret.extend(self._make_group_drop(lgn, miid))
+            else:
+                ret.extend(self._make_drops(lgn, iid, lpcxt))
+        if (not (lgn.is_scatter() or lgn.is_loop())):
+            visit(0, '0', None)
+        return ret
 
-    def _unroll_gather_as_output(self, slgn, tlgn, sdrops, tdrops, chunk_size):
-        if (slgn.h_level < tlgn.h_level):
-            raise GraphException("Gather {0} has higher h-level than its input {1}".format(tlgn.id, slgn.id))
-        # src must be data
-        for i, chunk in enumerate(self._split_list(sdrops, chunk_size)):
-            for sdrop in chunk:
-                self._link_drops(slgn, tlgn, sdrop, tdrops[i])
+    def _enclosing_groups(self, lgn):
+        """
+        The groups around lgn, from the outer most one
+        """
+        return lgn.enclosing_groups
+
+    def instance_shape(self, lgn):
+        """
+        The shape of the index space of the instances of lgn, i.e. the dop of
+        each of its enclosing groups (and of lgn itself for GroupBy, Gather
+        and MPI). Instance k of lgn makes the k-th (in row-major order) of
+        the drops lgn_to_pgn makes for lgn. Returns None if lgn makes no drop
+        """
+        if (lgn.is_scatter() or lgn.is_loop()):
+            return None
+        shape = [grp.dop for grp in self._enclosing_groups(lgn)]
+        if (lgn.is_group() or lgn.is_mpi()):
+            shape.append(lgn.dop)
+        return tuple(shape)
+
+    def num_instances(self, lgn):
+        shape = self.instance_shape(lgn)
+        if (shape is None):
+            return 0
+        return int(np.prod(shape, dtype=np.int64))
+
+    def _instance_context(self, lgn, k):
+        """
+        Returns the iid and the Loop context of the drop of instance k of lgn
+        """
+        chain = self._enclosing_groups(lgn)
+        idx = np.unravel_index(k, self.instance_shape(lgn)) if chain else [k]
+        iid = '0'
+        lpcxt = None
+        for grp, i in zip(chain, idx):
+            iid, lpcxt = self._group_instance(grp, iid, lpcxt, i)
+        if (lgn.is_group()):
+            iid, _ = self._group_instance(lgn, iid, lpcxt, idx[-1])
+            lpcxt = None
+        elif (lgn.is_mpi()):
+            iid = '{0}/{1}'.format(iid, idx[-1])
+        return iid, lpcxt
+
+    def make_instance_drops(self, lgn, k):
+        """
+        Returns the drops of instance k of lgn, each with its embedded extra
+        drop (or None)
+        """
+        iid, lpcxt = self._instance_context(lgn, k)
+        if (lgn.is_group()):
+            return self._make_group_drop(lgn, iid)
+        elif (lgn.is_mpi()):
+            proc_index = int(iid.rsplit('/', 1)[1])
+            src_drop = lgn.make_single_drop(iid, loop_cxt=lpcxt, proc_index=proc_index)
+            return [(src_drop, None)]
+        return self._make_drops(lgn, iid, lpcxt)
 
     def _get_chunk_size(self, s, t):
         """
@@ -1775,6 +2021,136 @@ class LG():
             ret = s.dop_diff(t)
         return ret
 
+    def link_rule(self, slgn, tlgn):
+        """
+        Returns the LinkRule that links the instances of slgn to those of
+        tlgn along the logical link between them
+        """
+        sid = slgn.id
+        num_src = self.num_instances(slgn)
+        num_tgt = self.num_instances(tlgn)
+        chunk_size = self._get_chunk_size(slgn, tlgn)
+        if (slgn.is_group() and (not tlgn.is_group())):
+            # this link must be artifically added (within group link)
+            # since
+            # 1. GroupBy's "natual" output must be a Scatter (i.e. group)
+            # 2. Scatter "naturally" does not have output
+            if (slgn.is_gather() and tlgn.gid != sid): # not the artifical link between gather and its own start child
+                # gather iteration case, tgt must be a Group-Start Component
+                pairs = []
+                for i in range(num_src):
+                    j = (i + 1) * slgn.gather_width
+                    if (j >= tlgn.group.dop and j % tlgn.group.dop == 0):
+                        continue
+                    while (j < (i + 2) * slgn.gather_width and j < tlgn.group.dop * (i + 1)):
+                        pairs.append((i, j))
+                        j += 1
+                # the gather data drop is the "true" source drop
+                return LinkRule(num_src, num_tgt, LinkRule.PAIRS, pairs=pairs,
+                                gather_data=True)
+            else:
+                if (num_src != num_tgt):
+                    err_info = "For within-group links, # {2} Group Inputs {0} must be the same as # {3} of Component Outputs {1}".format(slgn.id,
+                    tlgn.id, num_src, num_tgt)
+                    raise GraphException(err_info)
+                return LinkRule(num_src, num_tgt, LinkRule.MAP)
+        elif (slgn.is_group() and tlgn.is_group()):
+            # slgn must be GroupBy and tlgn must be Gather
+            return self._gather_as_output_rule(slgn, tlgn, num_src, num_tgt, chunk_size)
+        elif (not slgn.is_group() and (not tlgn.is_group())):
+            if (slgn.is_start_node() or tlgn.is_end_node()):
+                return LinkRule(num_src, num_tgt, LinkRule.NONE)
+            elif ((slgn.group is not None) and slgn.group.is_loop() and slgn.gid == tlgn.gid and slgn.is_group_end() and tlgn.is_group_start()):
+                # Re-link to the next iteration's start
+                if (num_src != num_tgt):
+                    raise GraphException("# of sdrops '{0}' != # of tdrops '{1}'for Loop '{2}'".format(slgn.text,
+                    tlgn.text, slgn.group.text))
+                # first add the outer construct (scatter, gather, group-by) boundary
+                # oc = slgn.group.group
+                # if (oc is not None and (not oc.is_loop())):
+                #     pass
+                return LinkRule(num_src, num_tgt, LinkRule.RELAY,
+                                width=slgn.group.dop)
+            elif (slgn.group is not None and slgn.group.is_loop() and
+            tlgn.group is not None and tlgn.group.is_loop() and (not slgn.h_related(tlgn))):
+                # stepwise locking for links between two Loops
+                tgt_cxts = collections.defaultdict(list)
+                for j in range(num_tgt):
+                    tgt_cxts[self._instance_context(tlgn, j)[1]].append(j)
+                pairs = []
+                for i in range(num_src):
+                    for j in tgt_cxts.get(self._instance_context(slgn, i)[1], []):
+                        pairs.append((i, j))
+                return LinkRule(num_src, num_tgt, LinkRule.PAIRS, pairs=pairs)
+            else:
+                if (slgn.h_level >= tlgn.h_level):
+                    # distribute slgn evenly to tlgn
+                    return LinkRule(num_src, num_tgt, LinkRule.MAP, width=chunk_size)
+                else:
+                    # distribute tlgn evenly to slgn
+                    return LinkRule(num_src, num_tgt, LinkRule.SPREAD, width=chunk_size)
+        else: # slgn is not group, but tlgn is group
+            if (tlgn.is_groupby()):
+                grpby_dict = collections.defaultdict(list)
+                layer_index = tlgn.group_by_scatter_layers[1]
+                for i in range(num_src):
+                    gdd_iid = self._instance_context(slgn, i)[0]
+                    src_ctx = gdd_iid.split('/')
+                    if (tlgn.group_keys is None):
+                        # the last bit of iid (current h id) is the local GrougBy key, i.e. inner most loop context id
+                        gby = src_ctx[-1]
+                        if (slgn.h_level - 2 == tlgn.h_level and tlgn.h_level > 0): #groupby itself is nested inside a scatter
+                        # group key consists of group context id + inner most loop context id
+                            gctx = '/'.join(src_ctx[0:-2])
+                            gby = gctx + '/' + gby
+                    else:
+                        # find the "group by" scatter level
+                        gbylist = []
+                        if (slgn.group.is_groupby()): # a chain of group bys
+                            try:
+                                src_ctx = gdd_iid.split('$')[1].split('-')
+                            except IndexError:
+                                raise GraphException("The group by hiearchy in the multi-key group by '{0}' is not specified for node '{1}'".format(slgn.group.text, slgn.text))
+                        else:
+                            src_ctx.reverse()
+                        for lid in layer_index:
+                            gbylist.append(src_ctx[lid])
+                        gby = '/'.join(gbylist)
+                    grpby_dict[gby].append(i)
+                grp_keys = grpby_dict.keys()
+                if (len(grp_keys) != num_tgt):
+                    # this happens when groupby itself is nested inside a scatter
+                    raise GraphException("# of Group keys {0} != # of Group Drops {1} for LGN {2}".format(len(grp_keys),
+                    num_tgt,
+                    tlgn.id))
+                grp_keys = sorted(grp_keys)
+                pairs = []
+                for j, gk in enumerate(grp_keys):
+                    for i in grpby_dict[gk]:
+                        pairs.append((i, j))
+                return LinkRule(num_src, num_tgt, LinkRule.PAIRS, pairs=pairs)
+            elif (tlgn.is_gather()):
+                return self._gather_as_output_rule(slgn, tlgn, num_src, num_tgt, chunk_size)
+            else:
+                raise GraphException("Unsupported target group {0}".format(tlgn.id))
+
+    def _gather_as_output_rule(self, slgn, tlgn, num_src, num_tgt, chunk_size):
+        if (slgn.h_level < tlgn.h_level):
+            raise GraphException("Gather {0} has higher h-level than its input {1}".format(tlgn.id, slgn.id))
+        # src must be data
+        return LinkRule(num_src, num_tgt, LinkRule.MAP, width=chunk_size)
+
+    def link_instances(self, slgn, tlgn, rule, src_drop, tgt_drop):
+        """
+        Links the drops of a source and a target instance paired by rule
+        """
+        if (rule.gather_data):
+            gddrop = src_drop['gather-data_drop'] # this is the "true" target (not source!) drop
+            gddrop.addConsumer(tgt_drop)
+            tgt_drop.addInput(gddrop)
+        else:
+            self._link_drops(slgn, tlgn, src_drop, tgt_drop)
+
     def _link_drops(self, slgn, tlgn, src_drop, tgt_drop):
         """
         """
@@ -1804,6 +2180,41 @@ class LG():
                 bc = tgt_drop['command']
                 bc.add_input_param(slgn.id, src_drop['oid'])
 
+    def _unroll_link(self, lk):
+        """
+        Links the drops of the two ends of logical link lk
+        """
+        slgn = self._done_dict[lk['from']] # source
+        tlgn = self._done_dict[lk['to']] # target
+        sdrops = self._drop_dict[slgn.id]
+        tdrops = self._drop_dict[tlgn.id]
+        rule = self.link_rule(slgn, tlgn)
+        for i, j in rule:
+            self.link_instances(slgn, tlgn, rule, sdrops[i], tdrops[j])
+
+    def _cleanup_drops(self, lgn, drops):
+        """
+        clean up the extra drops embedded in the drops of lgn
+        """
+        if (lgn.is_branch()):
+            extra = 'null_drop'
+        elif (lgn.is_start_listener()):
+            extra = 'listener_drop'
+        elif (lgn.is_groupby()):
+            extra = 'grp-data_drop'
+        elif (lgn.is_gather()):
+            extra = 'gather-data_drop'
+        else:
+            return
+        for drop in drops:
+            if extra in drop:
+                del drop[extra]
+
+    def _finalise_drop(self, drop):
+        if drop['type'] == 'app' and drop['app'].endswith('BashShellApp'):
+            bc = drop['command']
+            drop['command'] = bc.to_real_command()
+
     def unroll_to_tpl(self):
         """
         Not thread-safe!
@@ -1811,6 +2222,8 @@ class LG():
         1. just create pgn anyway
         2. sort out the links
         """
+        self._prepare_unroll()
+
         # each pg node needs to be taggged with iid
         # based purely on its h-level
         for lgn in self._start_list:
@@ -1819,129 +2232,7 @@ class LG():
         logger.info("Unroll progress - lgn_to_pgn done {0} for session {1}".format(len(self._start_list), self._session_id))
 
         for lk in self._lg_links:
-            sid = lk['from'] # source
-            tid = lk['to'] # target
-            slgn = self._done_dict[sid]
-            tlgn = self._done_dict[tid]
-            sdrops = self._drop_dict[sid]
-            tdrops = self._drop_dict[tid]
-            chunk_size = self._get_chunk_size(slgn, tlgn)
-            if (slgn.is_group() and (not tlgn.is_group())):
-                # this link must be artifically added (within group link)
-                # since
-                # 1. GroupBy's "natual" output must be a Scatter (i.e. group)
-                # 2. Scatter "naturally" does not have output
-                if (slgn.is_gather() and tlgn.gid != sid): # not the artifical link between gather and its own start child
-                    # gather iteration case, tgt must be a Group-Start Component
-                    for i, ga_drop in enumerate(sdrops):
-                        j = (i + 1) * slgn.gather_width
-                        if (j >= tlgn.group.dop and j % tlgn.group.dop == 0):
-                            continue
-                        while (j < (i + 2) * slgn.gather_width and j < tlgn.group.dop * (i + 1)):
-                            if 'gather-data_drop' in ga_drop:
-                                gddrop = ga_drop['gather-data_drop'] # this is the "true" target (not source!) drop
-                                gddrop.addConsumer(tdrops[j])
-                                tdrops[j].addInput(gddrop)
-                                j += 1
-                else:
-                    if (len(sdrops) != len(tdrops)):
-                        err_info = "For within-group links, # {2} Group Inputs {0} must be the same as # {3} of Component Outputs {1}".format(slgn.id,
-                        tlgn.id, len(sdrops), len(tdrops))
-                        raise GraphException(err_info)
-                    for i, sdrop in enumerate(sdrops):
-                        self._link_drops(slgn, tlgn, sdrop, tdrops[i])
-            elif (slgn.is_group() and tlgn.is_group()):
-                # slgn must be GroupBy and tlgn must be Gather
-                self._unroll_gather_as_output(slgn, tlgn, sdrops, tdrops, chunk_size)
-            elif (not slgn.is_group() and (not tlgn.is_group())):
-                if (slgn.is_start_node() or tlgn.is_end_node()):
-                    continue
-                elif ((slgn.group is not None) and slgn.group.is_loop() and slgn.gid == tlgn.gid and slgn.is_group_end() and tlgn.is_group_start()):
-                    # Re-link to the next iteration's start
-                    lsd = len(sdrops)
-                    if (lsd != len(tdrops)):
-                        raise GraphException("# of sdrops '{0}' != # of tdrops '{1}'for Loop '{2}'".format(slgn.text,
-                        tlgn.text, slgn.group.text))
-                    # first add the outer construct (scatter, gather, group-by) boundary
-                    # oc = slgn.group.group
-                    # if (oc is not None and (not oc.is_loop())):
-                    #     pass
-                    loop_chunk_size = slgn.group.dop
-                    for i, chunk in enumerate(self._split_list(sdrops, loop_chunk_size)):
-                        #logger.debug("{0} ** {1}".format(i, loop_chunk_size))
-                        for j, sdrop in enumerate(chunk):
-                            #logger.debug("{0} -- {1}".format(j, loop_chunk_size))
-                            if (j < loop_chunk_size - 1):
-                                self._link_drops(slgn, tlgn, sdrop, tdrops[i * loop_chunk_size + j + 1])
-                                #logger.debug("{0} --> {1}".format(i * loop_chunk_size + j, i * loop_chunk_size + j + 1))
-
-                    # for i, sdrop in enumerate(sdrops):
-                    #     if (i < lsd - 1):
-                    #         self._link_drops(slgn, tlgn, sdrop, tdrops[i + 1])
-                elif (slgn.group is not None and slgn.group.is_loop() and
-                tlgn.group is not None and tlgn.group.is_loop() and (not slgn.h_related(tlgn))):
-                    # stepwise locking for links between two Loops
-                    for sdrop, tdrop in product(sdrops, tdrops):
-                        if (sdrop['loop_cxt'] == tdrop['loop_cxt']):
-                            self._link_drops(slgn, tlgn, sdrop, tdrop)
-                else:
-                    if (slgn.h_level >= tlgn.h_level):
-                        for i, chunk in enumerate(self._split_list(sdrops, chunk_size)):
-                            # distribute slgn evenly to tlgn
-                            for sdrop in chunk:
-                                self._link_drops(slgn, tlgn, sdrop, tdrops[i])
-                    else:
-                        for i, chunk in enumerate(self._split_list(tdrops, chunk_size)):
-                            # distribute tlgn evenly to slgn
-                            for tdrop in chunk:
-                                self._link_drops(slgn, tlgn, sdrops[i], tdrop)
-            else: # slgn is not group, but tlgn is group
-                if (tlgn.is_groupby()):
-                    grpby_dict = collections.defaultdict(list)
-                    layer_index = tlgn.group_by_scatter_layers[1]
-                    for gdd in sdrops:
-                        src_ctx = gdd['iid'].split('/')
-                        if (tlgn.group_keys is None):
-                            # the last bit of iid (current h id) is the local GrougBy key, i.e. inner most loop context id
-                            gby = src_ctx[-1]
-                            if (slgn.h_level - 2 == tlgn.h_level and tlgn.h_level > 0): #groupby itself is nested inside a scatter
-                            # group key consists of group context id + inner most loop context id
-                                gctx = '/'.join(src_ctx[0:-2])
-                                gby = gctx + '/' + gby
-                        else:
-                            # find the "group by" scatter level
-                            gbylist = []
-                            if (slgn.group.is_groupby()): # a chain of group bys
-                                try:
-                                    src_ctx = gdd['iid'].split('$')[1].split('-')
-                                except IndexError:
-                                    raise GraphException("The group by hiearchy in the multi-key group by '{0}' is not specified for node '{1}'".format(slgn.group.text, slgn.text))
-                            else:
-                                src_ctx.reverse()
-                            for lid in layer_index:
-                                gbylist.append(src_ctx[lid])
-                            gby = '/'.join(gbylist)
-                        grpby_dict[gby].append(gdd)
-                    grp_keys = grpby_dict.keys()
-                    if (len(grp_keys) != len(tdrops)):
-                        # this happens when groupby itself is nested inside a scatter
-                        raise GraphException("# of Group keys {0} != # of Group Drops {1} for LGN {2}".format(len(grp_keys),
-                        len(tdrops),
-                        tlgn.id))
-                    grp_keys = sorted(grp_keys)
-                    for i, gk in enumerate(grp_keys):
-                        grpby_drop = tdrops[i]
-                        drop_list = grpby_dict[gk]
-                        for drp in drop_list:
-                            self._link_drops(slgn, tlgn, drp, grpby_drop)
-                            """
-                            drp.addOutput(grpby_drop)
-                            grpby_drop.addInput(drp)
-                            """
-                elif (tlgn.is_gather()):
-                    self._unroll_gather_as_output(slgn, tlgn, sdrops, tdrops, chunk_size)
-                else:
-                    raise GraphException("Unsupported target group {0}".format(tlgn.id))
+            self._unroll_link(lk)
 
         logger.info("Unroll progress - links done {0} for session {1}".format(len(self._lg_links), self._session_id))
 
@@ -1949,22 +2240,8 @@ class LG():
         for lid, lgn in self._done_dict.items():
             if ((lgn.is_start_node() or lgn.is_end_node()) and lid in self._drop_dict):
                 del self._drop_dict[lid]
-            elif (lgn.is_branch()):
-                for branch_drop in self._drop_dict[lid]:
-                    if 'null_drop' in branch_drop:
-                        del branch_drop['null_drop']
-            elif (lgn.is_start_listener()):
-                for sl_drop in self._drop_dict[lid]:
-                    if 'listener_drop'in sl_drop:
-                        del sl_drop['listener_drop']
-            elif (lgn.is_groupby()):
-                for sl_drop in self._drop_dict[lid]:
-                    if 'grp-data_drop' in sl_drop:
-                        del sl_drop['grp-data_drop']
-            elif (lgn.is_gather()):
-                for sl_drop in self._drop_dict[lid]:
-                    if 'gather-data_drop' in sl_drop:
-                        del sl_drop['gather-data_drop']
+            elif (lid in self._drop_dict):
+                self._cleanup_drops(lgn, self._drop_dict[lid])
 
         logger.info("Unroll progress - extra drops done for session {0}".format(self._session_id))
         ret = []
@@ -1972,8 +2249,76 @@ class LG():
             ret += drop_list
 
         for drop in ret:
-            if drop['type'] == 'app' and drop['app'].endswith('BashShellApp'):
-                bc = drop['command']
-                drop['command'] = bc.to_real_command()
+            self._finalise_drop(drop)
 
         return ret
+
+    def iter_unroll_to_tpl(self):
+        """
+        Not thread-safe!
+
+        Same as unroll_to_tpl, but yields the drops (in no particular order)
+        as soon as all the logical links of their logical graph node have been
+        unrolled, instead of returning them all at the end. The drops of a
+        logical graph node are only created when its first link is unrolled,
+        so only the nodes "in between" need to be kept in memory. This works
+        best when the links of the logical graph follow its topological order
+        """
+        lgn_list = self._prepare_unroll()
+
+        # index of the last link of each logical graph node
+        last_link = dict()
+        for i, lk in enumerate(self._lg_links):
+            last_link[lk['from']] = i
+            last_link[lk['to']] = i
+        done_at = collections.defaultdict(list)
+        for lid, i in last_link.items():
+            done_at[i].append(lid)
+
+        drop_dict = self._drop_dict
+        extra_dict = dict() # key - lgn id, val - embedded extra drops
+        visited = set(lgn.id for lgn in lgn_list)
+        def create(lid):
+            if (lid in extra_dict):
+                return
+            if (lid in visited):
+                new_drops = self._make_lgn_drops(self._done_dict[lid])
+            else:
+                new_drops = []
+            drop_dict[lid] = [d for d, _ in new_drops]
+            extra_dict[lid] = [e for _, e in new_drops if e is not None]
+
+        def release(lid):
+            lgn = self._done_dict[lid]
+            drops = drop_dict.pop(lid)
+            extra_drops = extra_dict.pop(lid)
+            if (lgn.is_start_node() or lgn.is_end_node()):
+                return
+            self._cleanup_drops(lgn, drops)
+            for drop in drops:
+                self._finalise_drop(drop)
+                yield drop
+            for drop in extra_drops:
+                self._finalise_drop(drop)
+                yield drop
+
+        num_drops = 0
+        for i, lk in enumerate(self._lg_links):
+            create(lk['from'])
+            create(lk['to'])
+            self._unroll_link(lk)
+            for lid in done_at.pop(i, []):
+                for drop in release(lid):
+                    num_drops += 1
+                    yield drop
+
+        # nodes without any links
+        for lgn in lgn_list:
+            if (lgn.id in last_link):
+                continue
+            create(lgn.id)
+            for drop in release(lgn.id):
+                num_drops += 1
+                yield drop
+
+        logger.info("Unroll progress - {0} drops streamed for session {1}".format(num_drops, self._session_id))
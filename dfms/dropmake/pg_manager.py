@@ -22,17 +22,31 @@
 Refer to
 https://confluence.ska-sdp.org/display/PRODUCTTREE/C.1.2.4.4.4+DFM+Physical+Graph+Manager
 """
+import collections
+import gzip
+import hashlib
+import logging
 import os
+import re
 import threading, json
 
 import networkx as nx
 import numpy as np
+import six
+import six.moves.cPickle as pickle  # @UnresolvedImport
 
 from dfms.dropmake.pg_generator import GraphException
 from dfms.dropmake.scheduler import DAGUtil, SchedulerException
 
 
+logger = logging.getLogger(__name__)
+
 MAX_PGT_FN_CNT = 300
+MAX_PGT_CACHE_SIZE = 256 * 1024 ** 2 # bytes
+
+# PGT ids not issued by the PGManager itself (e.g., before a restart) must
+# look like this before we read anything from disk for them
+_pgt_id_pattern = re.compile(r'^[\w-]+(/[\w-]+)*\.json$')
 
 class PGUtil(object):
     """
@@ -73,26 +87,90 @@ class PGUtil(object):
 class PGManager(object):
     """
     Physical Graph Manager
+
+    PGTs are kept in memory in their pickled form in a LRU cache, whose size
+    is bounded by max_cache_size (in bytes), and are also persisted to disk
+    (pickled and gzipped) so they can be brought back to memory after being
+    evicted. Each `get_pgt` call unpickles a new PGT, so callers can modify
+    it freely. PGTs added with a key
+    (see `pgt_key`) are named after it, so the same logical graph
+    translated with the same algorithm and parameters is only translated
+    once (see `pgt_id`)
     """
-    def __init__(self, root_dir):
-        self._pgt_dict = dict()
+    def __init__(self, root_dir, max_cache_size=MAX_PGT_CACHE_SIZE):
+        self._pgt_dict = collections.OrderedDict() # k - pgt id, v - pickled pgt
+        self._pgt_ids = set()
         self._pgt_fn_count = 0
-        self._gen_pgt_sem = threading.Semaphore(1)
-        self._root_dir = root_dir
+        self._root_dir = os.path.realpath(root_dir)
+        self._max_cache_size = max_cache_size
+        self._cache_size = 0
+        self._cache_lock = threading.Lock()
+
+    @staticmethod
+    def pgt_key(lg_content, params):
+        """
+        Return:
+            The content-addressed key (string) of the PGT of the logical
+            graph lg_content (bytes or string) translated with params (dict)
+        """
+        if (isinstance(lg_content, six.text_type)):
+            lg_content = lg_content.encode('utf8')
+        h = hashlib.sha1(lg_content)
+        params = json.dumps(sorted((str(k), str(v)) for k, v in params.items()))
+        h.update(params.encode('utf8'))
+        return h.hexdigest()[0:16]
+
+    @staticmethod
+    def pgt_id(lg_name, key):
+        """
+        Return:
+            The PGT id of the PGT with the given key (see `pgt_key`)
+        """
+        return lg_name.replace(".json", "_{0}_pgt.json".format(key))
+
+    def _valid_pgt_id(self, pgt_id):
+        if (pgt_id in self._pgt_ids):
+            return True
+        return (isinstance(pgt_id, six.string_types) and
+                _pgt_id_pattern.match(pgt_id) is not None)
 
-    def add_pgt(self, pgt, lg_name, num_islands=None):
+    def _pickle_path(self, pgt_id):
+        path = os.path.realpath("{0}/{1}.pkl.gz".format(self._root_dir, os.path.splitext(pgt_id)[0]))
+        if (not path.startswith(self._root_dir + os.sep)):
+            raise GraphException("Invalid PGT id: {0}".format(pgt_id))
+        return path
+
+    def _cache_pgt(self, pgt_id, pickled):
+        with self._cache_lock:
+            old = self._pgt_dict.pop(pgt_id, None)
+            if (old is not None):
+                self._cache_size -= len(old)
+            self._pgt_dict[pgt_id] = pickled
+            self._cache_size += len(pickled)
+            # evict the least recently used PGTs, but the newest one
+            while (self._cache_size > self._max_cache_size and len(self._pgt_dict) > 1):
+                old_id, old_pickled = self._pgt_dict.popitem(last=False)
+                self._cache_size -= len(old_pickled)
+                logger.info("Evicted PGT %s from memory (%d bytes)", old_id, len(old_pickled))
+
+    def add_pgt(self, pgt, lg_name, num_islands=None, key=None):
         """
         Dummy impl. using file system for now (thread safe)
         TODO - use proper graph databases to manage all PGTs
 
+        key:    the key of the PGT (see `pgt_key`). If None a counter-based
+                PGT id is used, which will be eventually reused
+
         Return:
             A unique PGT id (handle)
         """
-        #self._gen_pgt_sem.acquire()
-        self._pgt_fn_count += 1
-        if (self._pgt_fn_count == MAX_PGT_FN_CNT + 1):
-            self._pgt_fn_count = 0
-        pgt_id = lg_name.replace(".json", "{0}_pgt.json".format(self._pgt_fn_count))
+        if (key is None):
+            self._pgt_fn_count += 1
+            if (self._pgt_fn_count == MAX_PGT_FN_CNT + 1):
+                self._pgt_fn_count = 0
+            pgt_id = lg_name.replace(".json", "{0}_pgt.json".format(self._pgt_fn_count))
+        else:
+            pgt_id = self.pgt_id(lg_name, key)
         pgt_path = "{0}/{1}".format(self._root_dir, pgt_id)
         if (num_islands is None):
             pgt_content = pgt.json
@@ -113,20 +191,48 @@ class PGManager(object):
             # overwrite file on disks
             with open(pgt_path, "w") as f:
                 f.write(pgt_content)
-            self._pgt_dict[pgt_id] = pgt
+            pickled = pickle.dumps(pgt, pickle.HIGHEST_PROTOCOL)
+            with gzip.open(self._pickle_path(pgt_id), "wb") as f:
+                f.write(pickled)
+            self._cache_pgt(pgt_id, pickled)
+            self._pgt_ids.add(pgt_id)
         except Exception as exp:
             raise GraphException("Fail to save PGT {0}:{1}".format(pgt_path, str(exp)))
-        finally:
-            pass
-            #self._gen_pgt_sem.release()
         return pgt_id
 
     def get_pgt(self, pgt_id):
         """
         Return:
-            The PGT object given its PGT id
+            A new PGT object given its PGT id, which is loaded from disk if
+            it is not in memory anymore, or None if the PGT is not found
         """
-        return self._pgt_dict.get(pgt_id, None)
+        if (not self._valid_pgt_id(pgt_id)):
+            logger.warning("Invalid PGT id: %r", pgt_id)
+            return None
+
+        with self._cache_lock:
+            pickled = self._pgt_dict.pop(pgt_id, None)
+            if (pickled is not None):
+                self._pgt_dict[pgt_id] = pickled # most recently used now
+        if (pickled is not None):
+            return pickle.loads(pickled)
+
+        try:
+            pickle_path = self._pickle_path(pgt_id)
+        except GraphException:
+            logger.warning("Invalid PGT id: %r", pgt_id)
+            return None
+        if (not os.path.exists(pickle_path)):
+            return None
+        try:
+            with gzip.open(pickle_path, "rb") as f:
+                pickled = f.read()
+            pgt = pickle.loads(pickled)
+        except Exception:
+            logger.exception("Fail to load PGT %s from %s", pgt_id, pickle_path)
+            return None
+        self._cache_pgt(pgt_id, pickled)
+        return pgt
 
     def get_gantt_chart(self, pgt_id, json_str=True):
         """
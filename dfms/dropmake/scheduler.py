@@ -21,6 +21,7 @@
 #
 
 import logging
+import multiprocessing
 import os, sys
 import platform
 import time, random
@@ -32,6 +33,8 @@ import numpy as np
 from pyswarm import pso
 from collections import defaultdict
 
+from dfms.dropmake.dag import (CompactDAG, CriticalPath, CSRGraph,
+    MaxWeightedAntichain, NxReachability, Reachability)
 from dfms.dropmake.utils.anneal import Annealer
 from dfms.dropmake.utils.mcts import DAGTree, MCTS
 
@@ -905,149 +908,37 @@ class KFamilyPartition(Partition):
     A special case (K = 1) of the Maximum Weighted K-families based on
     the Theorem 3.1 in
     http://fmdb.cs.ucla.edu/Treports/930014.pdf
+
+    The maximum weighted antichain is maintained by a ``MaxWeightedAntichain``,
+    which keeps the Dilworth min-flow between calls and only augments it as
+    nodes join the partition
     """
-    def __init__(self, gid, max_dop, w_attr='num_cpus', global_dag=None):
+    def __init__(self, gid, max_dop, w_attr='num_cpus', global_dag=None, reach=None):
+        """
+        reach:  reachability queries on the global DAG (e.g. a
+                ``Reachability`` on its CompactDAG). If not given, queries go
+                to global_dag (or to the partition DAG if there is none)
+        """
         super(KFamilyPartition, self).__init__(gid, max_dop)
-        self._bpg = nx.DiGraph()
         self._global_dag = global_dag
-        self._check_global_dag = global_dag is not None
         self._w_attr = w_attr
-        self._tc = defaultdict(set)
-
-    def _add_to_split_graph(self, split_graph, el, ed_capacity,
-    dag, tmp_list):
-        """
-        el: node element in the DAG
-        ed_capacity:    edge capacity in the new split graph
-                        usually it comes from the weight of the DAG node
-        """
-        xi = '{0}_x'.format(el)
-        yi = '{0}_y'.format(el)
-        # if (ed_capacity > 1):
-        #     print("some >1 capacity: {0} for {1}".format(ed_capacity, el))
-        split_graph.add_edge('s', xi, capacity=ed_capacity, weight=0)
-        split_graph.add_edge(xi, yi, capacity=sys.maxsize, weight=1)
-        split_graph.add_edge(yi, 't', capacity=ed_capacity, weight=0)
-        tmp_list.append(xi)
-        tmp_list.append(yi)
-        # build transitive closure
-        el_des = nx.descendants(dag, el) # already a set
-        el_pred = set(dag.predecessors(el))
-
-        #check path on the global dag
-        if (self._check_global_dag):
-            tc = self._tc
-            part_node_set = set(dag.node) - set([el]) # node set
-            rem = part_node_set - el_des
-            global_dag = self._global_dag
-            for rel in rem:
-                if (rel in tc[el]):
-                    el_des.add(rel)
-                elif (nx.has_path(global_dag, el, rel)):
-                    tc[el].add(rel)
-                    el_des.add(rel)
-
-            rem = part_node_set - el_pred
-            for rel in rem:
-                if (el in tc[rel]):
-                    el_pred.add(rel)
-                elif (nx.has_path(global_dag, rel, el)):
-                    tc[rel].add(el)
-                    el_pred.add(rel)
-
-        for udown in el_des:
-            split_graph.add_edge(xi, '{0}_y'.format(udown),
-            capacity=sys.maxsize, weight=0)
-        for uup in el_pred:
-            split_graph.add_edge('{0}_x'.format(uup), yi,
-            capacity=sys.maxsize, weight=0)
-
-    def _get_pi_solution(self, split_graph):
-        """
-        1. create H (admissable graph) based on Section 3
-        http://fmdb.cs.ucla.edu/Treports/930014.pdf
-
-        2. calculate the max flow f' on H using networkx
-
-        3. construct Residual graph from f' on H based on
-        https://www.topcoder.com/community/data-science/\
-        data-science-tutorials/minimum-cost-flow-part-two-algorithms/
-
-        4. calculate Pi based on Section 3 again
-        """
-        # Step 1
-        H = nx.DiGraph()
-        H.add_nodes_from(split_graph)
-        for ed in split_graph.edges(data=True):
-            Cxy = ed[2].get('capacity', sys.maxsize)
-            Axy = ed[2]['weight']
-            if (Axy == 0 and Cxy > 0):
-                H.add_edge(ed[0], ed[1], capacity=Cxy, weight=Axy)
-
-        # Step 2
-        flow_value, flow_dict = nx.maximum_flow(H, 's', 't')
-
-        # Step 3
-        R = nx.DiGraph()
-        R.add_nodes_from(H)
-        for ed in H.edges(data=True):
-            Xij = flow_dict[ed[0]][ed[1]]
-            Uij = ed[2].get('capacity', sys.maxsize)
-            Cij = ed[2]['weight']
-            if (Uij - Xij) > 0:
-                R.add_edge(ed[0], ed[1], weight=Cij)
-            if (Xij > 0):
-                R.add_edge(ed[1], ed[0], weight=-1 * Cij)
-
-        # Step 4
-        pai = dict()
-        for n in R.nodes():
-            if (nx.has_path(R, 's', n)):
-                pai[n] = 0
-            else:
-                pai[n] = 1
-        return pai
-
-    def _get_w_antichain_len(self, split_graph, pi_solution):
-        """
-        Get the length of the maximum weighted antichain
-        """
-        pai = pi_solution
-        w_antichain_len = 0 #weighted antichain length
-        antichain_names = []
-        for h in range(2):
-            for nd in split_graph.nodes():
-                if (nd.endswith('_x')):
-                    y_nd = nd.split('_x')[0] + '_y'
-                    if ((1 - pai[nd] + pai['s'] == h) and
-                    (pai[y_nd] - pai[nd] == 1)):
-                        w_antichain_len += split_graph.edge['s'][nd]['capacity']
-                        #print(' *** %d' % split_graph.edge['s'][nd]['capacity'])
-                        antichain_names.append(nd)
-        #print("weighted antichain len = %d" % w_antichain_len)
-        # if (w_antichain_len > 1):
-        #     print(antichain_names)
-        return w_antichain_len
+        if (reach is None):
+            reach = NxReachability(self._dag if global_dag is None else global_dag)
+        self._antichain = MaxWeightedAntichain(reach)
 
     def add_node(self, u, weight):
         """
         Add a single node u to the partition
         """
         super(KFamilyPartition, self).add_node(u, weight)
-        #self._dag.add_node(u, weight=weight)
-        #self._max_dop = 1
         u_aw = self._global_dag.node[u].get(self._w_attr, 1)
         self._tmp_max_dop = u_aw
         self._max_dop = u_aw
-        self._add_to_split_graph(self._bpg, u, u_aw, self._dag, [])
+        self._antichain.add_nodes([(u, u_aw)])
 
     def can_add(self, u, v, gu, gv):
-        self_bpg = self._bpg
-        global_dag = self._global_dag
         dag = self._dag
         w_attr = self._w_attr
-        u_aw = gu[w_attr] # antichain weight in the split graph
-        v_aw = gv[w_attr]
         unew = u not in dag.node
         vnew = v not in dag.node
         if (unew):
@@ -1056,25 +947,21 @@ class KFamilyPartition(Partition):
             dag.add_node(v, attr_dict=gv)
         dag.add_edge(u, v)
 
-        tmp_added = []
-        # 1. construct the split graph
-        for el, elnew, elweight in [(u, unew, u_aw), (v, vnew, v_aw)]:
-            if (elnew):
-                self._add_to_split_graph(self_bpg, el, elweight, dag, tmp_added)
-
-        opt_sol = self._get_pi_solution(self_bpg)
-        mydop = self._get_w_antichain_len(self_bpg, opt_sol)
+        antichain = self._antichain
+        antichain.begin()
+        mydop = antichain.add_nodes([(el, gel[w_attr]) for el, elnew, gel in
+                                     [(u, unew, gu), (v, vnew, gv)] if elnew])
         canadd = False if mydop > self._ask_max_dop else True
         if (not canadd):
             #print("add rejected: %d > %d" %(mydop, self._ask_max_dop))
-            for tbd in tmp_added:
-                self_bpg.remove_node(tbd)
+            antichain.rollback()
             self._tmp_max_dop = self._max_dop
             if (unew):
                 self.remove(u)
             if (vnew):
                 self.remove(v)
         else:
+            antichain.commit()
             self._tmp_max_dop = mydop
         return (canadd, unew, vnew)
 
@@ -1088,26 +975,18 @@ class KFamilyPartition(Partition):
     def can_merge(self, that):
         """
         """
-        self._tmp_merge_dag = nx.compose(self._dag, that._dag)
-        dag = self._tmp_merge_dag
-        self_bpg = self._bpg
-        tmp_added = []
-        self_w_attr = self._w_attr
-        for node in that._dag.node.items():
-            el = node[0]
-            elweight = node[1].get(self_w_attr, 1)
-            self._add_to_split_graph(self_bpg, el, elweight, dag, tmp_added)
-        #opt_sol = nx.max_flow_min_cost(self_bpg, 's', 't') # returns a dict
-        opt_sol = self._get_pi_solution(self_bpg)
-        mydop = self._get_w_antichain_len(self_bpg, opt_sol)
+        antichain = self._antichain
+        antichain.begin()
+        mydop = antichain.merge(that._antichain)
         canmerge = False if mydop > self._ask_max_dop else True
         if (not canmerge):
             #print("merge rejected: %d > %d" %(mydop, self._ask_max_dop))
-            for tbd in tmp_added:
-                self_bpg.remove_node(tbd)
+            antichain.rollback()
             self._tmp_max_dop = self._max_dop
             self._tmp_merge_dag = None
         else:
+            antichain.commit()
+            self._tmp_merge_dag = nx.compose(self._dag, that._dag)
             self._tmp_max_dop = mydop
         return canmerge
 
@@ -1136,9 +1015,11 @@ class Scheduler(object):
         """
         self._drop_list = drop_list
         if (dag is None):
-            self._dag = DAGUtil.build_dag_from_drops(self._drop_list)
+            self._cdag = CompactDAG.from_drops(self._drop_list)
+            self._dag = self._cdag.to_nx(self._drop_list)
         else:
             self._dag = dag
+            self._cdag = CompactDAG.from_nx(dag)
         self._max_dop = max_dop
         self._parts = None # partitions
         self._part_dict = dict() #{gid : part}
@@ -1157,49 +1038,27 @@ class Scheduler(object):
         """
         # 1. build the bi-directional graph (each partition is a node)
         metis = DAGUtil.import_metis()
-        G = nx.Graph()
-        G.graph['edge_weight_attr'] = 'weight'
         st_gid = len(self._drop_list) + len(self._parts) + 1
-        # if (bal_cond == 0):
-        #     G.graph['node_weight_attr'] = ['wkl', 'eff']
-        #     for part in self._parts:
-        #         sc = part.schedule
-        #         G.add_node(part.partition_id, wkl=sc.workload, eff=sc.efficiency)
-        # else:
-        G.graph['node_weight_attr'] = 'cc'
-        for part in self._parts:
-            #sc = part.schedule
-            G.add_node(part.partition_id, cc=1)
-
+        part_ids = [part.partition_id for part in self._parts]
+        part_idx = dict((gid, i) for i, gid in enumerate(part_ids))
+        us = []
+        vs = []
+        ws = []
         for e in self._part_edges:
             u = e[0]
             v = e[1]
-            ugid = self._dag.node[u].get('gid', None)
-            vgid = self._dag.node[v].get('gid', None)
-            G.add_edge(ugid, vgid) # repeating is fine
-            ew = self._dag.edge[u][v]['weight']
-            try:
-                G[ugid][vgid]['weight'] += ew
-            except KeyError:
-                G[ugid][vgid]['weight'] = ew
-        #DAGUtil.metis_part(G, 15)
-        # since METIS does not allow zero edge weight, reset them to one
-        for e in G.edges(data=True):
-            if (e[2]['weight'] == 0):
-                e[2]['weight'] = 1
-        #logger.debug(G.nodes(data=True))
-        (edgecuts, metis_parts) = metis.part_graph(G,
-                                                   nparts=num_partitions,
-                                                   ufactor=1)
-        #assert(len(metis_parts) == len(G.nodes())) #test only
+            us.append(part_idx[self._dag.node[u].get('gid', None)])
+            vs.append(part_idx[self._dag.node[v].get('gid', None)])
+            ws.append(self._dag.edge[u][v]['weight'])
+        # each partition counts once when balancing
+        G = CSRGraph(len(part_ids), us, vs, ws,
+                     vwgt=[1] * len(part_ids), merge='sum')
+        (edgecuts, metis_parts) = G.part_graph(metis, nparts=num_partitions,
+                                               ufactor=1)
         for i, pt in enumerate(metis_parts): # note min(pt) == 0
             parent_id = pt + st_gid
-            child_part = self._part_dict[G.nodes()[i]]
+            child_part = self._part_dict[part_ids[i]]
             child_part.parent_id = parent_id
-            #logger.debug("Part {0} --> Cluster {1}".format(child_part.partition_id, parent_id))
-            #parent_part = Partition(parent_id, None)
-            #self._parts.append(parent_part)
-        #logger.debug("Edgecuts of merged partitions: ", edgecuts)
         return edgecuts
 
     def map_partitions(self):
@@ -1227,8 +1086,9 @@ class MySarkarScheduler(Scheduler):
     """
     def __init__(self, drop_list, max_dop=8, dag=None, dump_progress=False):
         super(MySarkarScheduler, self).__init__(drop_list, max_dop=max_dop, dag=dag)
-        self._sspace = [3] * len(self._dag.edges()) # all edges are not zeroed
+        self._sspace = [3] * self._cdag.num_edges # all edges are not zeroed
         self._dump_progress = dump_progress
+        self._critical_path = None
 
     def override_cannot_add(self):
         """
@@ -1236,6 +1096,19 @@ class MySarkarScheduler(Scheduler):
         """
         return False
 
+    def track_critical_path(self):
+        """
+        Whether this scheduler keeps the critical path up to date while zeroing edges
+        """
+        return self._dump_progress
+
+    @property
+    def critical_path(self):
+        """
+        The ``CriticalPath`` maintained during `partition_dag`, if tracked
+        """
+        return self._critical_path
+
     def is_time_critical(self, u, uw, unew, v, vw, vnew, curr_lpl, ow, rem_el):
         """
         This is called ONLY IF override_cannot_add has returned "True"
@@ -1306,37 +1179,42 @@ class MySarkarScheduler(Scheduler):
             3. partition time (seconds, float)
         """
         G = self._dag
+        cdag = self._cdag
         st_gid = len(self._drop_list) + 1
         init_c = st_gid
-        el = G.edges(data=True)
-        el.sort(key=lambda ed: ed[2]['weight'] * -1)
+        # edge weights are zeroed on the array, and mirrored on G
+        ew = cdag.edge_weight.copy()
         stt = time.time()
-        topo_sorted = nx.topological_sort(G)
+        cp = CriticalPath(cdag, ew) if self.track_critical_path() else None
+        self._critical_path = cp
         g_dict = self._part_dict#dict() #{gid : Partition}
         curr_lpl = None
         parts = []
         plots_data = []
         dump_progress = self._dump_progress
 
+        reach = Reachability(cdag)
         for n in G.nodes(data=True):
             n[1]['gid'] = st_gid
             #part = DilworthPartition(st_gid, self._max_dop)
             #part = WeightedDilworthPartition(st_gid, self._max_dop)
             #part = WeightedDilworthPartition(st_gid, self._max_dop, G)
             #part = MultiWeightPartition(st_gid, self._max_dop, global_dag=G)
-            part = KFamilyPartition(st_gid, self._max_dop, global_dag=G)
+            part = KFamilyPartition(st_gid, self._max_dop, global_dag=G, reach=reach)
             part.add_node(n[0], n[1].get('weight', 1))
             g_dict[st_gid] = part
             parts.append(part) # will it get rejected?
             st_gid += 1
 
-        for i, e in enumerate(el):
-            u = e[0]
+        node_ids = cdag.node_ids.tolist()
+        edge_src = cdag.edge_src.tolist()
+        edge_dst = cdag.edge_dst.tolist()
+        for i, eid in enumerate(cdag.edges_by_weight().tolist()):
+            u = node_ids[edge_src[eid]]
             gu = G.node[u]
-            v = e[1]
+            v = node_ids[edge_dst[eid]]
             gv = G.node[v]
-            ow = G.edge[u][v]['weight']
-            G.edge[u][v]['weight'] = 0 #edge zeroing
+            zero = True
             ugid = gu.get('gid', None)
             vgid = gv.get('gid', None)
             if (ugid != vgid): # merge existing parts
@@ -1346,12 +1224,16 @@ class MySarkarScheduler(Scheduler):
                     st_gid -= 1
                     self._sspace[i] = 1
                 else:
-                    G.edge[u][v]['weight'] = ow
-                    self._part_edges.append(e)
+                    zero = False
+                    self._part_edges.append((u, v))
+            if (zero):
+                ew[eid] = 0 #edge zeroing
+                G.edge[u][v]['weight'] = 0
+                if (cp is not None):
+                    cp.set_edge_weight(eid, 0)
             if (dump_progress):
                 bb = np.median([pp._tmp_max_dop for pp in parts])
-                curr_lpl = DAGUtil.get_longest_path(G, show_path=False,
-                topo_sort=topo_sorted)[1]
+                curr_lpl = cp.length
                 plots_data.append('%d,%d,%d' % (curr_lpl, len(parts), bb))
 
         edt = time.time() - stt
@@ -1359,9 +1241,10 @@ class MySarkarScheduler(Scheduler):
         if (dump_progress):
             with open('/tmp/%.3f_lpl_parts.csv' % time.time(), 'w') as of:
                 of.writelines(os.linesep.join(plots_data))
-        if (curr_lpl is None):
-            curr_lpl = DAGUtil.get_longest_path(G, show_path=False,
-            topo_sort=topo_sorted)[1]
+        if (cp is not None):
+            curr_lpl = cp.length
+        else:
+            curr_lpl = cdag.longest_path(ew, show_path=False)[1]
         return ((st_gid - init_c), curr_lpl, edt, parts)
 
 class MinNumPartsScheduler(MySarkarScheduler):
@@ -1378,6 +1261,9 @@ class MinNumPartsScheduler(MySarkarScheduler):
     def override_cannot_add(self):
         return True
 
+    def track_critical_path(self):
+        return True
+
     def is_time_critical(self, u, uw, unew, v, vw, vnew, curr_lpl, ow, rem_el):
         """
         This is called ONLY IF either can_add on partition has returned "False"
@@ -1386,6 +1272,7 @@ class MinNumPartsScheduler(MySarkarScheduler):
         Parameters:
             u - node u, v - node v, uw - weight of node u, vw - weight of node v
             curr_lpl - current longest path length, ow - current edge weight
+                       (if None, it is taken from the tracked critical path)
             rem_el - remainig edges to be zeroed
             ow - original edge length
         Returns:
@@ -1398,6 +1285,8 @@ class MinNumPartsScheduler(MySarkarScheduler):
         """
         if (unew and vnew):
             return True
+        if (curr_lpl is None):
+            curr_lpl = self._critical_path.length
         # compute time criticality probility
         ttlen = float(len(rem_el))
         if (ttlen == 0):
@@ -1452,7 +1341,13 @@ class PSOScheduler(Scheduler):
                 based on X[i] value, reject or linearisation
             (2) returns makespan
     """
-    def __init__(self, drop_list, max_dop=8, dag=None, deadline=None, topk=30, swarm_size=40):
+    def __init__(self, drop_list, max_dop=8, dag=None, deadline=None, topk=30, swarm_size=40,
+                 num_starts=1, num_workers=1):
+        """
+        num_starts:     number of independent runs of the search, the best
+                        solution amongst them is kept
+        num_workers:    number of processes running these searches
+        """
         super(PSOScheduler, self).__init__(drop_list, max_dop=max_dop, dag=dag)
         self._deadline = deadline
         #search space: key - combination of X[i] (string),
@@ -1460,11 +1355,15 @@ class PSOScheduler(Scheduler):
         self._sspace_dict = dict()
         self._topk = topk
         self._swarm_size = swarm_size
-        self._lite_dag = DAGUtil.build_dag_from_drops(self._drop_list, embed_drop=False)
+        self._lite_dag = self._cdag.to_nx()
         self._call_counts = 0
-        leng = len(self._lite_dag.edges())
+        leng = self._cdag.num_edges
         self._leng = leng
         self._topk = leng if self._topk is None or leng < self._topk else self._topk
+        # number of leading positions of X used as the search space key
+        self._memo_len = self._topk
+        self._num_starts = max(1, num_starts)
+        self._num_workers = max(1, num_workers)
 
     def partition_dag(self):
         """
@@ -1476,14 +1375,8 @@ class PSOScheduler(Scheduler):
         """
         # trigger the PSO algorithm
         G = self._dag
-        lb = [0.99] * self._leng
-        ub = [3.01] * self._leng
         stt = time.time()
-        if (self._deadline is None):
-            xopt, fopt = pso(self.objective_func, lb, ub, swarmsize=self._swarm_size)
-        else:
-            xopt, fopt = pso(self.objective_func, lb, ub, ieqcons=[self.constrain_func], swarmsize=self._swarm_size)
-
+        xopt = self._multi_start()
         curr_lpl, num_parts, parts, g_dict = self._partition_G(G, xopt)
         #curr_lpl, num_parts, parts, g_dict = self.objective_func(xopt)
         self._part_dict = g_dict
@@ -1502,21 +1395,96 @@ class PSOScheduler(Scheduler):
         #print "call counts ", self._call_counts
         return (num_parts, curr_lpl, edt - stt, parts)
 
-    def _partition_G(self, G, x):
+    def _search(self):
+        """
+        Runs the search once, and returns the best X found
+        """
+        lb = [0.99] * self._leng
+        ub = [3.01] * self._leng
+        if (self._deadline is None):
+            xopt, fopt = pso(self.objective_func, lb, ub, swarmsize=self._swarm_size)
+        else:
+            xopt, fopt = pso(self.objective_func, lb, ub, ieqcons=[self.constrain_func], swarmsize=self._swarm_size)
+        return xopt
+
+    def _score(self, x):
+        """
+        Sort key of a solution, the smaller the better
+        """
+        lpl, num_parts = self.evaluate(x)
+        if (self._deadline is None):
+            return (lpl, num_parts)
+        else:
+            return (lpl > self._deadline, num_parts, lpl)
+
+    def _multi_start(self):
+        """
+        Runs `_search` num_starts times, on num_workers processes, and
+        returns the best solution. The search spaces explored by all runs
+        are added to our own
+        """
+        if (self._num_starts == 1):
+            return self._search()
+        seeds = [random.randint(0, 2 ** 31 - 1) for _ in range(self._num_starts)]
+        if (self._num_workers == 1):
+            results = [_run_search(self, seed) for seed in seeds]
+        else:
+            global _search_scheduler
+            _search_scheduler = self
+            try:
+                # workers get the scheduler (and its DAGs) through fork
+                ctx = multiprocessing.get_context('fork')
+            except AttributeError:
+                ctx = multiprocessing
+            pool = ctx.Pool(min(self._num_workers, self._num_starts))
+            try:
+                results = pool.map(_search_worker, seeds)
+            finally:
+                pool.close()
+                pool.join()
+                _search_scheduler = None
+        for _, sspace in results:
+            self._sspace_dict.update(sspace)
+        best = min((x for x, _ in results), key=self._score)
+        logger.debug("Best of %d %s runs: %r", len(results),
+                     self.__class__.__name__, self.evaluate(best))
+        return best
+
+    def evaluate(self, x):
+        """
+        Returns the (critical path length, number of partitions) of the
+        partitioning given by X. Results are kept in the search space
+        """
+        sk = ''.join([str(int(round(xi))) for xi in x[0:self._memo_len]])
+        stuff = self._sspace_dict.get(sk, None)
+        if (stuff is None):
+            stuff = self._partition_G(self._lite_dag, x, label=False)[0:2]
+            self._sspace_dict[sk] = stuff
+        return stuff
+
+    def _partition_G(self, G, x, label=True):
         """
         A helper function to partition G based on a given scheme x
         subject to constraints imposed by each partition's DoP
+
+        If label is False, partition ids and zeroed edges are not written to
+        G, which is copied only if linearisation needs to add edges to it
         """
         #print x
         st_gid = len(self._drop_list) + 1
         init_c = st_gid
-        el = G.edges(data=True)
-        el.sort(key=lambda ed: ed[2]['weight'] * -1)
-        #topo_sorted = nx.topological_sort(G)
+        cdag = self._cdag
+        ew = cdag.edge_weight.copy()
+        node_ids = cdag.node_ids.tolist()
+        edge_src = cdag.edge_src.tolist()
+        edge_dst = cdag.edge_dst.tolist()
         #g_dict = self._part_dict#dict() #{gid : Partition}
         g_dict = dict()
         parts = []
-        for i, e in enumerate(el):
+        gids = dict() # {node : gid}
+        zeroed = []
+        linearised = False
+        for i, eid in enumerate(cdag.edges_by_weight().tolist()):
             pos = int(round(x[i]))
             if (pos == 3): #10 non_zero + 1
                 continue
@@ -1527,16 +1495,14 @@ class PSOScheduler(Scheduler):
             else:
                 raise SchedulerException("PSO position out of bound: {0}".format(pos))
 
-            u = e[0]
+            u = node_ids[edge_src[eid]]
             gu = G.node[u]
-            v = e[1]
+            v = node_ids[edge_dst[eid]]
             gv = G.node[v]
-            ow = G.edge[u][v]['weight']
-            G.edge[u][v]['weight'] = 0 #edge zeroing
             recover_edge = False
 
-            ugid = gu.get('gid', None)
-            vgid = gv.get('gid', None)
+            ugid = gids.get(u, None)
+            vgid = gids.get(v, None)
             if (ugid and (not vgid)):
                 part = g_dict[ugid]
             elif ((not ugid) and vgid):
@@ -1559,21 +1525,38 @@ class PSOScheduler(Scheduler):
                 if (ca):
                     # ignore linear flag, add it anyway
                     part.add(u, v, gu, gv)
-                    gu['gid'] = part._gid
-                    gv['gid'] = part._gid
+                    gids[u] = part._gid
+                    gids[v] = part._gid
                 else:
                     if (linear):
+                        if (not label and not linearised):
+                            G = G.copy()
+                        linearised = True
                         part.add(u, v, gu, gv, sequential=True, global_dag=G)
-                        gu['gid'] = part._gid
-                        gv['gid'] = part._gid
+                        gids[u] = part._gid
+                        gids[v] = part._gid
                     else:
                         recover_edge = True #outright rejection
             if (recover_edge):
-                G.edge[u][v]['weight'] = ow
-                self._part_edges.append(e)
+                if (label):
+                    self._part_edges.append((u, v))
+            else:
+                ew[eid] = 0 #edge zeroing
+                zeroed.append((u, v))
         self._call_counts += 1
         #print "called {0} times, len parts = {1}".format(self._call_counts, len(parts))
-        return (DAGUtil.get_longest_path(G, show_path=False)[1], len(parts), parts, g_dict)
+        if (label or linearised):
+            for u, v in zeroed:
+                G.edge[u][v]['weight'] = 0
+        if (label):
+            for n, gid in gids.items():
+                G.node[n]['gid'] = gid
+        if (G.number_of_edges() == cdag.num_edges):
+            lpl = cdag.longest_path(ew, show_path=False)[1]
+        else:
+            # linearisation has added new edges to G
+            lpl = DAGUtil.get_longest_path(G, show_path=False)[1]
+        return (lpl, len(parts), parts, g_dict)
 
     def constrain_func(self, x):
         """
@@ -1581,31 +1564,14 @@ class PSOScheduler(Scheduler):
         """
         if (self._deadline is None):
             raise SchedulerException("Deadline is None, cannot apply constraints!")
-
-        sk = ''.join([str(int(round(xi))) for xi in x[0:self._topk]])
-        stuff = self._sspace_dict.get(sk, None)
-        if (stuff is None):
-            G = self._lite_dag.copy()
-            stuff = self._partition_G(G, x)
-            self._sspace_dict[sk] = stuff[0:2]
-            del G
-        return self._deadline - stuff[0]
+        return self._deadline - self.evaluate(x)[0]
 
     def objective_func(self, x):
         """
         x is a list of values, each taking one of the 3 integers: 0,1,2 for an edge
         indices of x is identical to the indices in G.edges().sort(key='weight')
         """
-        # first check if the solution is already available in the search space
-        sk = ''.join([str(int(round(xi))) for xi in x[0:self._topk]])
-        stuff = self._sspace_dict.get(sk, None) #TODO is this atomic operation?
-        if (stuff is None):
-            # make a deep copy to avoid mix up multiple particles,
-            # each of which has multiple iterations
-            G = self._lite_dag.copy()
-            stuff = self._partition_G(G, x)
-            self._sspace_dict[sk] = stuff[0:2]
-            del G
+        stuff = self.evaluate(x)
         if (self._deadline is None):
             return stuff[0]
         else:
@@ -1653,10 +1619,7 @@ class GraphAnnealer(Annealer):
 
     def energy(self):
         """Calculates the number of partitions"""
-        G = self._scheduler._lite_dag.copy()
-        stuff = self._scheduler._partition_G(G, self.state)
-        self._lgl = stuff[0]
-        num_parts = stuff[1]
+        self._lgl, num_parts = self._scheduler.evaluate(self.state)
         #print "num_parts = {0}, lgl = {1}".format(num_parts, self._lgl)
         return num_parts
 
@@ -1676,11 +1639,18 @@ class MCTSScheduler(PSOScheduler):
     https://en.wikipedia.org/wiki/Monte_Carlo_tree_search
     Use basic functions in PSOScheduler by inheriting it for convinence
     """
-    def __init__(self, drop_list, max_dop=8, dag=None, deadline=None, max_moves=1000, max_calc_time=10):
-        super(MCTSScheduler, self).__init__(drop_list, max_dop, dag, deadline, None, 40)
+    def __init__(self, drop_list, max_dop=8, dag=None, deadline=None, max_moves=1000, max_calc_time=10,
+                 num_starts=1, num_workers=1):
+        super(MCTSScheduler, self).__init__(drop_list, max_dop, dag, deadline, None, 40,
+                                            num_starts=num_starts, num_workers=num_workers)
         self._max_moves = max_moves
         self._max_calc_time = max_calc_time
 
+    def _search(self):
+        stree = DAGTree(self._lite_dag, self)
+        mcts = MCTS(stree, calculation_time=self._max_calc_time, max_moves=self._max_moves)
+        return mcts.run()
+
     def partition_dag(self):
         """
         Trigger the MCTS algorithm
@@ -1692,13 +1662,7 @@ class MCTSScheduler(PSOScheduler):
         """
         stt = time.time()
         G = self._dag
-        stree = DAGTree(self._lite_dag, self)
-        mcts = MCTS(stree, calculation_time=self._max_calc_time, max_moves=self._max_moves)
-        # m, state = mcts.next_move()
-        # leng = len(G.edges())
-        # while (len(state) < leng):
-        #     m, state = mcts.next_move()
-        state = mcts.run()
+        state = self._multi_start()
         if logger.isEnabledFor(logging.DEBUG):
             leng = len(G.edges())
             logger.debug("Each MCTS move on average took {0} seconds".formats((time.time() - stt) / leng))
@@ -1726,13 +1690,32 @@ class SAScheduler(PSOScheduler):
     http://apmonitor.com/me575/index.php/Main/SimulatedAnnealing
     Use basic functions in PSOScheduler by inheriting it for convinence
     """
-    def __init__(self, drop_list, max_dop=8, dag=None, deadline=None, topk=None, max_iter=6000):
+    def __init__(self, drop_list, max_dop=8, dag=None, deadline=None, topk=None, max_iter=6000,
+                 num_starts=1, num_workers=1):
         """
         A smaller topk corresponds to a smaller range of perturbation during neighbour search,
         which coudl result in more single-drop partitions
         """
-        super(SAScheduler, self).__init__(drop_list, max_dop, dag, deadline, topk, 40)
+        super(SAScheduler, self).__init__(drop_list, max_dop, dag, deadline, topk, 40,
+                                          num_starts=num_starts, num_workers=num_workers)
         self._max_iter = max_iter
+        # states differ in all their positions, not only in the top k ones
+        self._memo_len = self._leng
+        self._init_state = None
+
+    def _search(self):
+        ga = GraphAnnealer(self._init_state, self, deadline=self._deadline, topk=self._topk)
+        # start the annealing process
+        #auto_schedule = ga.auto(minutes=self._max_wait)
+        #ga.set_schedule(auto_schedule)
+        ga.steps = self._max_iter
+        if (DEBUG):
+            ga.updates = 100
+        else:
+            ga.updates = 0
+        ga.save_state_on_exit = False
+        state, e = ga.anneal()
+        return state
 
     def partition_dag(self):
         """
@@ -1748,23 +1731,14 @@ class SAScheduler(PSOScheduler):
         mys = MySarkarScheduler(self._drop_list, max_dop=self._max_dop, dag=self._lite_dag.copy())
         num_parts_done, lpl, ptime, parts = mys.partition_dag()
         # print "initial num_parts = ", len(parts)
-        # 2. create the GraphAnnealer instance
+        self._init_state = mys._sspace
+        # 2. anneal (see `_search`), starting from that state
         stt = time.time()
-        ga = GraphAnnealer(mys._sspace, self, deadline=self._deadline, topk=self._topk)
-        # 3. start the annealing process
-        #auto_schedule = ga.auto(minutes=self._max_wait)
-        #ga.set_schedule(auto_schedule)
-        ga.steps = self._max_iter
-        if (DEBUG):
-            ga.updates = 100
-        else:
-            ga.updates = 0
-        ga.save_state_on_exit = False
-        state, e = ga.anneal()
-        # 4. calculate the solution under the 'annealed' state
+        state = self._multi_start()
+        # 3. calculate the solution under the 'annealed' state
         curr_lpl, num_parts, parts, g_dict = self._partition_G(G, state)
         edt = time.time()
-        logger.debug("Simulated Annealing scheduler took %.f secs, energy = %f, num_parts = %d".format(edt - stt, e, num_parts))
+        logger.debug("Simulated Annealing scheduler took %.3f secs, lpl = %d, num_parts = %d", edt - stt, curr_lpl, num_parts)
         st_gid = len(self._drop_list) + 1 + num_parts
         for n in G.nodes(data=True):
             if not 'gid' in n[1]:
@@ -1777,6 +1751,18 @@ class SAScheduler(PSOScheduler):
         self._parts = parts
         return (num_parts, curr_lpl, edt - stt, parts)
 
+# The scheduler whose search is run by the worker processes of a pool
+_search_scheduler = None
+
+def _run_search(scheduler, seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    x = scheduler._search()
+    return (list(x), scheduler._sspace_dict)
+
+def _search_worker(seed):
+    return _run_search(_search_scheduler, seed)
+
 class DSCScheduler(Schedule):
     """
     Based on
@@ -1797,6 +1783,8 @@ class DAGUtil(object):
     @staticmethod
     def get_longest_path(G, weight='weight', default_weight=1, show_path=True, topo_sort=None):
         """
+        If G is a ``CompactDAG`` its (array-based) longest path is returned
+
         Ported from:
         https://github.com/networkx/networkx/blob/master/networkx/algorithms/dag.py
         Added node weight
@@ -1819,6 +1807,8 @@ class DAGUtil(object):
             The length of the longest path
 
         """
+        if (isinstance(G, CompactDAG)):
+            return G.longest_path(show_path=show_path)
         dist = {} # stores {v : (length, u)}
         if (topo_sort is None):
             topo_sort = nx.topological_sort(G)
@@ -1854,14 +1844,9 @@ class DAGUtil(object):
         weight: float (for example, it could be RAM consumption in GB)
         Return : float
         """
-        max_width = 0
-        for antichain in nx.antichains(G):
-            t = 0
-            for n in antichain:
-                t += G.node[n].get(weight, default_weight)
-            if (t > max_width):
-                max_width = t
-        return max_width
+        antichain = MaxWeightedAntichain(NxReachability(G))
+        return antichain.add_nodes([(n, d.get(weight, default_weight))
+                                    for n, d in G.nodes(data=True)])
 
     @staticmethod
     def get_max_dop(G):
@@ -1869,15 +1854,8 @@ class DAGUtil(object):
         Get the maximum degree of parallelism of this DAG
         return : int
         """
-        return max([len(antichain) for antichain in nx.antichains(G)])
-        """
-        max_dop = 0
-        for antichain in nx.antichains(G):
-            leng = len(antichain)
-            if (leng > max_dop):
-                max_dop = leng
-        return max_dop
-        """
+        antichain = MaxWeightedAntichain(NxReachability(G))
+        return antichain.add_nodes([(n, 1) for n in G.nodes()])
 
     @staticmethod
     def get_max_antichains(G):
@@ -1975,42 +1953,7 @@ class DAGUtil(object):
         tw - task weight
         dw - data weight / volume
         """
-        key_dict = dict() # {oid : node_id}
-        drop_dict = dict() # {oid : drop}
-        for i, drop in enumerate(drop_list):
-            oid = drop['oid']
-            key_dict[oid] = i + 1 # starting from 1
-            drop_dict[oid] = drop
-        G = nx.DiGraph()
-        for i, drop in enumerate(drop_list):
-            oid = drop['oid']
-            myk = i + 1
-            tt = drop['type']
-            if ('plain' == tt):
-                obk = 'consumers' # outbound keyword
-                tw = 0
-                dtp = 0
-            elif ('app' == tt):
-                obk = 'outputs'
-                tw = int(drop['tw'])
-                dtp = 1
-            else:
-                raise SchedulerException("Drop Type '{0}' not supported".\
-                format(tt))
-            num_cpus = drop.get('num_cpus', 1)
-            if (embed_drop):
-                G.add_node(myk, weight=tw, text=drop['nm'], dt=dtp,
-                drop_spec=drop, num_cpus=num_cpus)
-            else:
-                G.add_node(myk, weight=tw, text=drop['nm'], dt=dtp,
-                num_cpus=num_cpus)
-            if obk in drop:
-                for oup in drop[obk]:
-                    if ('plain' == tt):
-                        G.add_weighted_edges_from([(myk, key_dict[oup], int(drop['dw']))])
-                    elif ('app' == tt):
-                        G.add_weighted_edges_from([(myk, key_dict[oup], int(drop_dict[oup].get('dw', 5)))])
-        return G
+        return CompactDAG.from_drops(drop_list).to_nx(drop_list, embed_drop=embed_drop)
 
     @staticmethod
     def metis_part(G, num_partitions):
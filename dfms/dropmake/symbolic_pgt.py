@@ -0,0 +1,314 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2017
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+A symbolic (compressed) form of the Physical Graph Template.
+
+Instead of enumerating every drop, each logical graph node is kept as
+
+    1. a template (the node itself, see LGNode.make_single_drop)
+    2. an index space (the product of the dops of its enclosing constructs,
+       see LG.instance_shape)
+    3. the link rules to its neighbours (see LinkRule)
+
+Partitioning and mapping work on ranges of these index spaces, and the
+concrete dropspecs of a range are only produced (by `SymbolicPGT.expand`)
+where and when they are needed. The whole thing serialises to the logical
+graph plus a few numbers per range.
+"""
+
+import bisect
+import json
+import logging
+
+import numpy as np
+import six
+
+from dfms.dropmake.pg_generator import LG, GPGTException
+
+
+logger = logging.getLogger(__name__)
+
+class SymbolicPGT(object):
+    """
+    A Physical Graph Template kept as templates, index spaces and link rules
+    """
+
+    def __init__(self, lg_json, ssid=None):
+        """
+        lg_json:    the logical graph (dict, as loaded from its JSON)
+        ssid:       the session id used as the prefix of all drop oids
+        """
+        self._lg_json = lg_json
+        self._lg = LG(six.StringIO(json.dumps(lg_json)), ssid=ssid)
+        self._ssid = self._lg._session_id
+        lg = self._lg
+
+        # all the nodes that make drops, in unrolling order, together with
+        # the artificial links of the groups
+        lgn_list = lg._prepare_unroll()
+
+        self._num_instances = dict() # k - lgn id, v - # of instances
+        self._lgn_ids = []
+        for lgn in lgn_list:
+            if (lgn.is_start_node() or lgn.is_end_node()):
+                continue
+            n = lg.num_instances(lgn)
+            if (n > 0):
+                self._lgn_ids.append(lgn.id)
+                self._num_instances[lgn.id] = n
+
+        self._lgn_by_str = dict((str(lgn.id), lgn) for lgn in lgn_list)
+        self._links = dict() # k - lgn id, v - (link index, lgn is source)
+        for i, lk in enumerate(lg._lg_links):
+            self._links.setdefault(lk['from'], []).append((i, True))
+            self._links.setdefault(lk['to'], []).append((i, False))
+        self._rules = dict() # k - link index, v - LinkRule
+
+        self._num_parts = 0
+        self._ranges = dict() # k - lgn id, v - list of (start, stop, partition)
+        self._part_nodes = None # node and island of each partition
+
+    @staticmethod
+    def from_file(lg_path, ssid=None):
+        with open(lg_path) as f:
+            return SymbolicPGT(json.load(f), ssid=ssid)
+
+    @property
+    def ssid(self):
+        return self._ssid
+
+    @property
+    def lgn_ids(self):
+        """
+        The ids of the logical graph nodes that make drops
+        """
+        return list(self._lgn_ids)
+
+    def num_instances(self, lgn_id):
+        return self._num_instances[lgn_id]
+
+    @property
+    def num_drops(self):
+        """
+        The number of drops the full expansion makes
+        """
+        ret = 0
+        done_dict = self._lg._done_dict
+        for lid in self._lgn_ids:
+            lgn = done_dict[lid]
+            per_instance = 2 if (lgn.is_branch() or lgn.is_start_listener() or
+                                 lgn.is_groupby() or lgn.is_gather()) else 1
+            ret += per_instance * self._num_instances[lid]
+        return ret
+
+    @property
+    def num_partitions(self):
+        return self._num_parts
+
+    def _rule(self, link_idx):
+        if (link_idx not in self._rules):
+            lk = self._lg._lg_links[link_idx]
+            done_dict = self._lg._done_dict
+            self._rules[link_idx] = self._lg.link_rule(done_dict[lk['from']],
+                                                       done_dict[lk['to']])
+        return self._rules[link_idx]
+
+    def partition(self, num_partitions):
+        """
+        Splits the index space of every logical graph node into (at most)
+        num_partitions contiguous ranges of (about) the same length, range p
+        going to partition p. Since link rules mostly relate proportional
+        indexes, linked instances tend to end up in the same partition
+        """
+        if (num_partitions <= 0):
+            raise GPGTException("Invalid num_partitions {0}".format(num_partitions))
+        self._num_parts = num_partitions
+        self._ranges = dict()
+        for lid in self._lgn_ids:
+            n = self._num_instances[lid]
+            ranges = []
+            for p in range(num_partitions):
+                start = p * n // num_partitions
+                stop = (p + 1) * n // num_partitions
+                if (stop > start):
+                    ranges.append((start, stop, p))
+            self._ranges[lid] = ranges
+        self._part_nodes = None
+        logger.info("Partitioned %d drops of %d logical graph nodes into %d partitions",
+                    self.num_drops, len(self._lgn_ids), num_partitions)
+
+    def map(self, node_list, num_islands=1):
+        """
+        Maps the partitions to node_list, whose first num_islands nodes are
+        the islands (see `tool.resource_map`). Neighbouring partitions go
+        to the same island
+        """
+        if (self._num_parts == 0):
+            raise GPGTException("The graph has not been partitioned yet")
+        num_islands = max(num_islands, 1)
+        is_list = node_list[0:num_islands]
+        nm_list = node_list[num_islands:]
+        if (len(nm_list) == 0):
+            raise GPGTException("Too few nodes: {0}".format(len(node_list)))
+        nm_len = len(nm_list)
+        part_nodes = []
+        for p in range(self._num_parts):
+            nidx = p % nm_len
+            part_nodes.append((nm_list[nidx], is_list[nidx * num_islands // nm_len]))
+        self._part_nodes = part_nodes
+
+    def ranges(self, partition=None):
+        """
+        The (lgn id, start, stop) ranges of partition (all of them if None)
+        """
+        if (self._num_parts == 0):
+            return [(lid, 0, self._num_instances[lid]) for lid in self._lgn_ids]
+        ret = []
+        for lid in self._lgn_ids:
+            for start, stop, p in self._ranges[lid]:
+                if (partition is None or p == partition):
+                    ret.append((lid, start, stop))
+        return ret
+
+    def partition_of(self, lgn_id, k):
+        """
+        The partition of instance k of lgn_id
+        """
+        ranges = self._ranges.get(lgn_id, None)
+        if (not ranges):
+            return 0
+        idx = bisect.bisect_right(ranges, (k, float('inf'))) - 1
+        return ranges[max(idx, 0)][2]
+
+    @property
+    def partition_nodes(self):
+        """
+        The (node, island) of each partition, or None if not mapped yet
+        """
+        return self._part_nodes
+
+    def locate(self, oid):
+        """
+        The partition of the drop with the given oid, or None if the oid
+        does not belong to this graph
+        """
+        prefix = '{0}_'.format(self._ssid)
+        if (not oid.startswith(prefix)):
+            return None
+        lid, _, iid = oid[len(prefix):].partition('_')
+        lgn = self._lgn_by_str.get(lid, None)
+        if (lgn is None):
+            return None
+        # iid is '0/i/j/...', where each index may be followed by a
+        # multi-key GroupBy context ($...) or an extra drop suffix (-...)
+        try:
+            idx = [int(x.split('$')[0].split('-')[0]) for x in iid.split('/')[1:]]
+        except ValueError:
+            return None
+        shape = self._lg.instance_shape(lgn)
+        if (len(idx) != len(shape) or any(i >= n for i, n in zip(idx, shape))):
+            return None
+        k = int(np.ravel_multi_index(idx, shape)) if shape else 0
+        return self.partition_of(lgn.id, k)
+
+    def expand(self, ranges=None, peer_nodes=None):
+        """
+        Yields the concrete dropspecs of ranges (see `ranges`), all of them if
+        None. Each dropspec is the same as what LG.unroll_to_tpl makes (plus
+        its node and island if mapped), although only the drops in ranges
+        and their direct neighbours are ever created.
+
+        If peer_nodes (a dict) is given, the node of each of those neighbours
+        is recorded in it, keyed by oid
+        """
+        if (ranges is None):
+            ranges = self.ranges()
+        lg = self._lg
+        done_dict = lg._done_dict
+        for lid, start, stop in ranges:
+            lgn = done_dict[lid]
+            links = []
+            for link_idx, is_src in self._links.get(lid, []):
+                lk = lg._lg_links[link_idx]
+                other = done_dict[lk['to'] if is_src else lk['from']]
+                links.append((self._rule(link_idx), is_src, other))
+            for k in range(start, stop):
+                instance = lg.make_instance_drops(lgn, k)
+                drop = instance[0][0]
+                for rule, is_src, other in links:
+                    for j in (rule.targets(k) if is_src else rule.sources(k)):
+                        peer = lg.make_instance_drops(other, j)
+                        if (is_src):
+                            lg.link_instances(lgn, other, rule, drop, peer[0][0])
+                        else:
+                            lg.link_instances(other, lgn, rule, peer[0][0], drop)
+                        if (peer_nodes is not None and self._part_nodes is not None):
+                            peer_node = self._part_nodes[self.partition_of(other.id, j)][0]
+                            for d, e in peer:
+                                peer_nodes[d['oid']] = peer_node
+                                if (e is not None):
+                                    peer_nodes[e['oid']] = peer_node
+                drops = [d for d, _ in instance]
+                lg._cleanup_drops(lgn, drops)
+                drops += [e for _, e in instance if e is not None]
+                node = island = None
+                if (self._part_nodes is not None):
+                    node, island = self._part_nodes[self.partition_of(lid, k)]
+                for d in drops:
+                    lg._finalise_drop(d)
+                    if (node is not None):
+                        d['node'] = node
+                        d['island'] = island
+                    yield d
+
+    def to_json(self):
+        """
+        The compressed Physical Graph Template (a dict), see `from_json`
+        """
+        ret = {'ssid': self._ssid, 'lg': self._lg_json,
+               'num_partitions': self._num_parts,
+               'ranges': dict((lid, [list(r) for r in rs]) for lid, rs in self._ranges.items())}
+        if (self._part_nodes is not None):
+            ret['partition_nodes'] = [list(pn) for pn in self._part_nodes]
+        return ret
+
+    @staticmethod
+    def from_json(json_obj):
+        """
+        Re-creates the SymbolicPGT of `to_json`
+        """
+        ret = SymbolicPGT(json_obj['lg'], ssid=json_obj['ssid'])
+        ret._num_parts = json_obj.get('num_partitions', 0)
+        ranges = json_obj.get('ranges', {})
+        # JSON keys are strings
+        for lid in ret._lgn_ids:
+            rs = ranges.get(lid, ranges.get(str(lid), None))
+            if (rs is not None):
+                ret._ranges[lid] = [tuple(r) for r in rs]
+        if ('partition_nodes' in json_obj):
+            # nodes can be (host, events_port, rpc_port) tuples, which
+            # JSON turns into lists
+            def as_node(x):
+                return tuple(x) if isinstance(x, list) else x
+            ret._part_nodes = [(as_node(node), as_node(island))
+                               for node, island in json_obj['partition_nodes']]
+        return ret
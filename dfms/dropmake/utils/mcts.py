@@ -80,7 +80,6 @@ class DAGTree(object):
         Then calculate payout based on the objective function:
             the length of the critical path
         """
-        G = self._dag.copy()
         leng = self._leng
         # convert '98760' to [9, 8, 7, 6, 0]
         x = [int(ii) for ii in list(state_history[-1][:])]
@@ -88,9 +87,7 @@ class DAGTree(object):
         if (len(x) < leng): #padding
             x += [3] * (leng - len(x))
 
-        stuff = self._scheduler._partition_G(G, x)
-        lgl = stuff[0]
-        num_parts = stuff[1]
+        lgl, num_parts = self._scheduler.evaluate(x)
         # TODO add num_parts as the panelty score
         return lgl * -1
 
@@ -290,16 +290,58 @@ def gen_pg():
         print(traceback.format_exc())
         return "Fail to deploy physical graph: {0}".format(ex)
 
+# the query parameters of gen_pgt that make a difference in the PGT
+pgt_params = ['num_par', 'num_islands', 'par_label', 'algo', 'min_goal', 'ptype',
+              'max_load_imb', 'max_dop', 'time_greedy', 'deadline', 'topk',
+              'swarm_size', 'num_starts', 'num_workers']
+
+def _make_pgt(lg_name, part, mpp):
+    lg = LG(lg_path(lg_name))
+    drop_list = lg.unroll_to_tpl()
+    if (part is None):
+        return PGT(drop_list)
+    par_label = request.query.get('par_label')
+    algo = request.query.get('algo')
+    if ('metis' == algo):
+        min_goal = int(request.query.get('min_goal'))
+        ptype = int(request.query.get('ptype'))
+        ufactor = 100 - int(request.query.get('max_load_imb')) + 1
+        if (ufactor <= 0):
+            ufactor = 1
+        return MetisPGTP(drop_list, int(part), min_goal, par_label, ptype, ufactor, merge_parts=mpp)
+    elif ('mysarkar' == algo):
+        return MySarkarPGTP(drop_list, int(part), par_label, int(request.query.get('max_dop')), merge_parts=mpp)
+    elif ('min_num_parts' == algo):
+        time_greedy = 1 - float(request.query.get('time_greedy')) / 100.0 # assuming between 1 to 100
+        return MinNumPartsPGTP(drop_list, int(request.query.get('deadline')),
+        int(part), par_label, int(request.query.get('max_dop')),
+        merge_parts=mpp, optimistic_factor=time_greedy)
+    elif ('pso' == algo):
+        params = ['deadline', 'topk', 'swarm_size', 'num_starts', 'num_workers']
+        pars = [None, 30, 40, 1, 1]
+        for i, para in enumerate(params):
+            try:
+                pars[i] = int(request.query.get(para))
+            except:
+                continue
+        return PSOPGTP(drop_list, par_label, int(request.query.get('max_dop')),
+        deadline=pars[0], topk=pars[1], swarm_size=pars[2], merge_parts=mpp,
+        num_starts=pars[3], num_workers=pars[4])
+    else:
+        raise GraphException("Unknown partition algorithm: {0}".format(algo))
+
 @get('/gen_pgt')
 def gen_pgt():
     """
     RESTful interface for translating Logical Graphs to Physical Graphs
+
+    PGTs are cached by the content of the logical graph and the translation
+    parameters, so translating the same graph the same way twice reuses
+    the first PGT
     """
     lg_name = request.query.get('lg_name')
     if (lg_exists(lg_name)):
         try:
-            lg = LG(lg_path(lg_name))
-            drop_list = lg.unroll_to_tpl()
             part = request.query.get('num_par')
             try:
                 #print('num_islands', request.query.get('num_islands'))
@@ -307,48 +349,20 @@ def gen_pgt():
             except:
                 num_islands = 0
             mpp = num_islands > 0
-            if (part is None):
-                is_part = ''
-                pgt = PGT(drop_list)
-            else:
-                is_part = 'Partition'
-                par_label = request.query.get('par_label')
-                algo = request.query.get('algo')
-                if ('metis' == algo):
-                    min_goal = int(request.query.get('min_goal'))
-                    ptype = int(request.query.get('ptype'))
-                    ufactor = 100 - int(request.query.get('max_load_imb')) + 1
-                    if (ufactor <= 0):
-                        ufactor = 1
-                    pgt = MetisPGTP(drop_list, int(part), min_goal, par_label, ptype, ufactor, merge_parts=mpp)
-                elif ('mysarkar' == algo):
-                    pgt = MySarkarPGTP(drop_list, int(part), par_label, int(request.query.get('max_dop')), merge_parts=mpp)
-                elif ('min_num_parts' == algo):
-                    time_greedy = 1 - float(request.query.get('time_greedy')) / 100.0 # assuming between 1 to 100
-                    pgt = MinNumPartsPGTP(drop_list, int(request.query.get('deadline')),
-                    int(part), par_label, int(request.query.get('max_dop')),
-                    merge_parts=mpp, optimistic_factor=time_greedy)
-                elif ('pso' == algo):
-                    params = ['deadline', 'topk', 'swarm_size']
-                    pars = [None, 30, 40]
-                    for i, para in enumerate(params):
-                        try:
-                            pars[i] = int(request.query.get(para))
-                        except:
-                            continue
-                    pgt = PSOPGTP(drop_list, par_label, int(request.query.get('max_dop')),
-                    deadline=pars[0], topk=pars[1], swarm_size=pars[2], merge_parts=mpp)
+            is_part = '' if part is None else 'Partition'
+
+            with open(lg_path(lg_name), 'rb') as f:
+                lg_content = f.read()
+            params = dict((k, request.query.get(k)) for k in pgt_params if request.query.get(k) is not None)
+            key = pg_mgr.pgt_key(lg_content, params)
+            pgt_id = pg_mgr.pgt_id(lg_name, key)
+            pgt = pg_mgr.get_pgt(pgt_id)
+            if (pgt is None):
+                pgt = _make_pgt(lg_name, part, mpp)
+                if (mpp):
+                    pgt_id = pg_mgr.add_pgt(pgt, lg_name, num_islands=num_islands, key=key)
                 else:
-                    raise GraphException("Unknown partition algorithm: {0}".format(algo))
-            if (mpp):
-                pgt_id = pg_mgr.add_pgt(pgt, lg_name, num_islands=num_islands)
-                """
-                if ('mysarkar' == algo):
-                    pgt_id = pg_mgr.add_pgt(pgt, lg_name, num_islands=int(part))
-                elif ('metis' == algo):
-                """
-            else:
-                pgt_id = pg_mgr.add_pgt(pgt, lg_name)
+                    pgt_id = pg_mgr.add_pgt(pgt, lg_name, key=key)
             part_info = ' - '.join(['{0}:{1}'.format(k, v) for k, v in pgt.result().items()])
             tpl = file_as_string('pg_viewer.html')
             return template(tpl, pgt_view_json_name=pgt_id, partition_info=part_info, is_partition_page=is_part)
@@ -396,6 +410,8 @@ https://github.com/ICRAR/daliuge-logical-graphs
                       help="logical graph editor host (all by default)")
     parser.add_option("-p", "--port", action="store", type="int", dest="port", default=8084,
                       help="logical graph editor port (8084 by default)")
+    parser.add_option("-c", "--cache-size", action="store", type="int", dest="cache_size", default=256,
+                      help="memory used to keep physical graph templates, in MB (256 by default)")
 
     (options, args) = parser.parse_args(args)
 
@@ -414,7 +430,7 @@ https://github.com/ICRAR/daliuge-logical-graphs
     global pgt_dir
     pgt_dir = options.pgt_path
     global pg_mgr
-    pg_mgr = PGManager(pgt_dir)
+    pg_mgr = PGManager(pgt_dir, max_cache_size=options.cache_size * 1024 ** 2)
 
     # catch SIGTERM as SIGINT
     signal.signal(signal.SIGTERM, lambda x,y: os.kill(os.getpid(), signal.SIGINT))
@@ -118,21 +118,34 @@ configured (and/or hardcoded) DLM
 @author: rtobar
 '''
 
+import heapq
+import itertools
 import logging
+import os
 import random
 import string
 import threading
 import time
 
-from dfms import droputils
+from six.moves import queue as Queue  # @UnresolvedImport
+
 from dfms.ddap_protocol import DROPStates, DROPPhases, AppDROPStates
-from dfms.drop import ContainerDROP
+from dfms.drop import ContainerDROP, AbstractDROP, FileDROP
 from dfms.lifecycle import registry
 from dfms.lifecycle.hsm import manager
+from dfms.manager.session import SessionStates
 
 
 logger = logging.getLogger(__name__)
 
+# Replication priorities; lower values are served first
+REPLICATION_PRIORITY_RECOVERY = 0
+REPLICATION_PRIORITY_NORMAL = 1
+REPLICATION_PRIORITY_MIGRATION = 2
+
+# Size of the chunks in which DROP contents are copied during replication
+REPLICATION_BUFSIZE = 4 * 1024 * 1024
+
 class DataLifecycleManagerBackgroundTask(threading.Thread):
     '''
     A thread that periodically runs some of the methods on the given DLM until
@@ -198,11 +211,201 @@ class DropEventListener(object):
         elif event.type == 'status':
             if event.status == DROPStates.COMPLETED:
                 self._dlm.handleCompletedDrop(event.uid)
+            elif event.status == DROPStates.EXPIRED:
+                self._dlm.handleExpiredDrop(event.uid)
+
+class ConsumersCountdown(object):
+    '''
+    Keeps track of the consumers of an expire-after-use DROP that have not
+    finished yet, and tells the DLM when all of them are done.
+
+    Local consumers notify us via their execStatus events. Remote consumers
+    (i.e., proxies to DROPs living in other nodes) cannot do that, and need to
+    be checked periodically via `checkRemoteConsumers`.
+    '''
+
+    finishedStates = (AppDROPStates.FINISHED, AppDROPStates.ERROR)
+
+    def __init__(self, dlm, drop):
+        self._dlm = dlm
+        self._drop = drop
+        self._lock = threading.Lock()
+        self._local = [c for c in drop.consumers if isinstance(c, AbstractDROP)]
+        self._remote = [c for c in drop.consumers if not isinstance(c, AbstractDROP)]
+        self._pending = set(c.uid for c in self._local)
+        self._done = False
+
+    @property
+    def hasRemoteConsumers(self):
+        return bool(self._remote)
+
+    def start(self):
+        # Subscribe first, then check, so we don't miss any event
+        for c in self._local:
+            c.subscribe(self, 'execStatus')
+        for c in self._local:
+            if c.execStatus in self.finishedStates:
+                self._consumerFinished(c.uid)
+        self._checkDone()
+
+    def handleEvent(self, event):
+        if event.execStatus in self.finishedStates:
+            self._consumerFinished(event.uid)
+            self._checkDone()
+
+    def checkRemoteConsumers(self):
+        remote = self._remote
+        if remote:
+            remote = [c for c in remote if c.execStatus not in self.finishedStates]
+            self._remote = remote
+        self._checkDone()
+
+    def _consumerFinished(self, uid):
+        with self._lock:
+            self._pending.discard(uid)
+
+    def _checkDone(self):
+        with self._lock:
+            if self._done or self._pending or self._remote:
+                return
+            self._done = True
+        for c in self._local:
+            c.unsubscribe(self, 'execStatus')
+        self._dlm.handleConsumersFinished(self._drop)
+
+class ThroughputLimiter(object):
+    '''
+    Limits the rate at which bytes are written into a store. A limiter is
+    shared by all the replications targeting the same store; each of them
+    reserves a time slot for the bytes it is about to write and sleeps until
+    the end of its slot. A rate of 0 means no limit.
+    '''
+
+    def __init__(self, rate):
+        self._rate = float(rate)
+        self._next = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        if self._rate <= 0:
+            return
+        with self._lock:
+            now = time.time()
+            self._next = max(now, self._next) + nbytes / self._rate
+            delay = self._next - now
+        if delay > 0:
+            time.sleep(delay)
+
+class DROPReplicator(object):
+    '''
+    Replicates (or migrates) DROPs asynchronously using a bounded pool of
+    worker threads.
+    Replication requests are queued and served in order of priority (and in
+    arrival order within the same priority). The worker threads are started
+    with the first request, and stopped via `stop`.
+    '''
+
+    def __init__(self, dlm, workers, rate):
+        self._dlm = dlm
+        self._nworkers = max(workers, 1)
+        self._rate = rate
+        self._queue = Queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._workers = []
+        self._limiters = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._bytes = 0
+
+    def submit(self, drop, priority, migrate=False):
+        with self._lock:
+            if not self._workers:
+                self._startWorkers()
+            self._queued += 1
+        self._queue.put((priority, next(self._seq), drop, migrate))
+
+    def _startWorkers(self):
+        for i in range(self._nworkers):
+            t = threading.Thread(target=self._work, name="DLMReplicator-%d" % (i,))
+            t.daemon = True
+            t.start()
+            self._workers.append(t)
+
+    def stop(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for _ in workers:
+            # None sorts lower than any priority in python 2, but fails
+            # to compare in python 3, hence the explicit -1 priority
+            self._queue.put((-1, next(self._seq), None, False))
+        for t in workers:
+            t.join()
+
+    def _work(self):
+        while True:
+            _, _, drop, migrate = self._queue.get()
+            if drop is None:
+                break
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+            ok = False
+            try:
+                self._dlm._replicateNow(drop, migrate)
+                ok = True
+            except Exception:
+                logger.exception("Problem while replicating %r", drop)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    if ok:
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+                    if not self._queued and not self._running:
+                        self._idle.notify_all()
+
+    def limiter(self, store):
+        with self._lock:
+            if store not in self._limiters:
+                self._limiters[store] = ThroughputLimiter(self._rate)
+            return self._limiters[store]
+
+    def bytesReplicated(self, nbytes):
+        with self._lock:
+            self._bytes += nbytes
+
+    def wait(self, timeout=None):
+        '''
+        Waits until there are no replications pending, or until `timeout`
+        seconds have passed. Returns whether all replications are done.
+        '''
+        end = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while self._queued or self._running:
+                if end is None:
+                    self._idle.wait()
+                    continue
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+            return True
+
+    def getStatus(self):
+        with self._lock:
+            return {'workers': self._nworkers, 'queued': self._queued,
+                    'running': self._running, 'completed': self._completed,
+                    'failed': self._failed, 'bytes': self._bytes}
 
 class DataLifecycleManager(object):
 
     def __init__(self, **kwargs):
-        self._hsm = manager.HierarchicalStorageManager()
+        self._hsm = kwargs.get('hsm', None) or manager.HierarchicalStorageManager()
         self._reg = registry.InMemoryRegistry()
         self._listener = DropEventListener(self)
 
@@ -212,6 +415,15 @@ class DataLifecycleManager(object):
         # here
         self._drops = {}
 
+        # Expiration dates of COMPLETED DROPs are kept in a heap, so that each
+        # check only looks at the DROPs that are actually due to expire.
+        # Expire-after-use DROPs are put in the heap by their consumers'
+        # countdowns, and EXPIRED DROPs are queued for their deletion
+        self._expirations = []
+        self._expired = []
+        self._countdowns = {}
+        self._expirationLock = threading.Lock()
+
         self._checkPeriod = 10
         if 'checkPeriod' in kwargs:
             self._checkPeriod = float(kwargs['checkPeriod'])
@@ -220,6 +432,27 @@ class DataLifecycleManager(object):
         if 'cleanupPeriod' in kwargs:
             self._cleanupPeriod = float(kwargs['cleanupPeriod'])
 
+        # DROPs not read for coldAfter seconds are moved down the HSM. This is
+        # opt-in: moving a DROP deletes the original instance, so it's only
+        # done if a coldAfter value is given
+        self._movePeriod = self._cleanupPeriod
+        if 'movePeriod' in kwargs:
+            self._movePeriod = float(kwargs['movePeriod'])
+        self._coldAfter = None
+        if kwargs.get('coldAfter', None) is not None:
+            self._coldAfter = float(kwargs['coldAfter'])
+        self._moving = set()
+
+        # The sessions the DROPs belong to, if known
+        self._sessions = {}
+
+        # Replications are carried out by a pool of workers so they don't
+        # delay the delivery of the events that trigger them. The rate at which
+        # data is written into each store can be limited (in bytes/s)
+        replicationWorkers = int(kwargs.get('replicationWorkers', 4))
+        replicationRate = float(kwargs.get('replicationRate', 0))
+        self._replicator = DROPReplicator(self, replicationWorkers, replicationRate)
+
     def startup(self):
         # Spawn the background threads
         finishedEvent = threading.Event()
@@ -227,9 +460,14 @@ class DataLifecycleManager(object):
         dropChecker.start()
         dropGarbageCollector = DROPGarbageCollector(self, self._cleanupPeriod, finishedEvent)
         dropGarbageCollector.start()
+        dropMover = None
+        if self._coldAfter is not None:
+            dropMover = DROPMover(self, self._movePeriod, finishedEvent)
+            dropMover.start()
 
         self._dropChecker = dropChecker
         self._dropGarbageCollector = dropGarbageCollector
+        self._dropMover = dropMover
         self._finishedEvent = finishedEvent
 
     def cleanup(self):
@@ -239,10 +477,13 @@ class DataLifecycleManager(object):
         self._finishedEvent.set()
         self._dropChecker.join()
         self._dropGarbageCollector.join()
+        if self._dropMover:
+            self._dropMover.join()
+        self._replicator.stop()
 
         # Unsubscribe to all events coming from the DROPs
         for drop in self._drops.values():
-            drop.unsubscribe(self)
+            drop.unsubscribe(self._listener)
 
     #
     # Support for 'with' keyword
@@ -259,36 +500,45 @@ class DataLifecycleManager(object):
         logger.debug("Deleting DROP %r", drop)
         drop.delete()
         drop.status = DROPStates.DELETED
+        self._hsm.release(drop.uid)
 
     def deleteExpiredDrops(self):
-        for drop in list(self._drops.values()):
-            if drop.status == DROPStates.EXPIRED:
+        with self._expirationLock:
+            expired, self._expired = self._expired, []
+        for uid in expired:
+            drop = self._drops.get(uid, None)
+            if drop is not None and drop.status == DROPStates.EXPIRED:
                 self._deleteDrop(drop)
 
+    def _scheduleExpiration(self, uid, when):
+        with self._expirationLock:
+            heapq.heappush(self._expirations, (when, uid))
+
     def expireCompletedDrops(self):
-        now = time.time()
-        for drop in self._drops.values():
 
-            if drop.status != DROPStates.COMPLETED:
-                continue
+        # Remote consumers of expire-after-use DROPs don't notify us when they
+        # finish, so we need to ask them
+        for countdown in list(self._countdowns.values()):
+            countdown.checkRemoteConsumers()
 
-            # Expire-after-use: mark as expired if all consumers
-            # are finished using this DROP
-            if drop.expireAfterUse:
-                allDone = all([c.execStatus in [AppDROPStates.FINISHED, AppDROPStates.ERROR] for c in drop.consumers])
-                if not allDone:
-                    continue
+        now = time.time()
+        due = []
+        with self._expirationLock:
+            expirations = self._expirations
+            while expirations and expirations[0][0] < now:
+                due.append(heapq.heappop(expirations)[1])
+
+        for uid in due:
 
-            # Otherwise, we check the expiration date
-            # (if no lifespan was specified for the DROP, its expiration
-            # date will be -1 and it will be skipped)
-            elif drop.expirationDate == -1 or \
-                 now <= drop.expirationDate:
+            # The DROP might have been lost, deleted or expired by other means
+            drop = self._drops.get(uid, None)
+            if drop is None or drop.status != DROPStates.COMPLETED:
                 continue
 
             if drop.isBeingRead():
                 logger.info("%r has expired but is currently being read, " \
                              "will skip expiration for the time being", drop)
+                self._scheduleExpiration(uid, now)
                 continue
 
             # Finally!
@@ -333,7 +583,7 @@ class DataLifecycleManager(object):
                     logger.info("%r has still more than one replica, no action needed", drop)
                 elif len(replicas) == 1:
                     logger.info("Only one replica left for DROP %r, will create a new one", drop)
-                    self.replicateDrop(replicas[0])
+                    self.replicateDrop(replicas[0], priority=REPLICATION_PRIORITY_RECOVERY)
                 else:
                     definitelyLost = True
 
@@ -345,6 +595,9 @@ class DataLifecycleManager(object):
         # All those objects identified as lost have to go now
         for uid in toRemove:
             del self._drops[uid]
+            self._sessions.pop(uid, None)
+            self._countdowns.pop(uid, None)
+            self._hsm.release(uid)
 
     def moveDropsAround(self):
         '''
@@ -392,38 +645,104 @@ class DataLifecycleManager(object):
         # activity is really run from DROPs it would mean that DROPs depend on the
         # DLM, while the DLM manages DROPs.
 
-        for drop in self._drops.values:
+        # We go for the latter: cold DROPs are copied into a new instance in a
+        # slower tier, after which the original instance is deleted. The new
+        # instance can be found through the registry.
+        if self._coldAfter is None:
+            return
+
+        now = time.time()
+        for drop in list(self._drops.values()):
 
             # Don't touch these
-            if drop.isBeingRead():
+            if drop.uid in self._moving or drop.isBeingRead():
+                continue
+
+            # DROPs are still in use while their session runs, or while
+            # their consumers haven't finished with them
+            if not self._isUnused(drop):
                 continue
 
             # EXPIRED DROPs will soon be deleted
             # DELETED DROPs drop not exist anymore
-            if drop.status in (DROPStates.DELETED, DROPStates.EXPIRED):
+            # Other than COMPLETED DROPs are not ready to be moved yet
+            if drop.status != DROPStates.COMPLETED:
                 continue
 
             # 1. Data that is not being used anymore should be moved down in the
             #    hierarchy
             lastAccess = self._reg.getLastAccess(drop.oid)
-            timeUnread = time.time() - lastAccess
-            if lastAccess != -1 and timeUnread > 10:
+            timeUnread = now - lastAccess
+            if lastAccess != -1 and timeUnread > self._coldAfter:
                 self.moveDropDown(drop)
 
-    def addDrop(self, drop):
+    def _isUnused(self, drop):
+        session = self._sessions.get(drop.uid, None)
+        if session is not None and session.status != SessionStates.FINISHED:
+            return False
+        finishedStates = ConsumersCountdown.finishedStates
+        for c in drop.consumers + drop.streamingConsumers:
+            try:
+                if c.execStatus not in finishedStates:
+                    return False
+            except Exception:
+                logger.exception("Couldn't get the execStatus of %r, assuming it's still running", c)
+                return False
+        return True
+
+    def moveDropDown(self, drop):
+        '''
+        Queues the migration of `drop` into a store of a slower tier than the
+        one it currently lives in. Returns whether the migration was queued.
+        '''
+        store = self._hsm.getStoreOf(drop)
+        if store is None or drop.size is None:
+            return False
+        if self._hsm.getTier(store) == self._hsm.getTierCount() - 1:
+            return False
+
+        logger.debug("Moving %r down from %s", drop, store)
+        self._moving.add(drop.uid)
+        self._replicator.submit(drop, REPLICATION_PRIORITY_MIGRATION, migrate=True)
+        return True
+
+    def addDrop(self, drop, session=None):
 
         # Keep track of the DROP and subscribe to the events it generates
         self._drops[drop.uid] = drop
+        if session is not None:
+            self._sessions[drop.uid] = session
         drop.phase = DROPPhases.GAS
         drop.subscribe(self._listener)
         self._reg.addDrop(drop)
 
-        # TODO: We currently use a background thread that scans
-        #       all DROPs for their status and compares its expiration date
-        #       with the current time in order to determine which DROPs must be
-        #       moved to EXPIRED. We might want to explore other alternatives to
-        #       perform this task, like using threading.Timers (probably not) or
-        #       any other that doesn't mean looping over all DROPs
+        # DROPs that are already COMPLETED won't tell us about it anymore
+        if drop.status == DROPStates.COMPLETED:
+            self._hsm.track(drop)
+            self._watchExpiration(drop)
+
+    def _watchExpiration(self, drop):
+
+        # Expire-after-use: the DROP expires when all its consumers are
+        # finished using it
+        if drop.expireAfterUse:
+            countdown = ConsumersCountdown(self, drop)
+            if countdown.hasRemoteConsumers:
+                self._countdowns[drop.uid] = countdown
+            countdown.start()
+
+        # Otherwise we check the expiration date (if no lifespan was specified
+        # for the DROP its expiration date will be -1 and it never expires)
+        elif drop.expirationDate != -1:
+            self._scheduleExpiration(drop.uid, drop.expirationDate)
+
+    def handleConsumersFinished(self, drop):
+        self._countdowns.pop(drop.uid, None)
+        self._scheduleExpiration(drop.uid, time.time())
+
+    def handleExpiredDrop(self, uid):
+        with self._expirationLock:
+            self._expired.append(uid)
 
     def handleOpenedDrop(self, oid, uid):
         drop = self._drops[uid]
@@ -438,6 +757,9 @@ class DataLifecycleManager(object):
         # in a persistent storage media we don't need to save it again
 
         drop = self._drops[uid]
+        self._hsm.track(drop)
+        self._watchExpiration(drop)
+
         if drop.precious and self.isReplicable(drop):
             logger.debug("Replicating %r because it's precious", drop)
             try:
@@ -448,8 +770,11 @@ class DataLifecycleManager(object):
     def isReplicable(self, drop):
         return not isinstance(drop, ContainerDROP)
 
-    def replicateDrop(self, drop):
+    def replicateDrop(self, drop, priority=REPLICATION_PRIORITY_NORMAL):
         '''
+        Queues the replication of `drop`, which happens asynchronously.
+        Requests with lower `priority` values are served first.
+
         :param dfms.drop.AbstractDROP drop:
         '''
 
@@ -459,46 +784,160 @@ class DataLifecycleManager(object):
 
         # Get the size of the DROP. This cannot currently be done in some of them,
         # like in the AbstractDROP
-        size = drop.size
-        if size is None:
+        if drop.size is None:
             return
 
-        # Check which layer of the hsm should host the replicated copy
-        store = self._hsm.getSlowestStore()
-        availableSpace = store.getAvailableSpace()
+        self._replicator.submit(drop, priority)
 
-        if size > availableSpace:
-            raise Exception("Cannot replicate DROP to store %s: not enough space left")
+    def waitForReplications(self, timeout=None):
+        '''
+        Waits until all queued replications have been carried out, or until
+        `timeout` seconds have passed. Returns whether all of them are done.
+        '''
+        return self._replicator.wait(timeout)
 
-        # Create new DROP and write the contents of the original into it
-        # TODO: In a real world application this will probably happen in a separate
-        #       worker thread with a working queue, or in separate threads, one
-        #       for each replication task (or a mix of the two)
-        newDrop, newUid = self._replicate(drop, store)
+    def getReplicationStatus(self):
+        '''
+        Returns a dictionary with the number of queued, running, completed and
+        failed replications, and the amount of bytes replicated so far
+        '''
+        return self._replicator.getStatus()
+
+    def _replicateNow(self, drop, migrate=False):
+        try:
+            self._doReplicate(drop, migrate)
+        finally:
+            if migrate:
+                self._moving.discard(drop.uid)
 
-        # The DROPs (both) should now be tagged as SOLID
-        newDrop.phase = DROPPhases.SOLID
-        drop.phase = DROPPhases.SOLID
+    def _doReplicate(self, drop, migrate):
+
+        # The DROP might have been expired or deleted while queued
+        if drop.status != DROPStates.COMPLETED:
+            logger.debug("%r no longer COMPLETED, skipping its replication", drop)
+            return
+
+        # Replicas go to the slowest tier with enough space left, while
+        # migrated DROPs go to the next tier with enough space left
+        size = drop.size
+        newUid = self._newUid()
+        if migrate:
+            current = self._hsm.getStoreOf(drop)
+            minTier = self._hsm.getTier(current) + 1
+            store = self._hsm.allocate(newUid, size, minTier=minTier)
+        else:
+            store = self._hsm.allocate(newUid, size, slowestFirst=True)
+
+        if store is None:
+            raise Exception("Cannot replicate DROP %r: not enough space left in any store" % (drop,))
+
+        # Create new DROP and write the contents of the original into it
+        try:
+            newDrop = self._replicate(drop, store, newUid)
+        except:
+            self._hsm.release(newUid)
+            raise
+
+        if migrate:
+            newDrop.phase = drop.phase
+        else:
+            # The DROPs (both) should now be tagged as SOLID
+            newDrop.phase = DROPPhases.SOLID
+            drop.phase = DROPPhases.SOLID
 
         # Update our own registry
         self._drops[newUid] = newDrop
         self._reg.addDropInstance(newDrop)
-        self._reg.setDropPhase(drop, DROPPhases.SOLID)
+        if not migrate:
+            self._reg.setDropPhase(drop, DROPPhases.SOLID)
+
+        # The original instance of a migrated DROP is not needed anymore,
+        # unless somebody started reading it in the meanwhile
+        if migrate:
+            if drop.isBeingRead():
+                logger.info("%r is being read, will not delete it after moving it to %s", drop, store)
+            else:
+                self._deleteDrop(drop)
 
     def getDropUids(self, drop):
         return self._reg.getDropUids(drop)
 
-    def _replicate(self, drop, store):
-
+    def _newUid(self):
         # Dummy, but safe, new UID
-        newUid = 'uid:' + ''.join([random.SystemRandom().choice(string.ascii_letters + string.digits) for _ in range(10)])
+        return 'uid:' + ''.join([random.SystemRandom().choice(string.ascii_letters + string.digits) for _ in range(10)])
+
+    def _replicate(self, drop, store, newUid):
 
         logger.debug('Creating new DROP with uid %s from %r', newUid, drop)
 
-        # For the time being we manually copy the contents of the current DROP into it
-        newDrop = store.createDrop(drop.oid, newUid, expectedSize=drop.size, precious=drop.precious)
-        droputils.copyDropContents(drop, newDrop)
+        # The new DROP is marked as COMPLETED by ourselves after copying the
+        # contents, so we don't give it an expectedSize. File-to-file copies
+        # happen in the kernel when possible
+        newDrop = store.createDrop(drop.oid, newUid, precious=drop.precious)
+        limiter = self._replicator.limiter(store)
+        start = time.time()
+        if isinstance(drop, FileDROP) and isinstance(newDrop, FileDROP):
+            nbytes = self._copyFile(drop, newDrop, limiter)
+
+            # The data didn't go through the new DROP, so it doesn't know
+            # its size or checksum
+            newDrop.setCompleted()
+            newDrop.size = nbytes
+            if drop.checksum is not None:
+                newDrop.checksum = drop.checksum
+                newDrop.checksumType = drop.checksumType
+        else:
+            nbytes = self._copyContents(drop, newDrop, limiter)
+            newDrop.setCompleted()
+        self._replicator.bytesReplicated(nbytes)
+
+        # Learn how fast the stores involved are
+        elapsed = time.time() - start
+        store.recordWrite(nbytes, elapsed)
+        source = self._hsm.getStoreOf(drop)
+        if source is not None:
+            source.recordRead(nbytes, elapsed)
 
         logger.debug('%r successfully replicated to %r', drop, newDrop)
 
-        return newDrop, newUid
\ No newline at end of file
+        return newDrop
+
+    def _copyContents(self, drop, newDrop, limiter):
+        nbytes = 0
+        desc = drop.open()
+        try:
+            buf = drop.read(desc, REPLICATION_BUFSIZE)
+            while buf:
+                limiter.consume(len(buf))
+                newDrop.write(buf)
+                nbytes += len(buf)
+                buf = drop.read(desc, REPLICATION_BUFSIZE)
+        finally:
+            drop.close(desc)
+        return nbytes
+
+    def _copyFile(self, drop, newDrop, limiter):
+
+        # Opening the DROP flags it as being read while we copy the file
+        nbytes = 0
+        desc = drop.open()
+        try:
+            with open(drop.path, 'rb') as src, open(newDrop.path, 'wb') as dst:
+                if hasattr(os, 'sendfile'):
+                    infd, outfd = src.fileno(), dst.fileno()
+                    while True:
+                        sent = os.sendfile(outfd, infd, nbytes, REPLICATION_BUFSIZE)
+                        if not sent:
+                            break
+                        nbytes += sent
+                        limiter.consume(sent)
+                else:
+                    buf = src.read(REPLICATION_BUFSIZE)
+                    while buf:
+                        limiter.consume(len(buf))
+                        dst.write(buf)
+                        nbytes += len(buf)
+                        buf = src.read(REPLICATION_BUFSIZE)
+        finally:
+            drop.close(desc)
+        return nbytes
@@ -27,6 +27,7 @@ HSMs work and what they actually offer in terms of APIs.
 '''
 
 import logging
+import threading
 
 from dfms.lifecycle.hsm import store
 
@@ -34,21 +35,121 @@ from dfms.lifecycle.hsm import store
 logger = logging.getLogger(__name__)
 
 class HierarchicalStorageManager(object):
+    '''
+    Stores are organized in tiers, from the fastest to the slowest one, and
+    several stores can share the same tier. DROPs are placed into stores with
+    `allocate`, which takes into account the space left in each store and,
+    within a tier, how fast each store has proven to be for writing. The space
+    taken by the DROPs known to the HSM is accounted for incrementally.
+    '''
 
-    def __init__(self):
-        self._stores = []
-        self.addStore(store.MemoryStore())
-        self.addStore(store.FileSystemStore('/', '/tmp/daliuge_tfiles'))
+    def __init__(self, stores=None):
+        self._tiers = []
+        self._locations = {}
+        self._lock = threading.Lock()
+        if stores is None:
+            stores = [store.MemoryStore(), store.FileSystemStore('/', '/tmp/daliuge_tfiles')]
+        for s in stores:
+            self.addStore(s)
 
-    def addStore(self, newStore):
+    def addStore(self, newStore, tier=None):
         '''
+        Adds `newStore` as the new slowest tier of the HSM, or to the existing
+        `tier` if given
+
         @param newStore store.AbstractStore
         '''
         logger.debug("Adding store to HSM: " + str(newStore))
-        self._stores.append(newStore)
+        if tier is None:
+            self._tiers.append([newStore])
+        else:
+            self._tiers[tier].append(newStore)
+
+    def getStores(self):
+        return [s for tier in self._tiers for s in tier]
+
+    def getTierCount(self):
+        return len(self._tiers)
+
+    def getTier(self, theStore):
+        for i, tier in enumerate(self._tiers):
+            if theStore in tier:
+                return i
+        raise ValueError("%s is not part of this HSM" % (theStore,))
 
     def getSlowestStore(self):
         """
         :return store.AbstractStore:
         """
-        return self._stores[-1]
\ No newline at end of file
+        return self._tiers[-1][0]
+
+    def getStoreOf(self, drop):
+        '''
+        Returns the store holding the data of `drop`, or None if unknown
+        '''
+        with self._lock:
+            if drop.uid in self._locations:
+                return self._locations[drop.uid][0]
+        for s in self.getStores():
+            if s.contains(drop):
+                return s
+        return None
+
+    def _candidates(self, tier, size):
+        # Stores whose writing speed is still unknown go first so they get
+        # measured; the rest go in order of their expected writing time
+        def key(s):
+            speed = s.getWritingSpeed()
+            return (speed > 0, size / float(speed) if speed else 0, -s.getAvailableSpace())
+        return sorted([s for s in tier if s.getAvailableSpace() >= size], key=key)
+
+    def allocate(self, uid, size, minTier=0, slowestFirst=False):
+        '''
+        Reserves `size` bytes for the DROP with `uid` in a store from `minTier`
+        or any slower tier, and returns the store, or None if no store has
+        enough space. Tiers are visited from the fastest to the slowest one,
+        or the other way around if `slowestFirst` is given.
+        '''
+        tiers = list(range(minTier, len(self._tiers)))
+        if slowestFirst:
+            tiers.reverse()
+        for i in tiers:
+            for s in self._candidates(self._tiers[i], size):
+                if s.reserveSpace(size):
+                    with self._lock:
+                        self._locations[uid] = (s, size)
+                    return s
+        return None
+
+    def track(self, drop):
+        '''
+        Accounts for the space taken by a COMPLETED `drop` that was not
+        allocated via `allocate`, if it lives in one of our stores
+        '''
+        with self._lock:
+            if drop.uid in self._locations:
+                return
+        size = drop.size
+        theStore = self.getStoreOf(drop)
+        if not size or theStore is None:
+            return
+        theStore.reserveSpace(size, force=True)
+        with self._lock:
+            self._locations[drop.uid] = (theStore, size)
+
+    def release(self, uid):
+        '''
+        Gives back the space taken by the DROP with `uid`
+        '''
+        with self._lock:
+            location = self._locations.pop(uid, None)
+        if location:
+            theStore, size = location
+            theStore.releaseSpace(size)
+
+    def updateSpaces(self):
+        '''
+        Measures again the spaces of all stores
+        '''
+        for s in self.getStores():
+            s.updateSpaces()
@@ -31,6 +31,7 @@ from abc import ABCMeta, abstractmethod
 import json
 import logging
 import os
+import threading
 
 import psutil
 
@@ -39,22 +40,33 @@ from dfms.drop import FileDROP, InMemoryDROP, NgasDROP
 
 logger = logging.getLogger(__name__)
 
+# Weight given to new measurements when updating the reading/writing speeds
+SPEED_SMOOTHING = 0.3
+
 class AbstractStore(object):
     """
-    The abstract store implementation, see the subclasses for details
+    The abstract store implementation, see the subclasses for details.
+
+    The total and available spaces of a store are measured by `updateSpaces`.
+    Since measuring them can be expensive, in between measurements the
+    available space is accounted for incrementally via `reserveSpace` and
+    `releaseSpace`. Reading and writing speeds are learnt from the transfers
+    reported via `recordRead` and `recordWrite`.
     """
 
     __metaclass__ = ABCMeta
 
     def __init__(self, *args, **kwargs):
         super(AbstractStore, self).__init__()
+        self._spaceLock = threading.Lock()
         self._setTotalSpace(0)
         self._setAvailableSpace(0)
         self._setWritingSpeed(0)
         self._setReadingSpeed(0)
 
     def updateSpaces(self):
-        self._updateSpaces()
+        with self._spaceLock:
+            self._updateSpaces()
         if logger.isEnabledFor(logging.DEBUG):
             avail = self.getAvailableSpace()
             total = self.getTotalSpace()
@@ -80,6 +92,50 @@ class AbstractStore(object):
     def getTotalSpace(self):
         return self._totalSpace
 
+    def getWritingSpeed(self):
+        return self._writingSpeed
+
+    def getReadingSpeed(self):
+        return self._readingSpeed
+
+    def reserveSpace(self, nbytes, force=False):
+        """
+        Accounts for `nbytes` being stored in this store. Unless `force` is
+        given the reservation fails (and False is returned) if there is not
+        enough space available.
+        """
+        with self._spaceLock:
+            if not force and nbytes > self._availableSpace:
+                return False
+            self._setAvailableSpace(self._availableSpace - nbytes)
+            return True
+
+    def releaseSpace(self, nbytes):
+        """
+        Accounts for `nbytes` being removed from this store
+        """
+        with self._spaceLock:
+            self._setAvailableSpace(min(self._availableSpace + nbytes, self._totalSpace))
+
+    def recordWrite(self, nbytes, seconds):
+        if nbytes > 0 and seconds > 0:
+            self._setWritingSpeed(self._smooth(self._writingSpeed, nbytes / seconds))
+
+    def recordRead(self, nbytes, seconds):
+        if nbytes > 0 and seconds > 0:
+            self._setReadingSpeed(self._smooth(self._readingSpeed, nbytes / seconds))
+
+    def _smooth(self, current, measured):
+        if not current:
+            return measured
+        return (1 - SPEED_SMOOTHING) * current + SPEED_SMOOTHING * measured
+
+    def contains(self, drop):
+        """
+        Whether the data of `drop` is stored in this store
+        """
+        return False
+
     @abstractmethod
     def createDrop(self, oid, uid, **kwargs):
         pass
@@ -129,6 +185,9 @@ class FileSystemStore(AbstractStore):
         kwargs['dirname'] = self._savingDir
         return FileDROP(oid, uid, **kwargs)
 
+    def contains(self, drop):
+        return isinstance(drop, FileDROP) and _isUnder(drop.path, self._savingDir)
+
     def __str__(self):
         return self._mountPoint
 
@@ -150,6 +209,9 @@ class MemoryStore(AbstractStore):
     def createDrop(self, oid, uid, **kwargs):
         return InMemoryDROP(oid, uid, **kwargs)
 
+    def contains(self, drop):
+        return isinstance(drop, InMemoryDROP)
+
     def __str__(self):
         return 'Memory'
 
@@ -159,6 +221,7 @@ class NgasStore(AbstractStore):
     NgasDROPs and monitors the disks usage of the NGAS system.
     """
     def __init__(self, host=None, port=None, initialCheck=True):
+        super(NgasStore, self).__init__()
 
         try:
             from ngamsPClient import ngamsPClient  # @UnusedImport
@@ -225,6 +288,7 @@ class DirectoryStore(AbstractStore):
     __SIZE_FILE = 'SIZE'
 
     def __init__(self, dirName, initialize=False):
+        super(DirectoryStore, self).__init__()
 
         if not dirName:
             raise Exception("No directory given to DirectoryStore")
@@ -251,19 +315,22 @@ class DirectoryStore(AbstractStore):
         kwargs['dirname'] = self._dirName
         return FileDROP(oid, uid, **kwargs)
 
+    def contains(self, drop):
+        return isinstance(drop, FileDROP) and _isUnder(drop.path, self._dirName)
+
     def _updateSpaces(self):
         used = self._dirUsage(self._dirName)
         self._setAvailableSpace(self.getTotalSpace() - used)
 
     def _dirUsage(self, dirName):
         total = 0
-        for f in os.listdir(dirName):
-            if os.path.isdir(f):
-                total += self._dirUsage(os.path.join(dirName, f))
-            elif os.path.isfile(f):
+        sizeFile = os.path.join(dirName, self.__SIZE_FILE)
+        for root, _, files in os.walk(dirName):
+            for f in files:
+                path = os.path.join(root, f)
                 # Don't count our special file
-                if f != self.__SIZE_FILE or dirName != self._dirName:
-                    total += os.stat(os.path.join(dirName, f))
+                if path != sizeFile:
+                    total += os.path.getsize(path)
         return total
 
     @staticmethod
@@ -280,4 +347,7 @@ class DirectoryStore(AbstractStore):
                 f.write(str(size))
 
     def __str__(self):
-        return "dir:%s" % (self._dirName)
\ No newline at end of file
+        return "dir:%s" % (self._dirName)
+
+def _isUnder(path, dirName):
+    return os.path.abspath(path).startswith(os.path.abspath(dirName) + os.sep)
@@ -121,6 +121,7 @@ class InMemoryRegistry(Registry):
         dropRow.oid       = drop.oid
         dropRow.phase     = drop.phase
         dropRow.instances = {drop.uid: drop}
+        dropRow.accessTimes = []
         self._drops[dropRow.oid] = dropRow
 
     def addDropInstance(self, drop):
@@ -146,7 +147,7 @@ class InMemoryRegistry(Registry):
 
     def getLastAccess(self, oid):
         if oid in self._drops and self._drops[oid].accessTimes:
-            return self._drops[oid].accesTimes[-1]
+            return self._drops[oid].accessTimes[-1]
         else:
             return -1
 
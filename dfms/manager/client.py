@@ -24,12 +24,15 @@ import os
 
 from six.moves import urllib_parse as urllib  # @UnresolvedImport
 
+from dfms import utils
 from dfms.manager import constants
 from dfms.restutils import RestClient
 
 
 logger = logging.getLogger(__name__)
 compress = os.environ.get('DALIUGE_COMPRESSED_JSON', True)
+# Graphs are sent in binary form when possible; "json" forces JSON
+graph_format = os.environ.get('DALIUGE_GRAPH_FORMAT', 'msgpack' if utils.msgpack else 'json')
 
 class BaseDROPManagerClient(RestClient):
     """
@@ -66,9 +69,25 @@ class BaseDROPManagerClient(RestClient):
         Appends a graph to session `sessionId`, without creating its DROPs yet,
         but checking that the graph looks correct
         """
-        self._post_json('/sessions/%s/graph/append' % (urllib.quote(sessionId),), graphSpec, compress=compress)
+        url = '/sessions/%s/graph/append' % (urllib.quote(sessionId),)
+        if graph_format == 'msgpack':
+            self._post_msgpack(url, graphSpec, compress=compress)
+        else:
+            self._post_json(url, graphSpec, compress=compress)
         logger.debug('Successfully appended graph to session %s on %s:%s', sessionId, self.host, self.port)
 
+    def append_graph_template(self, sessionId, template, partitions=None):
+        """
+        Appends the drops of `partitions` (all of them if None) of the
+        symbolic Physical Graph Template `template` to session `sessionId`,
+        and returns how many drops were added
+        """
+        url = '/sessions/%s/graph/template' % (urllib.quote(sessionId),)
+        content = {'template': template, 'partitions': partitions}
+        ret = self._post_json(url, content, compress=compress)
+        logger.debug('Successfully appended graph template to session %s on %s:%s', sessionId, self.host, self.port)
+        return ret
+
     def destroy_session(self, sessionId):
         """
         Destroys session `sessionId`
@@ -131,6 +150,7 @@ class BaseDROPManagerClient(RestClient):
     destroySession = destroy_session
     getSessionStatus = session_status
     addGraphSpec = append_graph
+    addGraphTemplate = append_graph_template
     deploySession = deploy_session
     getGraphStatus = graph_status
     getGraphSize = graph_size
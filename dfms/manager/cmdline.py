@@ -35,10 +35,13 @@ import time
 import daemon
 from lockfile.pidlockfile import PIDLockFile
 
-from dfms import version, utils
+from dfms import version, utils, restutils
 from dfms.manager.composite_manager import DataIslandManager, MasterManager
 from dfms.manager.constants import NODE_DEFAULT_REST_PORT, \
-    ISLAND_DEFAULT_REST_PORT, MASTER_DEFAULT_REST_PORT, REPLAY_DEFAULT_REST_PORT
+    ISLAND_DEFAULT_REST_PORT, MASTER_DEFAULT_REST_PORT, REPLAY_DEFAULT_REST_PORT, \
+    NODE_DEFAULT_RPC_WORKERS, COMPOSITE_DEFAULT_MAX_FANOUT, \
+    COMPOSITE_DEFAULT_COMMAND_TIMEOUT, COMPOSITE_DEFAULT_STATUS_CACHE_TTL, \
+    REST_DEFAULT_WORKERS, REST_DEFAULT_MAX_QUEUED
 from dfms.manager.node_manager import NodeManager
 from dfms.manager.replay import ReplayManager, ReplayManagerServer
 from dfms.manager.rest import NMRestServer, CompositeManagerRestServer, \
@@ -57,7 +60,10 @@ def launchServer(opts):
     logger.info('Creating %s' % (dmName))
     dm = opts.dmType(*opts.dmArgs, **opts.dmKwargs)
 
-    server = opts.restType(dm, opts.maxreqsize)
+    serverOpts = {}
+    if opts.restBackend == 'pool':
+        serverOpts = {'workers': opts.restWorkers, 'max_queued': opts.restQueue}
+    server = opts.restType(dm, opts.maxreqsize, backend=opts.restBackend, **serverOpts)
 
     # Signal handling
     def handle_signal(signNo, stack_frame):
@@ -88,6 +94,12 @@ def addCommonOptions(parser, defaultPort):
                       dest="port", help = "The port to bind this instance on", default=defaultPort)
     parser.add_option("-m", "--max-request-size", action="store", type="int",
                       dest="maxreqsize", help="The maximum allowed HTTP request size, in MB", default=10)
+    parser.add_option(      "--rest-backend", action="store", type="choice", choices=list(restutils.server_backends),
+                      dest="restBackend", help="The server backend used to serve REST requests", default='pool')
+    parser.add_option(      "--rest-workers", action="store", type="int",
+                      dest="restWorkers", help="Number of threads serving REST requests (pool backend only)", default=REST_DEFAULT_WORKERS)
+    parser.add_option(      "--rest-queue", action="store", type="int",
+                      dest="restQueue", help="Maximum number of REST requests waiting to be served before new ones are rejected (pool backend only)", default=REST_DEFAULT_MAX_QUEUED)
     parser.add_option("-d", "--daemon", action="store_true",
                       dest="daemon", help="Run as daemon", default=False)
     parser.add_option(      "--cwd", action="store_true",
@@ -232,6 +244,8 @@ def dlgNM(parser, args):
                       dest="enable_luigi", help="Enable integration with Luigi. Disabled by default.", default=False)
     parser.add_option("-t", "--max-threads", action="store", type="int",
                       dest="max_threads", help="Max thread pool size used for executing drops. 0 (default) means no pool.", default=0)
+    parser.add_option("--rpc-workers", action="store", type="int",
+                      dest="rpc_workers", help="Number of threads used to serve RPC requests on drops", default=NODE_DEFAULT_RPC_WORKERS)
     (options, args) = parser.parse_args(args)
 
     # Add DM-specific options
@@ -244,7 +258,8 @@ def dlgNM(parser, args):
                         'host': options.host,
                         'error_listener': options.errorListener,
                         'enable_luigi': options.enable_luigi,
-                        'max_threads': options.max_threads}
+                        'max_threads': options.max_threads,
+                        'rpc_workers': options.rpc_workers}
     options.dmAcronym = 'NM'
     options.restType = NMRestServer
 
@@ -265,12 +280,23 @@ def dlgCompositeManager(parser, args, dmType, acronym, dmPort, dmRestServer):
                       dest="pkeyPath", help = "Path to the private SSH key to use when connecting to the nodes", default=None)
     parser.add_option("--dmCheckTimeout", action="store", type="int",
                       dest="dmCheckTimeout", help="Maximum timeout used when automatically checking for DM presence", default=10)
+    parser.add_option("--max-fanout", action="store", type="int",
+                      dest="maxFanout", help="Maximum number of DMs to send commands to in parallel", default=COMPOSITE_DEFAULT_MAX_FANOUT)
+    parser.add_option("--dmCommandTimeout", action="store", type="float",
+                      dest="dmCommandTimeout", help="Maximum time to wait for each DM to answer a command, 0 to wait forever", default=COMPOSITE_DEFAULT_COMMAND_TIMEOUT)
+    parser.add_option("--session-retention", action="store", type="float",
+                      dest="sessionRetention", help="Time after which finished sessions are destroyed, 0 to keep them forever", default=0)
+    parser.add_option("--status-cache-ttl", action="store", type="float",
+                      dest="statusCacheTTL", help="Time during which session and graph statuses are reused, 0 to always query the sub-DMs", default=COMPOSITE_DEFAULT_STATUS_CACHE_TTL)
     (options, args) = parser.parse_args(args)
 
     # Add DIM-specific options
     options.dmType = dmType
     options.dmArgs = ([s for s in options.nodes.split(',') if s],)
-    options.dmKwargs = {'pkeyPath': options.pkeyPath, 'dmCheckTimeout': options.dmCheckTimeout}
+    options.dmKwargs = {'pkeyPath': options.pkeyPath, 'dmCheckTimeout': options.dmCheckTimeout,
+                        'maxFanout': options.maxFanout, 'dmCommandTimeout': options.dmCommandTimeout,
+                        'sessionRetention': options.sessionRetention,
+                        'statusCacheTTL': options.statusCacheTTL}
     options.dmAcronym = acronym
     options.restType = dmRestServer
 
@@ -24,15 +24,20 @@ import collections
 import functools
 import logging
 import multiprocessing.pool
+import sys
 import threading
+import time
+
+import six
 
 from dfms import remote, graph_loader
-from dfms.ddap_protocol import DROPRel
+from dfms.ddap_protocol import DROPRel, DROPLinkType
 from dfms.exceptions import InvalidGraphException, DaliugeException, \
-    SubManagerException
+    SubManagerException, NoSessionException
 from dfms.manager.client import NodeManagerClient
 from dfms.manager.constants import ISLAND_DEFAULT_REST_PORT, NODE_DEFAULT_REST_PORT
 from dfms.manager.drop_manager import DROPManager
+from dfms.manager.session import SessionStates
 from dfms.utils import portIsOpen
 from dfms.manager import constants
 
@@ -44,7 +49,7 @@ def uid_for_drop(dropSpec):
         return dropSpec['uid']
     return dropSpec['oid']
 
-def sanitize_relations(interDMRelations, graph):
+def sanitize_relations(interDMRelations, uids):
 
     # TODO: Big change required to remove this hack here
     #
@@ -64,18 +69,238 @@ def sanitize_relations(interDMRelations, graph):
     # should probably change the requirement on the physical graphs sent by
     # users to always require an UID, and optionally an OID, and then change
     # all this code to immediately use those UIDs instead.
+    #
+    # `uids` maps the OIDs of drops to their UIDs, and needs to contain only
+    # those that are different
     newDMRelations = []
     for rel in interDMRelations:
-        lhs = uid_for_drop(graph[rel.lhs])
-        rhs = uid_for_drop(graph[rel.rhs])
+        lhs = uids.get(rel.lhs, rel.lhs)
+        rhs = uids.get(rel.rhs, rel.rhs)
         new_rel = DROPRel(lhs, rel.rel, rhs)
         newDMRelations.append(new_rel)
     interDMRelations[:] = newDMRelations
 
-def group_by_node(uids, graph):
+class DropIndex(object):
+    """
+    A compact index of the drops of a session, recording only the node each
+    drop lives in. Node names are interned, so each drop costs only its UID
+    and a reference to its node's name. OIDs are recorded only for the drops
+    whose UID is different.
+    """
+
+    def __init__(self):
+        self._nodes = {}
+        self._nodeNames = {}
+        self._keysSize = 0
+        self.uids = {}
+
+    def add(self, oid, uid, node):
+        if node not in self._nodeNames:
+            self._nodeNames[node] = node
+            self._keysSize += sys.getsizeof(node)
+        node = self._nodeNames[node]
+        self._nodes[uid] = node
+        self._keysSize += sys.getsizeof(uid)
+        if uid != oid:
+            self.uids[oid] = uid
+            self._keysSize += sys.getsizeof(oid)
+
+    def memory(self):
+        """
+        An estimation of the memory used by this index, in bytes
+        """
+        return sys.getsizeof(self._nodes) + sys.getsizeof(self._nodeNames) + \
+               sys.getsizeof(self.uids) + self._keysSize
+
+    def __getitem__(self, uid):
+        return self._nodes[uid]
+
+    def __contains__(self, uid):
+        return uid in self._nodes
+
+    def __len__(self):
+        return len(self._nodes)
+
+# Approximate size of a relationship held by a CompositeSession
+_REL_SIZE = sys.getsizeof(DROPRel('', '', ''))
+
+# Relationships where events flow from the rhs to the lhs drop, and vice versa
+_EVT_TO_LHS = (DROPLinkType.CONSUMER, DROPLinkType.STREAMING_CONSUMER, DROPLinkType.OUTPUT)
+_EVT_TO_RHS = (DROPLinkType.INPUT, DROPLinkType.STREAMING_INPUT, DROPLinkType.PRODUCER)
+
+class CompositeSession(object):
+    """
+    The state a CompositeManager keeps about one of its sessions: the index
+    of its drops, and the relationships between drops of different nodes
+    which need to be established by the NMs. Sessions are eventually evicted
+    by their CompositeManager after they finish.
+    """
+
+    def __init__(self, sessionId):
+        self.sessionId = sessionId
+        self.index = DropIndex()
+        self.drop_rels = collections.defaultdict(functools.partial(collections.defaultdict, list))
+        self.hosts = collections.defaultdict(set)
+        self.templates = []
+        self.created = time.time()
+        self.finished = None
+        self._nrels = 0
+        self._nentries = 0
+
+    def addRelationship(self, rel):
+        """
+        Records `rel` for the nodes of its two drops; relationships between
+        drops on the same node are recorded only once
+        """
+        rhn = self.index[rel.rhs]
+        lhn = self.index[rel.lhs]
+        self.drop_rels[lhn][rhn].append(rel)
+        self._nrels += 1
+        self._nentries += 1
+        if lhn != rhn:
+            self.drop_rels[rhn][lhn].append(rel)
+            self._nentries += 1
+
+    def locate(self, uid):
+        """
+        Returns the node holding drop `uid`, or None if unknown
+        """
+        if uid in self.index:
+            return self.index[uid]
+        for template in self.templates:
+            partition = template.locate(uid)
+            if partition is not None:
+                return template.partition_nodes[partition][0]
+        return None
+
+    def downstreamNodes(self, nodes):
+        """
+        Returns, for each of `nodes`, the set of nodes that can be reached by
+        the events fired by its drops, including the node itself
+        """
+        if self.templates:
+            # The relationships of drops added via graph templates are known
+            # only by the NMs, so any node can be reached
+            all_nodes = set(node for host_nodes in self.hosts.values() for node in host_nodes)
+            return {node: all_nodes | set([node]) for node in nodes}
+
+        edges = collections.defaultdict(set)
+        for rels_by_node in self.drop_rels.values():
+            for rels in rels_by_node.values():
+                for rel in rels:
+                    if rel.rel in _EVT_TO_LHS:
+                        src, dst = self.index[rel.rhs], self.index[rel.lhs]
+                    elif rel.rel in _EVT_TO_RHS:
+                        src, dst = self.index[rel.lhs], self.index[rel.rhs]
+                    else:
+                        continue
+                    if src != dst:
+                        edges[src].add(dst)
+
+        downstream = {}
+        for node in nodes:
+            reached = set([node])
+            to_visit = [node]
+            while to_visit:
+                for dst in edges[to_visit.pop()]:
+                    if dst not in reached:
+                        reached.add(dst)
+                        to_visit.append(dst)
+            downstream[node] = reached
+        return downstream
+
+    @property
+    def relationships(self):
+        return set([z for x in self.drop_rels.values() for y in x.values() for z in y])
+
+    def memory(self):
+        """
+        An estimation of the memory used by this session, in bytes
+        """
+        return self.index.memory() + self._nrels * _REL_SIZE + self._nentries * 8
+
+    def toDict(self):
+        return {'drops': len(self.index), 'relationships': self._nrels,
+                'memory': self.memory(), 'created': self.created,
+                'finished': self.finished}
+
+class CoalescingCache(object):
+    """
+    A cache whose values are considered fresh for `ttl` seconds. While a value
+    is being computed, other threads asking for the same key wait for that
+    computation to finish instead of starting their own, so any number of
+    concurrent requests for the same key result in a single computation.
+    Cached values are shared, and therefore must not be modified.
+    """
+
+    class _Entry(object):
+        def __init__(self):
+            self.done = threading.Event()
+            self.value = None
+            self.error = None
+            self.time = None
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        """
+        Returns the value for `key`, calling `compute` to get a new one if
+        the cached value is too old or missing
+        """
+        if self.ttl <= 0:
+            return compute()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            fresh = entry is not None and (not entry.done.is_set() or time.time() - entry.time < self.ttl)
+            if not fresh:
+                entry = self._entries[key] = CoalescingCache._Entry()
+                computing = True
+            else:
+                computing = False
+
+        if computing:
+            try:
+                entry.value = compute()
+            except Exception as e:
+                entry.error = e
+                # Errors are not cached, only shared with those waiting
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+                raise
+            finally:
+                entry.time = time.time()
+                entry.done.set()
+            return entry.value
+
+        entry.done.wait()
+        if entry.error is not None:
+            raise entry.error
+        return entry.value
+
+    def invalidate(self, sessionId):
+        """
+        Forgets the values of all keys whose second element is `sessionId`
+        """
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == sessionId]:
+                del self._entries[key]
+
+def _all_finished(status):
+    # Session statuses of composite managers are dictionaries of the statuses
+    # of their sub-DMs
+    if isinstance(status, dict):
+        return bool(status) and all(_all_finished(s) for s in status.values())
+    return status == SessionStates.FINISHED
+
+def group_by_node(uids, nodes):
     uids_by_node = collections.defaultdict(list)
     for uid in uids:
-        uids_by_node[graph[uid]['node']].append(uid)
+        uids_by_node[nodes[uid]].append(uid)
     return uids_by_node
 
 class CompositeManager(DROPManager):
@@ -101,7 +326,11 @@ class CompositeManager(DROPManager):
 
     __metaclass__ = abc.ABCMeta
 
-    def __init__(self, dmPort, partitionAttr, dmExec, subDmId, dmHosts=[], pkeyPath=None, dmCheckTimeout=10):
+    def __init__(self, dmPort, partitionAttr, dmExec, subDmId, dmHosts=[], pkeyPath=None, dmCheckTimeout=10,
+                 maxFanout=constants.COMPOSITE_DEFAULT_MAX_FANOUT,
+                 dmCommandTimeout=constants.COMPOSITE_DEFAULT_COMMAND_TIMEOUT,
+                 sessionRetention=0,
+                 statusCacheTTL=0):
         """
         Creates a new CompositeManager. The sub-DMs it manages are to be located
         at `dmHosts`, and should be listening on port `dmPort`.
@@ -117,19 +346,35 @@ class CompositeManager(DROPManager):
                 of `None` means that the default path should be used
         :param: dmCheckTimeout The timeout used before giving up and declaring
                 a sub-DM as not-yet-present in a given host
+        :param: maxFanout The maximum number of sub-DMs to send commands to in
+                parallel
+        :param: dmCommandTimeout The time to wait for each sub-DM to answer
+                a command before declaring it as failed; 0 means forever
+        :param: sessionRetention The time after which finished sessions are
+                destroyed; 0 means never
+        :param: statusCacheTTL The time during which the statuses of sessions
+                and graphs obtained from the sub-DMs are reused; 0 means
+                the sub-DMs are queried every time
         """
         self._dmPort = dmPort
         self._partitionAttr = partitionAttr
         self._dmExec = dmExec
         self._subDmId = subDmId
         self._dmHosts = dmHosts
-        self._graph = {}
-        self._drop_rels = {}
+        self._sessions = {}
         self._sessionIds = [] # TODO: it's still unclear how sessions are managed at the composite-manager level
+        self._sessionRetention = sessionRetention
+        self._statusCache = CoalescingCache(statusCacheTTL)
         self._pkeyPath = pkeyPath
         self._dmCheckTimeout = dmCheckTimeout
-        n_threads = max(1,min(len(dmHosts),20))
-        self._tp = multiprocessing.pool.ThreadPool(n_threads)
+        self._dmCommandTimeout = dmCommandTimeout
+        self._graphBatchSize = constants.COMPOSITE_DEFAULT_GRAPH_BATCH_SIZE
+        self._maxFanout = max(1, maxFanout)
+        self._tp = None
+        self._tpSize = 0
+        self._oldTps = []
+        self._tpLock = threading.Lock()
+        self._resizeThreadPool(len(dmHosts))
 
         # The list of bottom-level nodes that are covered by this manager
         # This list is different from the dmHosts, which are the machines that
@@ -138,6 +383,7 @@ class CompositeManager(DROPManager):
         self._nodes = []
 
         self.startDMChecker()
+        self.startSessionChecker()
 
     def startDMChecker(self):
         self._dmCheckerEvt = threading.Event()
@@ -149,11 +395,80 @@ class CompositeManager(DROPManager):
             self._dmCheckerEvt.set()
             self._dmCheckerThread.join()
 
+    def startSessionChecker(self):
+        self._sessionCheckerEvt = threading.Event()
+        self._sessionCheckerThread = None
+        if self._sessionRetention > 0:
+            self._sessionCheckerThread = threading.Thread(name='SessionChecker Thread', target=self._checkSessions)
+            self._sessionCheckerThread.start()
+
+    def stopSessionChecker(self):
+        if not self._sessionCheckerEvt.isSet():
+            self._sessionCheckerEvt.set()
+            if self._sessionCheckerThread:
+                self._sessionCheckerThread.join()
+
+    def _checkSessions(self):
+        period = min(self._sessionRetention, 60)
+        while not self._sessionCheckerEvt.wait(period):
+            self.evictFinishedSessions()
+
+    def evictFinishedSessions(self):
+        """
+        Destroys the sessions that finished more than our retention period ago
+        """
+        now = time.time()
+        for session in list(self._sessions.values()):
+            sessionId = session.sessionId
+            if session.finished is None:
+                try:
+                    if _all_finished(self.getSessionStatus(sessionId)):
+                        session.finished = now
+                except Exception:
+                    logger.warning("Couldn't get the status of session %s, will try again later", sessionId)
+                    continue
+            if session.finished is not None and now - session.finished >= self._sessionRetention:
+                logger.info("Evicting session %s, finished %.2f [s] ago", sessionId, now - session.finished)
+                try:
+                    self.destroySession(sessionId)
+                except Exception:
+                    logger.exception("Error while evicting session %s, will try again later", sessionId)
+
+    def _getSession(self, sessionId):
+        if sessionId not in self._sessions:
+            raise NoSessionException(sessionId)
+        return self._sessions[sessionId]
+
+    def getSessionsInfo(self):
+        """
+        Returns the number of drops and relationships, the estimated memory
+        footprint and the creation and finishing times of each session held by
+        this manager
+        """
+        return {sessionId: session.toDict() for sessionId, session in list(self._sessions.items())}
+
     # Explicit shutdown
     def shutdown(self):
         self.stopDMChecker()
-        self._tp.close()
-        self._tp.join()
+        self.stopSessionChecker()
+        for tp in self._oldTps + [self._tp]:
+            tp.close()
+            tp.join()
+
+    def _resizeThreadPool(self, nHosts):
+        """
+        Makes sure the thread pool used to send commands to the sub-DMs can
+        talk to `nHosts` of them at once (up to our maximum fan-out). Previous
+        pools might still be in use, so they are closed only on shutdown
+        """
+        size = max(1, min(nHosts, self._maxFanout))
+        with self._tpLock:
+            if size > self._tpSize:
+                if self._tp is not None:
+                    self._oldTps.append(self._tp)
+                self._tp = multiprocessing.pool.ThreadPool(size)
+                self._tpSize = size
+            return self._tp
 
     def _checkDM(self):
         while True:
@@ -229,7 +544,7 @@ class CompositeManager(DROPManager):
     # If "collect" is given, then individual results are also kept in the given
     # structure, which is either a dictionary or a list
     #
-    def _do_in_host(self, action, sessionId, exceptions, f, collect, port, iterable):
+    def _do_in_host(self, action, sessionId, f, port, iterable):
 
         host = iterable
         if isinstance(iterable, (list, tuple)):
@@ -238,25 +553,98 @@ class CompositeManager(DROPManager):
         try:
             self.ensureDM(host, port)
             with self.dmAt(host, port) as dm:
-                res = f(dm, iterable, sessionId)
-
-            if isinstance(collect, dict):
-                collect.update(res)
-            elif isinstance(collect, list):
-                collect.append(res)
-
-        except Exception as e:
-            exceptions[host] = e
+                return f(dm, iterable, sessionId)
+        except Exception:
             logger.exception("Error while %s on host %s, session %s", action, host, sessionId)
+            raise
 
     def replicate(self, sessionId, f, action, collect=None, iterable=None, port=None):
         """
-        Replicates the given function call on each of the underlying drop managers
+        Replicates the given function call on each of the underlying drop managers.
+
+        Calls are made in parallel (up to our maximum fan-out), and each of
+        them is given at most our command timeout to finish. The results of
+        the calls that succeed are still collected when others fail, in which
+        case all the errors are reported together via a SubManagerException.
         """
-        thrExs = {}
-        iterable = iterable or self._dmHosts
+        iterable = list(iterable or self._dmHosts)
         port = port or self._dmPort
-        self._tp.map(functools.partial(self._do_in_host, action, sessionId, thrExs, f, collect, port), iterable)
+        tp = self._resizeThreadPool(len(iterable))
+        results = [self._submit(tp, sessionId, f, action, port, item) for item in iterable]
+        self._collect(sessionId, action, results, collect)
+
+    def iterate(self, sessionId, f, action, window=constants.COMPOSITE_DEFAULT_STREAM_WINDOW):
+        """
+        Like `replicate`, but yields the result of each call on the underlying
+        drop managers instead of collecting them all. Only `window` calls are
+        in flight at any given time, so at most that many results are held in
+        memory. Errors are reported via a SubManagerException once all the
+        successful results have been yielded.
+        """
+        hosts = list(self._dmHosts)
+        tp = self._resizeThreadPool(min(window, len(hosts)))
+        timeout = self._dmCommandTimeout or None
+        pending = collections.deque()
+        thrExs = {}
+        hosts = iter(hosts)
+        while True:
+            for host in hosts:
+                pending.append(self._submit(tp, sessionId, f, action, self._dmPort, host))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                break
+            host, res = pending.popleft()
+            try:
+                r = res.get(timeout)
+            except multiprocessing.TimeoutError:
+                msg = "No answer from %s after %.2f [s] while %s" % (host, timeout, action)
+                logger.error(msg)
+                thrExs[host] = DaliugeException(msg)
+                continue
+            except Exception as e:
+                thrExs[host] = e
+                continue
+            yield r
+
+        if thrExs:
+            msg = "More than one error occurred while %s on session %s" % (action, sessionId)
+            raise SubManagerException(msg, thrExs)
+
+    def _submit(self, tp, sessionId, f, action, port, item, callback=None):
+        host = item[0] if isinstance(item, (list, tuple)) else item
+        def do_in_host():
+            try:
+                return self._do_in_host(action, sessionId, f, port, item)
+            finally:
+                if callback:
+                    callback()
+        return host, tp.apply_async(do_in_host)
+
+    def _collect(self, sessionId, action, results, collect=None):
+        thrExs = {}
+        timeout = self._dmCommandTimeout
+        deadline = time.time() + timeout if timeout else None
+        for host, res in results:
+            try:
+                if deadline is None:
+                    r = res.get()
+                else:
+                    r = res.get(max(0, deadline - time.time()))
+            except multiprocessing.TimeoutError:
+                msg = "No answer from %s after %.2f [s] while %s" % (host, timeout, action)
+                logger.error(msg)
+                thrExs[host] = DaliugeException(msg)
+                continue
+            except Exception as e:
+                thrExs[host] = e
+                continue
+
+            if isinstance(collect, dict):
+                collect.update(r)
+            elif isinstance(collect, list):
+                collect.append(r)
+
         if thrExs:
             msg = "More than one error occurred while %s on session %s" % (action, sessionId)
             raise SubManagerException(msg, thrExs)
@@ -276,6 +664,8 @@ class CompositeManager(DROPManager):
         self.replicate(sessionId, self._createSession, "creating sessions")
         logger.info('Successfully created session %s in all hosts', sessionId)
         self._sessionIds.append(sessionId)
+        self._sessions[sessionId] = CompositeSession(sessionId)
+        self._statusCache.invalidate(sessionId)
 
     def _destroySession(self, dm, host, sessionId):
         dm.destroySession(sessionId)
@@ -288,6 +678,8 @@ class CompositeManager(DROPManager):
         logger.info('Destroying Session %s in all hosts', sessionId)
         self.replicate(sessionId, self._destroySession, "creating sessions")
         self._sessionIds.remove(sessionId)
+        self._sessions.pop(sessionId, None)
+        self._statusCache.invalidate(sessionId)
 
     def _add_node_subscriptions(self, dm, host_and_subscriptions, sessionId):
         host, subscriptions = host_and_subscriptions
@@ -300,13 +692,42 @@ class CompositeManager(DROPManager):
         logger.info("Successfully appended graph to session %s on %s", sessionId, host)
 
     def addGraphSpec(self, sessionId, graphSpec):
+        """
+        Adds `graphSpec` to session `sessionId`. `graphSpec` can be any
+        iterable of drop specifications, including one that parses them as
+        they arrive; the drop specifications are sent to their DMs in batches
+        while the rest of the graph is still being read, so only an index of
+        the graph (and not the graph itself) is kept in memory.
+
+        Note that, unlike with a single DM, an invalid drop specification found
+        at the middle of `graphSpec` doesn't prevent the previous ones from
+        being added to the session.
+        """
 
         # The first step is to break down the graph into smaller graphs that
         # belong to the same host, so we can submit that graph into the individual
         # DMs. For this we need to make sure that our graph has a the correct
-        # attribute set
+        # attribute set.
+        # The relationships between drops that end up in different batches are
+        # removed from the batches and recorded separately
         logger.info('Separating graph')
+        session = self._getSession(sessionId)
+        index = session.index
+        action = "appending graphSpec to individual DMs"
+        tp = self._resizeThreadPool(len(self._dmHosts))
+        inflight = threading.BoundedSemaphore(self._maxFanout)
+        results = []
+        inter_partition_rels = []
         perPartition = collections.defaultdict(list)
+
+        def submit(partition, dropSpecs):
+            inter_partition_rels.extend(graph_loader.removeUnmetRelationships(dropSpecs))
+            inflight.acquire()
+            results.append(self._submit(tp, sessionId, self._addGraphSpec, action,
+                                        self._dmPort, (partition, dropSpecs),
+                                        callback=inflight.release))
+
+        n = 0
         for dropSpec in graphSpec:
             if self._partitionAttr not in dropSpec:
                 msg = "Drop %s doesn't specify a %s attribute" % (dropSpec['oid'], self._partitionAttr)
@@ -317,37 +738,103 @@ class CompositeManager(DROPManager):
                 msg = "Drop %s's %s %s does not belong to this DM" % (dropSpec['oid'], self._partitionAttr, partition)
                 raise InvalidGraphException(msg)
 
-            perPartition[partition].append(dropSpec)
+            # Index the drop; we only need to know where it lives
+            uid = uid_for_drop(dropSpec)
+            index.add(dropSpec['oid'], uid, dropSpec.get('node'))
+            session.hosts[partition].add(index[uid])
+            n += 1
 
-            # Add the drop specs to our graph
-            self._graph[uid_for_drop(dropSpec)] = dropSpec
+            batch = perPartition[partition]
+            batch.append(dropSpec)
+            if len(batch) >= self._graphBatchSize:
+                submit(partition, batch)
+                perPartition[partition] = []
 
-        # At each partition the relationships between DROPs should be local at the
-        # moment of submitting the graph; thus we record the inter-partition
-        # relationships separately and remove them from the original graph spec
-        inter_partition_rels = []
-        for dropSpecs in perPartition.values():
-            inter_partition_rels += graph_loader.removeUnmetRelationships(dropSpecs)
-        sanitize_relations(inter_partition_rels, self._graph)
+        for partition, batch in perPartition.items():
+            if batch:
+                submit(partition, batch)
+        del perPartition
+
+        logger.info('Adding individual graphSpec of session %s to each DM', sessionId)
+        try:
+            self._collect(sessionId, action, results)
+        finally:
+            self._statusCache.invalidate(sessionId)
+        logger.info('Successfully added individual graphSpec of session %s (%d drops) to each DM', sessionId, n)
+
+        # Relationships are expressed in terms of OIDs, but we work with UIDs
+        sanitize_relations(inter_partition_rels, index.uids)
         logger.info('Removed (and sanitized) %d inter-dm relationships', len(inter_partition_rels))
 
         # Store the inter-partition relationships; later on they have to be
         # communicated to the NMs so they can establish them as needed.
-        drop_rels = collections.defaultdict(functools.partial(collections.defaultdict, list))
+        # Graphs can be appended in several parts, so we accumulate them.
+        # Relationships between drops of different parts that end up in the
+        # same node are sent only once to that node, which links them locally
         for rel in inter_partition_rels:
-            rhn = self._graph[rel.rhs]['node']
-            lhn = self._graph[rel.lhs]['node']
-            drop_rels[lhn][rhn].append(rel)
-            drop_rels[rhn][lhn].append(rel)
+            session.addRelationship(rel)
 
-        self._drop_rels[sessionId] = drop_rels
-        logger.debug("Calculated NM-level drop relationships: %r", drop_rels)
+        logger.debug("Calculated NM-level drop relationships: %r", session.drop_rels)
 
-        # Create the individual graphs on each DM now that they are correctly
-        # separated.
-        logger.info('Adding individual graphSpec of session %s to each DM', sessionId)
-        self.replicate(sessionId, self._addGraphSpec, "appending graphSpec to individual DMs", iterable=perPartition.items())
-        logger.info('Successfully added individual graphSpec of session %s to each DM', sessionId)
+    def _addGraphTemplate(self, dm, host_and_partitions, sessionId):
+        host, (template, partitions) = host_and_partitions
+        n = dm.addGraphTemplate(sessionId, template, partitions)
+        logger.info("Successfully expanded %d partitions of graph template in session %s on %s", len(partitions), sessionId, host)
+        return n
+
+    def addGraphTemplate(self, sessionId, template, partitions=None):
+        """
+        Adds the drops of `partitions` (all of them if None) of `template`, a
+        mapped symbolic Physical Graph Template (see
+        `dfms.dropmake.symbolic_pgt`), to session `sessionId`.
+
+        Instead of drop specifications, each underlying DM receives the
+        template itself and the partitions it is responsible for, and the
+        drop specifications are expanded at the bottom of the hierarchy, in
+        parallel. Neither the drops nor the relationships between drops of
+        different nodes are indexed here, so the time and memory this takes
+        do not depend on the size of the graph. Returns the number of drops
+        added.
+        """
+        from dfms.dropmake.symbolic_pgt import SymbolicPGT
+
+        session = self._getSession(sessionId)
+        spgt = SymbolicPGT.from_json(template)
+        part_nodes = spgt.partition_nodes
+        if part_nodes is None:
+            raise InvalidGraphException("The graph template has not been mapped to nodes")
+        if partitions is None:
+            partitions = range(spgt.num_partitions)
+
+        partsPerHost = collections.defaultdict(list)
+        for p in partitions:
+            node, island = part_nodes[p]
+            host = node if self._partitionAttr == 'node' else island
+            if host not in self._dmHosts:
+                msg = "Partition %d's %s %s does not belong to this DM" % (p, self._partitionAttr, host)
+                raise InvalidGraphException(msg)
+            partsPerHost[host].append(p)
+
+        action = "expanding graph template in individual DMs"
+        tp = self._resizeThreadPool(len(partsPerHost))
+        results = [self._submit(tp, sessionId, self._addGraphTemplate, action,
+                                self._dmPort, (host, (template, parts)))
+                   for host, parts in partsPerHost.items()]
+        counts = []
+        try:
+            self._collect(sessionId, action, results, counts)
+        finally:
+            self._statusCache.invalidate(sessionId)
+
+        for p in partitions:
+            node, island = part_nodes[p]
+            host = node if self._partitionAttr == 'node' else island
+            session.hosts[host].add(node)
+        session.templates.append(spgt)
+
+        n = sum(counts)
+        logger.info('Successfully added graph template of session %s (%d drops) to each DM', sessionId, n)
+        return n
 
     def _deploySession(self, dm, host, sessionId):
         dm.deploySession(sessionId)
@@ -359,64 +846,168 @@ class CompositeManager(DROPManager):
         logger.info("Successfully triggered drops for session %s on %s", sessionId, host)
 
     def deploySession(self, sessionId, completedDrops=[]):
-
-        # Indicate the node managers that they have to subscribe to events
-        # published by some nodes
-        if self._drop_rels.get(sessionId, None):
-            self.replicate(sessionId, self._add_node_subscriptions, "adding relationship information",
-                           port=constants.NODE_DEFAULT_REST_PORT,
-                           iterable=self._drop_rels[sessionId].items())
-            logger.info("Delivered node subscription list to node managers")
+        """
+        Deploys session `sessionId` in all the underlying DMs, moving
+        `completedDrops` to COMPLETED afterwards.
+
+        Deployment is pipelined instead of happening in lockstep: each DM is
+        deployed as soon as the nodes it covers have been told which of their
+        drops are related to drops in other nodes, and the completed drops of
+        each node are triggered as soon as all the nodes that can receive
+        events from them are deployed. Execution can therefore start on some
+        nodes while others are still deploying.
+        """
+        session = self._getSession(sessionId)
+        nodes = dict((uid, session.locate(uid)) for uid in completedDrops)
+        not_found = set(uid for uid, node in nodes.items() if node is None)
+        if not_found:
+            raise DaliugeException("UIDs for completed drops not found: %r", not_found)
+
+        completed_by_node = group_by_node(completedDrops, nodes)
+        downstream = session.downstreamNodes(completed_by_node)
+        node_host = {node: host for host, nodes in session.hosts.items() for node in nodes}
+        subs_by_host = collections.defaultdict(list)
+        for node, subscriptions in session.drop_rels.items():
+            subs_by_host[node_host.get(node, node)].append((node, subscriptions))
+
+        tp = self._resizeThreadPool(len(self._dmHosts) + len(session.drop_rels))
+        lock = threading.Lock()
+        done = threading.Event()
+        thrExs = {}
+        deployed = set()
+        ready_nodes = set()
+        to_trigger = dict(completed_by_node)
+        subs_left = {host: len(subs_by_host.get(host, ())) for host in self._dmHosts}
+
+        # The number of running calls, plus one until all the initial calls
+        # have been submitted
+        running = [1]
+        def call_finished():
+            with lock:
+                running[0] -= 1
+                if not running[0]:
+                    done.set()
+
+        def run(action, f, port, item, then):
+            host = item[0] if isinstance(item, tuple) else item
+            with lock:
+                running[0] += 1
+            def task():
+                try:
+                    self._do_in_host(action, sessionId, f, port, item)
+                    then()
+                except Exception as e:
+                    with lock:
+                        thrExs.setdefault(host, e)
+                finally:
+                    call_finished()
+            tp.apply_async(task)
+
+        def trigger_ready_nodes():
+            with lock:
+                nodes = [node for node in to_trigger if downstream[node] <= ready_nodes]
+                items = [(node, to_trigger.pop(node)) for node in nodes]
+            for item in items:
+                logger.info('Moving Drops to COMPLETED right away on %s: %r', *item)
+                run("triggering drops", self._triggerDrops, constants.NODE_DEFAULT_REST_PORT, item, lambda: None)
+
+        def deploy(host):
+            def host_deployed():
+                with lock:
+                    deployed.add(host)
+                    ready_nodes.update(session.hosts.get(host, ()))
+                trigger_ready_nodes()
+            run("deploying session", self._deploySession, self._dmPort, host, host_deployed)
+
+        def subscriptions_added(host):
+            def f():
+                with lock:
+                    subs_left[host] -= 1
+                    deploy_now = not subs_left[host]
+                if deploy_now:
+                    deploy(host)
+            return f
 
         logger.info('Deploying Session %s in all hosts', sessionId)
-        self.replicate(sessionId, self._deploySession, "deploying session")
-        logger.info('Successfully deployed session %s in all hosts', sessionId)
+        try:
+            for host in self._dmHosts:
+                if not subs_left[host]:
+                    deploy(host)
+                    continue
+                for item in subs_by_host[host]:
+                    run("adding relationship information", self._add_node_subscriptions,
+                        constants.NODE_DEFAULT_REST_PORT, item, subscriptions_added(host))
+            call_finished()
+
+            timeout = self._dmCommandTimeout * 3 if self._dmCommandTimeout else None
+            if not done.wait(timeout):
+                with lock:
+                    for host in self._dmHosts:
+                        if host not in deployed:
+                            thrExs.setdefault(host, DaliugeException("%s didn't finish deploying after %.2f [s]" % (host, timeout)))
+        finally:
+            self._statusCache.invalidate(sessionId)
 
-        # Now that everything is wired up we move the requested DROPs to COMPLETED
-        # (instead of doing it at the DM-level deployment time, in which case
-        # we would certainly miss most of the events)
-        if completedDrops:
-            not_found = set(completedDrops) - set(self._graph)
-            if not_found:
-                raise DaliugeException("UIDs for completed drops not found: %r", not_found)
-            logger.info('Moving Drops to COMPLETED right away: %r', completedDrops)
-            completed_by_host = group_by_node(completedDrops, self._graph)
-            self.replicate(sessionId, self._triggerDrops, "triggering drops",
-                           port=constants.NODE_DEFAULT_REST_PORT,
-                           iterable=completed_by_host.items())
-            logger.info('Successfully triggered drops')
+        if thrExs:
+            msg = "More than one error occurred while deploying session %s" % (sessionId,)
+            raise SubManagerException(msg, thrExs)
+        logger.info('Successfully deployed session %s in all hosts', sessionId)
 
     def _getGraphStatus(self, dm, host, sessionId):
         return dm.getGraphStatus(sessionId)
 
     def getGraphStatus(self, sessionId):
-        allStatus = {}
-        self.replicate(sessionId, self._getGraphStatus, "getting graph status", collect=allStatus)
-        return allStatus
+        """
+        Returns the status of the drops of session `sessionId`. Statuses are
+        fetched from all the underlying drop managers in parallel, and reused
+        for a short while by subsequent calls, so many clients polling the
+        same session don't multiply the load on the underlying managers.
+        """
+        def fetch():
+            allStatus = {}
+            self.replicate(sessionId, self._getGraphStatus, "getting graph status", collect=allStatus)
+            return allStatus
+        return self._statusCache.get(('graphStatus', sessionId), fetch)
+
+    def iterGraphStatus(self, sessionId):
+        """
+        Yields the (oid, status) pairs of the graph of session `sessionId`
+        """
+        return six.iteritems(self.getGraphStatus(sessionId))
 
     def _getGraph(self, dm, host, sessionId):
         return dm.getGraph(sessionId)
 
     def getGraph(self, sessionId):
+        return dict(self.iterGraph(sessionId))
 
-        allGraphs = {}
-        self.replicate(sessionId, self._getGraph, "getting the graph", collect=allGraphs)
+    def iterGraph(self, sessionId):
+        """
+        Yields the (oid, dropSpec) pairs of the graph of session `sessionId`,
+        fetching the graphs of a few underlying drop managers at a time
+        """
 
         # The graphs coming from the DMs are not interconnected, we need to
         # add the missing connections to the graph before returning upstream
-        rels = set([z for x in self._drop_rels[sessionId].values() for y in x.values() for z in y])
-        for rel in rels:
-            graph_loader.addLink(rel.rel, allGraphs[rel.rhs], rel.lhs)
+        rels = collections.defaultdict(list)
+        for rel in self._getSession(sessionId).relationships:
+            rels[rel.rhs].append(rel)
 
-        return allGraphs
+        for graph in self.iterate(sessionId, self._getGraph, "getting the graph"):
+            for oid, dropSpec in six.iteritems(graph):
+                for rel in rels.get(oid, ()):
+                    graph_loader.addLink(rel.rel, dropSpec, rel.lhs)
+                yield oid, dropSpec
 
     def _getSessionStatus(self, dm, host, sessionId):
         return {host: dm.getSessionStatus(sessionId)}
 
     def getSessionStatus(self, sessionId):
-        allStatus = {}
-        self.replicate(sessionId, self._getSessionStatus, "getting the graph status", collect=allStatus)
-        return allStatus
+        def fetch():
+            allStatus = {}
+            self.replicate(sessionId, self._getSessionStatus, "getting the graph status", collect=allStatus)
+            return allStatus
+        return self._statusCache.get(('sessionStatus', sessionId), fetch)
 
     def _getGraphSize(self, dm, host, sessionId):
         return dm.getGraphSize(sessionId)
@@ -431,14 +1022,15 @@ class DataIslandManager(CompositeManager):
     The DataIslandManager, which manages a number of NodeManagers.
     """
 
-    def __init__(self, dmHosts=[], pkeyPath=None, dmCheckTimeout=10):
+    def __init__(self, dmHosts=[], pkeyPath=None, dmCheckTimeout=10, **kwargs):
         super(DataIslandManager, self).__init__(NODE_DEFAULT_REST_PORT,
                                                 'node',
                                                 'dfmsNM',
                                                 'nm',
                                                 dmHosts=dmHosts,
                                                 pkeyPath=pkeyPath,
-                                                dmCheckTimeout=dmCheckTimeout)
+                                                dmCheckTimeout=dmCheckTimeout,
+                                                **kwargs)
 
         # In the case of the Data Island the dmHosts are the final nodes as well
         self._nodes = dmHosts
@@ -453,12 +1045,13 @@ class MasterManager(CompositeManager):
     The MasterManager, which manages a number of DataIslandManagers.
     """
 
-    def __init__(self, dmHosts=[], pkeyPath=None, dmCheckTimeout=10):
+    def __init__(self, dmHosts=[], pkeyPath=None, dmCheckTimeout=10, **kwargs):
         super(MasterManager, self).__init__(ISLAND_DEFAULT_REST_PORT,
                                             'island',
                                             'dfmsDIM',
                                             'dim',
                                             dmHosts=dmHosts,
                                             pkeyPath=pkeyPath,
-                                            dmCheckTimeout=dmCheckTimeout)
+                                            dmCheckTimeout=dmCheckTimeout,
+                                            **kwargs)
         logger.info('Created MasterManager for hosts: %r', self._dmHosts)
@@ -32,4 +32,29 @@ DAEMON_DEFAULT_REST_PORT = 9000
 
 # Others ports used by the Node Managers
 NODE_DEFAULT_EVENTS_PORT = 5555
-NODE_DEFAULT_RPC_PORT    = 6666
\ No newline at end of file
+NODE_DEFAULT_RPC_PORT    = 6666
+
+# Number of worker threads used by Node Managers to serve RPC requests
+NODE_DEFAULT_RPC_WORKERS = 16
+
+# Maximum number of sub-DMs a CompositeManager sends commands to in parallel,
+# and the time it waits for each of them to answer (0 means forever)
+COMPOSITE_DEFAULT_MAX_FANOUT = 256
+COMPOSITE_DEFAULT_COMMAND_TIMEOUT = 300
+
+# Number of drops sent at once by a CompositeManager to each of its sub-DMs
+# while appending a graph
+COMPOSITE_DEFAULT_GRAPH_BATCH_SIZE = 10000
+
+# Number of sub-DMs whose graphs (or graph statuses) are fetched at the same
+# time when streaming them back to the client
+COMPOSITE_DEFAULT_STREAM_WINDOW = 4
+
+# Time during which the CompositeManager daemons reuse the session and graph
+# statuses obtained from their sub-DMs
+COMPOSITE_DEFAULT_STATUS_CACHE_TTL = 1
+
+# Worker threads and maximum number of queued requests of the REST servers of
+# the daemons when using the "pool" backend
+REST_DEFAULT_WORKERS = 32
+REST_DEFAULT_MAX_QUEUED = 128
@@ -38,7 +38,7 @@ import time
 import six
 from six.moves import queue as Queue  # @UnresolvedImport
 
-from dfms import utils
+from dfms import graph_loader, utils
 from dfms.drop import AppDROP
 from dfms.exceptions import NoSessionException, SessionAlreadyExistsException,\
     DaliugeException
@@ -91,12 +91,14 @@ class NodeManagerBase(DROPManager):
                  enable_luigi=False,
                  events_port = constants.NODE_DEFAULT_EVENTS_PORT,
                  rpc_port = constants.NODE_DEFAULT_RPC_PORT,
-                 max_threads = 0):
+                 max_threads = 0,
+                 rpc_workers = constants.NODE_DEFAULT_RPC_WORKERS):
 
         self._dlm = DataLifecycleManager() if useDLM else None
         self._host = host or 'localhost'
         self._events_port = events_port
         self._rpc_port = rpc_port
+        self._rpc_workers = max(rpc_workers, 1)
         self._sessions = {}
 
         # dfmsPath contains code added by the user with possible
@@ -170,6 +172,14 @@ class NodeManagerBase(DROPManager):
         ``host``:``port``, and its closing method, as a 2-tuple.
         """
 
+    def get_rpc_server_stats(self):
+        """
+        Returns a dictionary with statistics about the RPC requests served by
+        this Node Manager. RPC backends that don't keep track of these return
+        an empty dictionary.
+        """
+        return {}
+
     def deliver_event(self, evt):
         """
         Method called by subclasses when a new event has arrived through the
@@ -202,6 +212,37 @@ class NodeManagerBase(DROPManager):
         self._check_session_id(sessionId)
         self._sessions[sessionId].addGraphSpec(graphSpec)
 
+    def addGraphTemplate(self, sessionId, template, partitions=None):
+        """
+        Adds to session `sessionId` the drops of `partitions` (all of them if
+        None) of `template`, a symbolic Physical Graph Template (see
+        `dfms.dropmake.symbolic_pgt`). The drop specifications are expanded
+        here, and the relationships with drops of other nodes, which are
+        computed from the template as well, are set up as node subscriptions.
+        Returns the number of drops added
+        """
+        from dfms.dropmake.symbolic_pgt import SymbolicPGT
+
+        self._check_session_id(sessionId)
+        spgt = SymbolicPGT.from_json(template)
+        if partitions is None:
+            ranges = spgt.ranges()
+        else:
+            ranges = [r for p in partitions for r in spgt.ranges(p)]
+
+        peer_nodes = {}
+        graphSpec = list(spgt.expand(ranges, peer_nodes=peer_nodes))
+        logger.info('Expanded %d drops from graph template for session %s', len(graphSpec), sessionId)
+
+        remote_rels = graph_loader.removeUnmetRelationships(graphSpec)
+        self._sessions[sessionId].addGraphSpec(graphSpec)
+        if remote_rels:
+            subscriptions = collections.defaultdict(list)
+            for rel in remote_rels:
+                subscriptions[peer_nodes[rel.lhs]].append(rel)
+            self.add_node_subscriptions(sessionId, subscriptions)
+        return len(graphSpec)
+
     def getGraphStatus(self, sessionId):
         self._check_session_id(sessionId)
         return self._sessions[sessionId].getGraphStatus()
@@ -218,7 +259,7 @@ class NodeManagerBase(DROPManager):
             if self._threadpool is not None:
                 drop._tp = self._threadpool
             if self._dlm:
-                self._dlm.addDrop(drop)
+                self._dlm.addDrop(drop, session)
 
             # Remote event forwarding
             evt_listener = NMDropEventListener(self, sessionId)
@@ -260,10 +301,11 @@ class NodeManagerBase(DROPManager):
 
         logger.debug("Received subscription information: %r", relationships)
         self._check_session_id(sessionId)
-        self._sessions[sessionId].add_node_subscriptions(relationships, self)
+        remote_hosts = self._sessions[sessionId].add_node_subscriptions(relationships, self)
 
-        # Set up event channels subscriptions
-        for nodesub in relationships:
+        # Set up event channels subscriptions, only for those nodes
+        # that hold drops actually related to ours
+        for nodesub in remote_hosts:
 
             host = nodesub
             events_port = constants.NODE_DEFAULT_EVENTS_PORT
@@ -449,6 +491,91 @@ class ZMQPubSubMixIn(BaseMixIn):
                 logger.exception("Something bad happened in %s:%d to ZMQ :'(", self._host, self._events_port)
                 break
 
+class RPCServerStats(object):
+    """
+    Statistics about the requests served by an RPC server: how many requests
+    are currently waiting for (or being served by) a worker thread, and how
+    long it takes to serve them.
+    """
+
+    def __init__(self, workers):
+        self._workers = workers
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._max_pending = 0
+        self._inline = 0
+        self._pooled = 0
+        self._total_latency = 0.
+        self._max_latency = 0.
+
+    def request_queued(self):
+        with self._lock:
+            self._pending += 1
+            self._max_pending = max(self._pending, self._max_pending)
+
+    def request_served(self, latency, pooled):
+        with self._lock:
+            if pooled:
+                self._pending -= 1
+                self._pooled += 1
+            else:
+                self._inline += 1
+            self._total_latency += latency
+            self._max_latency = max(latency, self._max_latency)
+
+    def to_dict(self):
+        with self._lock:
+            served = self._inline + self._pooled
+            return {'workers': self._workers,
+                    'pending': self._pending,
+                    'queued': max(0, self._pending - self._workers),
+                    'max_pending': self._max_pending,
+                    'inline_requests': self._inline,
+                    'pooled_requests': self._pooled,
+                    'avg_latency': self._total_latency / served if served else 0.,
+                    'max_latency': self._max_latency}
+
+class ZeroRPCServerMethods(object):
+    """
+    The methods exposed by the ZeroRPC server of a Node Manager.
+
+    ZeroRPC serves all requests from a single gevent loop. Drop methods can
+    block for arbitrary amounts of time (e.g., reading data from disk), so
+    ``call_drop`` requests are handed over to a bounded pool of worker threads
+    instead, letting the loop keep on multiplexing other requests. Property
+    reads and method lookups are cheap and are served inline.
+    """
+
+    def __init__(self, nm, workers, stats):
+        self._nm = nm
+        self._workers = workers
+        self._stats = stats
+
+    def _inline(self, f, *args):
+        start = time.time()
+        try:
+            return f(*args)
+        finally:
+            self._stats.request_served(time.time() - start, False)
+
+    def _pooled(self, f, *args):
+        start = time.time()
+        self._stats.request_queued()
+        try:
+            # get() yields to the gevent loop until the worker is done
+            return self._workers.spawn(f, *args).get()
+        finally:
+            self._stats.request_served(time.time() - start, True)
+
+    def call_drop(self, session_id, uid, name, *args):
+        return self._pooled(self._nm.call_drop, session_id, uid, name, *args)
+
+    def get_drop_property(self, session_id, uid, name):
+        return self._inline(self._nm.get_drop_property, session_id, uid, name)
+
+    def has_method(self, session_id, uid, name):
+        return self._inline(self._nm.has_method, session_id, uid, name)
+
 class ZeroRPCMixIn(BaseMixIn):
 
     request = collections.namedtuple('request', 'method args queue')
@@ -457,7 +584,9 @@ class ZeroRPCMixIn(BaseMixIn):
     def start(self):
         super(ZeroRPCMixIn, self).start()
 
-        # Starts the single-threaded ZeroRPC server for RPC requests
+        # Starts the ZeroRPC server for RPC requests. Requests are received
+        # by a single thread, but served by a pool of workers
+        self._zrpcstats = RPCServerStats(self._rpc_workers)
         timeout = 30
         server_started = threading.Event()
         self._zrpcserverthread = threading.Thread(target=self.run_zrpcserver, name="ZeroRPC server", args=(self._host, self._rpc_port, server_started))
@@ -478,11 +607,17 @@ class ZeroRPCMixIn(BaseMixIn):
         import zerorpc
         logger.info("Importing of gevent and zerorpc took %.3f seconds", time.time() - start)
 
+        # The worker threads are created in this thread so they are bound to
+        # the gevent hub the server is running on
+        import gevent.threadpool
+        workers = gevent.threadpool.ThreadPool(self._rpc_workers)
+        methods = ZeroRPCServerMethods(self, workers, self._zrpcstats)
+
         # Use a specific context; otherwise multiple servers on the same process
         # (only during tests) share the same Context.instance() which is global
         # to the process
         ctx = zerorpc.Context()
-        self._zrpcserver = zerorpc.Server(self, context=ctx)
+        self._zrpcserver = zerorpc.Server(methods, context=ctx)
         # zmq needs an address, not a hostname
         endpoint = "tcp://%s:%d" % (zmq_safe(host), port,)
         self._zrpcserver.bind(endpoint)
@@ -492,6 +627,7 @@ class ZeroRPCMixIn(BaseMixIn):
         runner = gevent.spawn(self._zrpcserver.run)
         stopper = gevent.spawn(self.stop_zrpcserver)
         gevent.joinall([runner, stopper])
+        workers.kill()
         ctx.destroy()
 
     def stop_zrpcserver(self):
@@ -506,6 +642,9 @@ class ZeroRPCMixIn(BaseMixIn):
         for t in [self._zrpcserverthread] + self._zrpcclientthreads:
             t.join()
 
+    def get_rpc_server_stats(self):
+        return self._zrpcstats.to_dict()
+
     def get_client_for_endpoint(self, host, port):
 
         endpoint = (host, port)
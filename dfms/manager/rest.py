@@ -25,11 +25,14 @@ Data Managers (DROPManager and DataIslandManager) to the outside world.
 """
 
 import functools
+import itertools
 import json
 import logging
+import types
 
 import bottle
 import pkg_resources
+import six
 
 from dfms import utils
 from dfms.exceptions import InvalidGraphException, InvalidSessionState, \
@@ -46,12 +49,41 @@ def file_as_string(fname, enc='utf8'):
     b = pkg_resources.resource_string(__name__, fname) # @UndefinedVariable
     return utils.b2s(b, enc)
 
+def accepts_gzip():
+    """
+    Whether the client of the current request accepts gzip-encoded responses
+    """
+    for coding in bottle.request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = coding.partition(';')
+        if coding.strip().lower() in ('gzip', '*'):
+            params = params.replace(' ', '')
+            return not params.startswith('q=') or float(params[2:] or 0) > 0
+    return False
+
+def stream_response(chunks):
+    """
+    Sets up the current response to send the JSON content produced by the
+    `chunks` generator, gzip-compressing it if the client accepts it. The first
+    chunk is produced right away, so errors happening before any content has
+    been sent are still reported with the proper status code.
+    """
+    first = next(chunks)
+    chunks = itertools.chain((first,), chunks)
+    bottle.response.content_type = 'application/json'
+    bottle.response.set_header('Vary', 'Accept-Encoding')
+    if accepts_gzip():
+        bottle.response.set_header('Content-Encoding', 'gzip')
+        chunks = utils.gzip_chunks(chunks)
+    return chunks
+
 def daliuge_aware(func):
 
     @functools.wraps(func)
     def fwrapper(*args, **kwargs):
         try:
             res = func(*args, **kwargs)
+            if isinstance(res, types.GeneratorType):
+                return stream_response(res)
             if res is not None:
                 bottle.response.content_type = 'application/json'
                 return json.dumps(res)
@@ -102,9 +134,9 @@ class ManagerRestServer(RestServer):
     (i.e. those not under /api).
     """
 
-    def __init__(self, dm, maxreqsize=10):
+    def __init__(self, dm, maxreqsize=10, **serverOpts):
 
-        super(ManagerRestServer, self).__init__()
+        super(ManagerRestServer, self).__init__(**serverOpts)
 
         # Increase maximum file sizes
         bottle.BaseRequest.MEMFILE_MAX = maxreqsize * 1024 * 1024
@@ -123,6 +155,7 @@ class ManagerRestServer(RestServer):
         app.get(   '/api/sessions/<sessionId>/graph/size',   callback=self.getGraphSize)
         app.get(   '/api/sessions/<sessionId>/graph/status', callback=self.getGraphStatus)
         app.post(  '/api/sessions/<sessionId>/graph/append', callback=self.addGraphParts)
+        app.post(  '/api/sessions/<sessionId>/graph/template', callback=self.addGraphTemplate)
 
         # The non-REST mappings that serve HTML-related content
         app.route('/static/<filepath:path>', callback=self.server_static)
@@ -177,7 +210,11 @@ class ManagerRestServer(RestServer):
 
     @daliuge_aware
     def getGraph(self, sessionId):
-        return self.dm.getGraph(sessionId)
+        # Graphs can be big, so they are encoded and sent as they are produced
+        return utils.iter_json_object(self._graphItems(sessionId))
+
+    def _graphItems(self, sessionId):
+        return six.iteritems(self.dm.getGraph(sessionId))
 
     @daliuge_aware
     def getGraphSize(self, sessionId):
@@ -185,24 +222,48 @@ class ManagerRestServer(RestServer):
 
     @daliuge_aware
     def getGraphStatus(self, sessionId):
-        return self.dm.getGraphStatus(sessionId)
+        return utils.iter_json_object(self._graphStatusItems(sessionId))
+
+    def _graphStatusItems(self, sessionId):
+        return six.iteritems(self.dm.getGraphStatus(sessionId))
 
     # TODO: addGraphParts v/s addGraphSpec
     @daliuge_aware
     def addGraphParts(self, sessionId):
-        if bottle.request.content_type != 'application/json':
+
+        # Graphs come in JSON or, if we can read it, msgpack form
+        content_type = bottle.request.content_type
+        binary = content_type == utils.MSGPACK_CONTENT_TYPE and utils.msgpack is not None
+        if content_type != 'application/json' and not binary:
             bottle.response.status = 415
             return
 
         # We also accept gzipped content
         hdrs = bottle.request.headers
         if hdrs.get('Content-Encoding', None) == 'gzip':
-            json_content = utils.ZlibUncompressedStream(bottle.request.body)
+            content = utils.ZlibUncompressedStream(bottle.request.body)
         else:
-            json_content = bottle.request.body
+            content = bottle.request.body
+
+        self.dm.addGraphSpec(sessionId, self._readGraphParts(content, binary))
 
-        graph_parts = bottle.json_loads(json_content.read())
-        self.dm.addGraphSpec(sessionId, graph_parts)
+    @daliuge_aware
+    def addGraphTemplate(self, sessionId):
+
+        if bottle.request.content_type != 'application/json':
+            bottle.response.status = 415
+            return
+
+        content = bottle.request.body
+        if bottle.request.headers.get('Content-Encoding', None) == 'gzip':
+            content = utils.ZlibUncompressedStream(content)
+        body = bottle.json_loads(content.read())
+        return self.dm.addGraphTemplate(sessionId, body['template'], body.get('partitions', None))
+
+    def _readGraphParts(self, content, binary):
+        if binary:
+            return list(utils.iter_msgpack_array(content))
+        return bottle.json_loads(content.read())
 
     #===========================================================================
     # non-REST methods
@@ -247,9 +308,9 @@ class NMRestServer(ManagerRestServer):
 
     @daliuge_aware
     def getNMStatus(self):
-        # we currently return the sessionIds, more things might be added in the
-        # future
-        return {'sessions': self.sessions()}
+        # we currently return the sessionIds and the RPC server statistics,
+        # more things might be added in the future
+        return {'sessions': self.sessions(), 'rpc': self.dm.get_rpc_server_stats()}
 
     @daliuge_aware
     def linkGraphParts(self, sessionId):
@@ -291,6 +352,19 @@ class CompositeManagerRestServer(ManagerRestServer):
     methods.
     """
 
+    def _readGraphParts(self, content, binary):
+        # The CompositeManager sends drops to the DMs as it reads them
+        if binary:
+            return utils.iter_msgpack_array(content)
+        return utils.iter_json_array(content)
+
+    def _graphItems(self, sessionId):
+        # ... and fetches the graphs from a few DMs at a time
+        return self.dm.iterGraph(sessionId)
+
+    def _graphStatusItems(self, sessionId):
+        return self.dm.iterGraphStatus(sessionId)
+
     def initializeSpecifics(self, app):
         app.get(   '/api',                                   callback=self.getCMStatus)
         app.get(   '/api/nodes',                             callback=self.getCMNodes)
@@ -309,7 +383,8 @@ class CompositeManagerRestServer(ManagerRestServer):
 
     @daliuge_aware
     def getCMStatus(self):
-        return {'hosts': self.dm.dmHosts, 'sessionIds': self.dm.getSessionIds()}
+        return {'hosts': self.dm.dmHosts, 'sessionIds': self.dm.getSessionIds(),
+                'sessions': self.dm.getSessionsInfo()}
 
     @daliuge_aware
     def getCMNodes(self):
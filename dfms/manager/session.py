@@ -133,6 +133,7 @@ class Session(object):
         self._error_status_listener = None
         self._enable_luigi = enable_luigi
         self._dropsubs = {}
+        self._local_rels = set()
         if error_listener:
             self._error_status_listener = ErrorStatusListener(self, error_listener)
 
@@ -254,6 +255,8 @@ class Session(object):
         self._roots = graph_loader.createGraphFromDropSpecList(self._graph.values())
         logger.info("%d drops successfully created", len(self._graph))
 
+        # The graph is walked only once, and 'foreach' is invoked on each
+        # drop here so its effects are in place before any drop is triggered
         for drop,_ in droputils.breadFirstTraverse(self._roots):
 
             # Register them
@@ -262,6 +265,9 @@ class Session(object):
             # Register them with the error handler
             if self._error_status_listener:
                 drop.subscribe(self._error_status_listener, eventType='status')
+
+            if foreach:
+                foreach(drop)
         logger.info("Stored all drops, proceeding with further customization")
 
         # Start the luigi task that will make sure the graph is executed
@@ -294,13 +300,6 @@ class Session(object):
         # to make sure all event listeners are ready
         self.trigger_drops(completedDrops)
 
-        # Foreach
-        if foreach:
-            logger.info("Invoking 'foreach' on each drop")
-            for drop,_ in droputils.breadFirstTraverse(self._roots):
-                foreach(drop)
-            logger.info("'foreach' invoked for each drop")
-
         # Append proxies
         logger.info("Creating %d drop proxies: %r", len(self._proxyinfo), self._proxyinfo)
         for nm, host, port, local_uid, relname, remote_uid in self._proxyinfo:
@@ -319,13 +318,15 @@ class Session(object):
         self.finish()
 
     def trigger_drops(self, uids):
-        for drop,downStreamDrops in droputils.breadFirstTraverse(self._roots):
-            downStreamDrops[:] = [dsDrop for dsDrop in downStreamDrops if isinstance(dsDrop, AbstractDROP)]
-            if drop.uid in uids:
-                if isinstance(drop, InputFiredAppDROP):
-                    drop.async_execute()
-                else:
-                    drop.setCompleted()
+        for uid in uids:
+            drop = self._drops.get(uid)
+            if drop is None:
+                logger.warning("Drop %s not found in session %s, cannot trigger it", uid, self._sessionId)
+                continue
+            if isinstance(drop, InputFiredAppDROP):
+                drop.async_execute()
+            else:
+                drop.setCompleted()
 
     def deliver_event(self, evt):
         """
@@ -340,16 +341,58 @@ class Session(object):
             logger.debug("Passing event %r to %r", evt, drop)
             drop.handleEvent(evt)
 
+    def _is_local_relationship(self, rel):
+        return rel.lhs in self._graph and rel.rhs in self._graph
+
+    def _link_locally(self, rel):
+        """
+        Establishes the relationship ``rel``, whose both ends are held by this
+        session, directly between the drops (or their specifications, if the
+        drops have not been created yet).
+        """
+        if rel in self._local_rels:
+            return
+        self._local_rels.add(rel)
+
+        logger.debug("Linking %r locally", rel)
+        if self._drops:
+            rhs, lhs = self._drops[rel.rhs], self._drops[rel.lhs]
+            getattr(rhs, LINKTYPE_1TON_APPEND_METHOD[rel.rel])(lhs)
+        else:
+            graph_loader.addLink(rel.rel, self._graph[rel.rhs], rel.lhs)
+
     def add_node_subscriptions(self, relationships, nm):
+        """
+        Stores the relationships this session's drops have with drops held
+        by other Node Managers, and sets everything up so proxies are created
+        and events are received for them when the session is deployed.
+
+        Relationships whose both ends are actually held by this session (e.g.,
+        because their drops were appended in different graph parts) are
+        established directly instead.
+
+        Returns the keys of ``relationships`` for which remote relationships
+        exist, and to whose events the Node Manager needs to subscribe.
+        """
 
         evt_consumer = (DROPLinkType.CONSUMER, DROPLinkType.STREAMING_CONSUMER, DROPLinkType.OUTPUT)
         evt_producer = (DROPLinkType.INPUT,    DROPLinkType.STREAMING_INPUT,    DROPLinkType.PRODUCER)
 
+        remote_hosts = []
         for host, droprels in relationships.items():
 
             # Make sure we have DROPRel tuples
             droprels = [DROPRel(*x) for x in droprels]
 
+            # Short-circuit relationships that are not remote at all
+            for rel in droprels:
+                if self._is_local_relationship(rel):
+                    self._link_locally(rel)
+            droprels = [rel for rel in droprels if not self._is_local_relationship(rel)]
+            if not droprels:
+                continue
+            remote_hosts.append(host)
+
             # Sanitize the host/rpc_port info if needed
             rpc_port = constants.NODE_DEFAULT_RPC_PORT
             if type(host) is tuple:
@@ -388,6 +431,8 @@ class Session(object):
 
                 self._proxyinfo.append((nm, host, rpc_port, local_uid, mname, remote_uid))
 
+        return remote_hosts
+
     def finish(self):
         self.status = SessionStates.FINISHED
         logger.info("Session %s finished", self._sessionId)
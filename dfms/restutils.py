@@ -20,13 +20,23 @@
 #    MA 02111-1307  USA
 #
 import codecs
+import errno
 import json
 import logging
-from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+import socket
+import threading
+import time
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, ServerHandler
+
+try:
+    import selectors
+except ImportError:
+    import selectors34 as selectors  # @UnresolvedImport
 
 import bottle
 import six
 import six.moves.http_client as httplib  # @UnresolvedImport
+import six.moves.queue as Queue  # @UnresolvedImport
 import six.moves.socketserver as SocketServer  # @UnresolvedImport
 import six.moves.urllib_parse as urllib  # @UnresolvedImport
 
@@ -37,22 +47,347 @@ from dfms.exceptions import DaliugeException, SubManagerException
 
 logger = logging.getLogger(__name__)
 
-class ThreadingWSGIServer(SocketServer.ThreadingMixIn, WSGIServer):
-    daemon_threads = True
+class TrackingWSGIServer(WSGIServer):
+    """
+    A WSGIServer that keeps track of its open connections
+    """
     allow_reuse_address = True
 
+    def __init__(self, *args, **kwargs):
+        WSGIServer.__init__(self, *args, **kwargs)
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+
+    def track_request(self, request):
+        with self._connections_lock:
+            self._connections.add(request)
+
+    def shutdown_request(self, request):
+        with self._connections_lock:
+            self._connections.discard(request)
+        WSGIServer.shutdown_request(self, request)
+
+    def close_connections(self):
+        """
+        Shuts down the connections still open, which otherwise would be kept
+        alive by their clients after the server stops
+        """
+        with self._connections_lock:
+            connections = list(self._connections)
+        for request in connections:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+class ThreadingWSGIServer(SocketServer.ThreadingMixIn, TrackingWSGIServer):
+    """
+    A server that uses a new thread for each connection
+    """
+    daemon_threads = True
+
+    def process_request(self, request, client_address):
+        self.track_request(request)
+        SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+class PooledWSGIServer(TrackingWSGIServer):
+    """
+    A server that serves requests using a fixed number of worker threads.
+
+    At most `max_queued` requests wait for a worker to become available;
+    further requests are answered right away with a 503 status and a
+    Retry-After header, so clients back off instead of piling up on the
+    server. Idle connections don't hold a worker: they are watched by a
+    separate thread and given to the workers when their next request arrives
+    (at most `max_idle` of them are kept open).
+    """
+
+    def __init__(self, server_address, handler_class, workers=32, max_queued=128,
+                 max_idle=512, retry_after=1):
+        TrackingWSGIServer.__init__(self, server_address, handler_class)
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_idle = max_idle
+        self.retry_after = retry_after
+        self._queue = Queue.Queue()
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._idle = {}
+        self._idle_lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._stopping = threading.Event()
+
+        self._threads = [threading.Thread(target=self._work, name='REST worker %d' % i) for i in range(workers)]
+        self._threads.append(threading.Thread(target=self._watch_idle, name='REST idle connections'))
+        for t in self._threads:
+            t.daemon = True
+            t.start()
+
+    def process_request(self, request, client_address):
+        # New connections are handed to a worker only when their first
+        # request arrives, like idle ones
+        self.track_request(request)
+        if not self.park(request, client_address):
+            self._reject(request)
+            self.shutdown_request(request)
+
+    def _dispatch(self, request, client_address):
+        with self._pending_lock:
+            busy = self._pending >= self.workers + self.max_queued
+            if not busy:
+                self._pending += 1
+        if busy:
+            logger.warning("Too many requests, rejecting request from %s:%d", *client_address[:2])
+            self._reject(request)
+            self.shutdown_request(request)
+            return
+        self._queue.put((request, client_address))
+
+    def _reject(self, request):
+        body = json.dumps({'type': 'DaliugeException', 'args': ['Server too busy, try again later']})
+        response = 'HTTP/1.1 503 Service Unavailable\r\n' + \
+                   'Content-Type: application/json\r\n' + \
+                   'Content-Length: %d\r\n' % len(body) + \
+                   'Retry-After: %d\r\n' % self.retry_after + \
+                   'Connection: close\r\n\r\n' + body
+        try:
+            request.sendall(response.encode('ascii'))
+        except socket.error:
+            pass
+
+    def finish_request(self, request, client_address):
+        handler = self.RequestHandlerClass(request, client_address, self)
+        return getattr(handler, 'parked', False)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            parked = False
+            try:
+                parked = self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                with self._pending_lock:
+                    self._pending -= 1
+            if not parked or not self.park(request, client_address):
+                self.shutdown_request(request)
+
+    def park(self, request, client_address):
+        """
+        Keeps aside an open connection until its next request arrives.
+        Returns whether there was room to keep it.
+        """
+        with self._idle_lock:
+            if self._stopping.is_set() or len(self._idle) >= self.max_idle:
+                return False
+            self._idle[request] = (client_address, time.time())
+        self._wakeup_w.send(b'x')
+        return True
+
+    def _watch_idle(self):
+
+        # Only this thread touches the selector, which follows the contents of
+        # _idle on each iteration. poll/epoll have no limit on the descriptor
+        # numbers they can watch, unlike select
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup_r, selectors.EVENT_READ)
+        watched = set()
+        try:
+            while not self._stopping.is_set():
+                with self._idle_lock:
+                    idle = set(self._idle)
+                for r in watched - idle:
+                    self._unwatch(selector, r)
+                for r in idle - watched:
+                    try:
+                        selector.register(r, selectors.EVENT_READ)
+                    except (ValueError, KeyError, OSError):
+                        # Closed under our feet, or already registered
+                        pass
+                watched = idle
+
+                for key, _ in selector.select(1):
+                    r = key.fileobj
+                    if r is self._wakeup_r:
+                        self._wakeup_r.recv(4096)
+                        continue
+                    with self._idle_lock:
+                        entry = self._idle.pop(r, None)
+                    self._unwatch(selector, r)
+                    watched.discard(r)
+                    if entry:
+                        self._dispatch(r, entry[0])
+
+                # Close connections that have been idle for too long
+                now = time.time()
+                timeout = self.RequestHandlerClass.timeout or 60
+                with self._idle_lock:
+                    expired = [r for r, (_, since) in self._idle.items() if now - since > timeout]
+                    for r in expired:
+                        del self._idle[r]
+                for r in expired:
+                    self._unwatch(selector, r)
+                    watched.discard(r)
+                    self.shutdown_request(r)
+        finally:
+            selector.close()
+
+    def _unwatch(self, selector, request):
+        try:
+            selector.unregister(request)
+        except (ValueError, KeyError, OSError):
+            pass
+
+    def server_close(self):
+        self._stopping.set()
+        self._wakeup_w.send(b'x')
+        with self._idle_lock:
+            idle, self._idle = list(self._idle), {}
+        for request in idle:
+            self.shutdown_request(request)
+        for _ in range(self.workers):
+            self._queue.put(None)
+        TrackingWSGIServer.server_close(self)
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+# The different servers that can be used to serve REST requests
+server_backends = {
+    'threading': ThreadingWSGIServer,
+    'pool': PooledWSGIServer
+}
+
+class RequestBody(object):
+    """
+    Wraps the input stream of a request with a known Content-Length, so the
+    part of the body not read by the application can be skipped before the
+    next request is read from the same connection
+    """
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def read(self, n=-1):
+        if n is None or n < 0 or n > self.remaining:
+            n = self.remaining
+        data = self.rfile.read(n)
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, n=-1):
+        if n is None or n < 0 or n > self.remaining:
+            n = self.remaining
+        data = self.rfile.readline(n)
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=-1):
+        return list(iter(self.readline, b''))
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def skip(self):
+        while self.remaining:
+            if not self.read(min(self.remaining, 65536)):
+                return False
+        return True
+
+class KeepAliveServerHandler(ServerHandler):
+    """
+    Answers requests using HTTP/1.1 so clients can keep their connections open.
+    Responses of unknown length are still delimited by closing the connection.
+    """
+
+    http_version = '1.1'
+    keep_alive = False
+
+    def cleanup_headers(self):
+        ServerHandler.cleanup_headers(self)
+        self.keep_alive = 'Content-Length' in self.headers and \
+                          self.headers.get('Connection', '').lower() != 'close'
+        if not self.keep_alive:
+            self.headers['Connection'] = 'close'
+
 class LoggingWSGIRequestHandler(WSGIRequestHandler):
+    """
+    A request handler that serves several requests on the same connection
+    when the client asks for it
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    # How long idle connections are kept open
+    timeout = 60
+
     def log_message(self, fmt, *args):
         logger.debug(fmt, *args)
 
+    # Whether the connection was given back to the server after serving a
+    # request, instead of waiting for the next request here
+    parked = False
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        if not self.close_connection and hasattr(self.server, 'park'):
+            self.parked = True
+            return
+        while not self.close_connection:
+            self.handle_one_request()
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except socket.timeout:
+            self.close_connection = True
+            return
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            self.close_connection = True
+            return
+        if not self.parse_request():
+            return
+
+        # Chunked request bodies are not tracked, so we don't try to reuse
+        # their connections
+        body = self.rfile
+        length = self.headers.get('Content-Length')
+        if length:
+            body = RequestBody(self.rfile, int(length))
+        elif self.headers.get('Transfer-Encoding'):
+            self.close_connection = True
+
+        handler = KeepAliveServerHandler(body, self.wfile, self.get_stderr(), self.get_environ())
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+        if not handler.keep_alive:
+            self.close_connection = True
+        elif isinstance(body, RequestBody) and not body.skip():
+            self.close_connection = True
+
 class RestServerWSGIServer:
-    def __init__(self, wsgi_app, listen = '127.0.0.1', port = 8080):
+    def __init__(self, wsgi_app, listen = '127.0.0.1', port = 8080, backend='threading', **backend_opts):
+        if backend not in server_backends:
+            raise ValueError("Unknown REST server backend %s, must be one of %r" % (backend, list(server_backends)))
         self.wsgi_app = wsgi_app
         self.listen = listen
         self.port = port
-        self.server = make_server(self.listen, self.port, self.wsgi_app,
-                                  server_class=ThreadingWSGIServer,
-                                  handler_class=LoggingWSGIRequestHandler)
+        self.server = server_backends[backend]((self.listen, self.port),
+                                               LoggingWSGIRequestHandler,
+                                               **backend_opts)
+        self.server.set_app(self.wsgi_app)
 
     def serve_forever(self):
         self.server.serve_forever()
@@ -60,15 +395,23 @@ class RestServerWSGIServer:
     def server_close(self):
         self.server.shutdown()
         self.server.server_close()
+        self.server.close_connections()
 
 class RestServer(object):
     """
     The base class for our REST servers
     """
 
-    def __init__(self):
+    def __init__(self, backend='threading', **backend_opts):
+        """
+        Creates a new REST server that will use `backend` (one of the keys
+        of `server_backends`) to serve requests. `backend_opts` are given to
+        the backend server class.
+        """
         self._server = None
         self._server_thr = None
+        self._backend = backend
+        self._backend_opts = backend_opts
         self.app = bottle.Bottle()
 
     def start(self, host, port):
@@ -79,7 +422,7 @@ class RestServer(object):
         # tornado's IOLoop directly instead
         logger.info("Starting REST server on %s:%d" % (host, port))
 
-        self._server = RestServerWSGIServer(self.app, host, port)
+        self._server = RestServerWSGIServer(self.app, host, port, self._backend, **self._backend_opts)
         self._server.serve_forever()
 
     def stop(self, timeout=None):
@@ -121,9 +464,93 @@ class chunked(object):
             return b"0\r\n\r\n"
         return chunk(data)
 
+class KeepAliveConnection(httplib.HTTPConnection):
+    """
+    An HTTP connection that, like the port checks we used to perform, keeps
+    trying to connect to the server until ``timeout`` expires. Once connected
+    no timeout applies, since some requests legitimately take long.
+    """
+
+    def connect(self):
+        sock = utils.connect_to(self.host, self.port, self.timeout)
+        if not sock:
+            raise RestClientException("Cannot connect to %s:%d after %.2f [s]" % (self.host, self.port, self.timeout))
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+
+class ConnectionPool(object):
+    """
+    Keeps the idle, open connections to each host/port pair so they can be
+    used by later requests
+    """
+
+    def __init__(self, max_idle=8):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, host, port, timeout):
+        """
+        Returns an idle connection to ``host``:``port`` if there is one, or a
+        new (not yet connected) one otherwise, together with a flag indicating
+        whether the connection is being reused
+        """
+        while True:
+            with self._lock:
+                idle = self._idle.get((host, port))
+                if not idle:
+                    break
+                conn = idle.pop()
+            if not self._is_stale(conn):
+                return conn, True
+            conn.close()
+        return KeepAliveConnection(host, port, timeout=timeout), False
+
+    def _is_stale(self, conn):
+        # An idle connection shouldn't have anything to read; if it has, the
+        # server closed it (or sent something unexpected)
+        sock = conn.sock
+        if sock is None:
+            return True
+        try:
+            sock.settimeout(0)
+            sock.recv(1, socket.MSG_PEEK)
+            return True
+        except socket.error as e:
+            return e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK)
+        finally:
+            sock.settimeout(None)
+
+    def put(self, conn):
+        with self._lock:
+            idle = self._idle.setdefault((conn.host, conn.port), [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def has_connections(self, host, port):
+        with self._lock:
+            return bool(self._idle.get((host, port)))
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+connection_pool = ConnectionPool()
+
+# Requests with these methods can be safely sent twice
+idempotent_methods = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
 class RestClient(object):
     """
-    The base class for our REST clients
+    The base class for our REST clients. Connections are taken from (and given
+    back to) `connection_pool`, so successive requests to the same server,
+    even from different clients, reuse the same HTTP/1.1 connection.
     """
 
     def __init__(self, host, port, timeout):
@@ -134,10 +561,19 @@ class RestClient(object):
         self._resp = None
 
     def _close(self):
-        if self._resp:
-            self._resp.close()
-        if self._conn:
-            self._conn.close()
+        conn, resp = self._conn, self._resp
+        self._conn = self._resp = None
+        if not conn:
+            return
+
+        # Connections can be reused only if their last response was fully
+        # read and the server didn't ask to close them
+        if resp is None or (resp.isclosed() and not resp.will_close):
+            connection_pool.put(conn)
+        else:
+            if resp:
+                resp.close()
+            conn.close()
 
     __del__ = _close
     def __enter__(self):
@@ -164,6 +600,11 @@ class RestClient(object):
         ret = self._POST(url, content, content_type='application/json', compress=compress)
         return json.load(ret) if ret else None
 
+    def _post_msgpack(self, url, content, compress=False):
+        content = utils.ChunkedStream(utils.msgpack_array_chunks(content))
+        ret = self._POST(url, content, content_type=utils.MSGPACK_CONTENT_TYPE, compress=compress)
+        return json.load(ret) if ret else None
+
     def _GET(self, url):
         return self._request(url, 'GET')
 
@@ -188,16 +629,39 @@ class RestClient(object):
         # Do the HTTP stuff...
         logger.debug("Sending %s request to %s:%d%s", method, self.host, self.port, url)
 
-        if not utils.portIsOpen(self.host, self.port, self.timeout):
-            raise RestClientException("Cannot connect to %s:%d after %.2f [s]" % (self.host, self.port, self.timeout))
+        # Give back the connection used by our previous request
+        self._close()
 
-        if content and hasattr(content, 'read'):
+        # Streamed contents cannot be sent again if a reused connection turns
+        # out to be closed, so they always go through a new connection
+        headers = dict(headers)
+        streamed = content and hasattr(content, 'read')
+        if streamed:
             headers['Transfer-Encoding'] = 'chunked'
             content = chunked(content)
-
-        self._conn = httplib.HTTPConnection(self.host, self.port)
-        self._conn.request(method, url, content, headers)
-        self._resp = self._conn.getresponse()
+            self._conn, reused = KeepAliveConnection(self.host, self.port, timeout=self.timeout), False
+        else:
+            self._conn, reused = connection_pool.get(self.host, self.port, self.timeout)
+
+        sent = False
+        try:
+            self._conn.request(method, url, content, headers)
+            sent = True
+            self._resp = self._conn.getresponse()
+        except (httplib.HTTPException, socket.error):
+            self._conn.close()
+            self._conn = None
+
+            # The server might have closed the idle connection we picked up,
+            # in which case we try again with a new one. Requests that could
+            # have reached the server are sent again only if they are
+            # idempotent
+            if not reused or (sent and method not in idempotent_methods):
+                raise
+            logger.debug("Connection to %s:%d was closed, reconnecting", self.host, self.port)
+            self._conn = KeepAliveConnection(self.host, self.port, timeout=self.timeout)
+            self._conn.request(method, url, content, headers)
+            self._resp = self._conn.getresponse()
 
         # Server errors are encoded in the body as json content
         if self._resp.status != httplib.OK:
@@ -223,8 +687,12 @@ class RestClient(object):
             except Exception:
                 ex = RestClientException(msg + "Unknown")
 
+            self._close()
             raise ex
 
-        if not self._resp.length:
+        # Streamed responses have no length, but still have content
+        if self._resp.length == 0:
+            self._resp.read()
+            self._close()
             return None
         return codecs.getreader('utf-8')(self._resp)
\ No newline at end of file
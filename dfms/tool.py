@@ -35,14 +35,30 @@ logger = logging.getLogger(__name__)
 
 def _open_i(path, flags=None):
     if path == '-':
+        if flags and 'b' in flags:
+            return getattr(sys.stdin, 'buffer', sys.stdin)
         return sys.stdin
     return open(os.path.expanduser(path), flags or 'r')
 
 def _open_o(path, flags=None):
     if path == '-':
+        if flags and 'b' in flags:
+            return getattr(sys.stdout, 'buffer', sys.stdout)
         return sys.stdout
     return open(os.path.expanduser(path), flags or 'w')
 
+def _load_graph(path):
+    # Graphs can be given either in JSON or msgpack form
+    with _open_i(path, 'rb') as f:
+        return utils.loads_graph(f.read())
+
+def _adjust_dropspec(dropspec, zerorun=False, app=None):
+    # Optionally set sleepTimes to 0 and apps to a specific type
+    if zerorun and 'sleepTime' in dropspec:
+        dropspec['sleepTime'] = 0
+    if app and 'app' in dropspec:
+        dropspec['app'] = app
+
 def unroll(lg_path, oid_prefix, zerorun=False, app=None):
     '''
     Unrolls the Logical Graph in `lg_graph` into a Physical Graph Template
@@ -56,18 +72,29 @@ def unroll(lg_path, oid_prefix, zerorun=False, app=None):
     drop_list = lg.unroll_to_tpl()
     logger.info("Unroll completed for %s with # of Drops: %d", lg_path, len(drop_list))
 
-    # Optionally set sleepTimes to 0 and apps to a specific type
-    if zerorun:
-        for dropspec in drop_list:
-            if 'sleepTime' in dropspec:
-                dropspec['sleepTime'] = 0
-    if app:
-        for dropspec in drop_list:
-            if 'app' in dropspec:
-                dropspec['app'] = app
+    for dropspec in drop_list:
+        _adjust_dropspec(dropspec, zerorun=zerorun, app=app)
 
     return drop_list
 
+def iter_unroll(lg_path, oid_prefix, zerorun=False, app=None):
+    '''
+    Like `unroll`, but yields the Drop specifications of the Physical Graph
+    Template as they are unrolled instead of returning them all at once,
+    so they can be written out without keeping the whole Physical Graph
+    Template in memory.
+    '''
+
+    from dfms.dropmake.pg_generator import LG
+    lg = LG(_open_i(lg_path), ssid=oid_prefix)
+    logger.info("Start to unroll %s", lg_path)
+    n = 0
+    for dropspec in lg.iter_unroll_to_tpl():
+        _adjust_dropspec(dropspec, zerorun=zerorun, app=app)
+        n += 1
+        yield dropspec
+    logger.info("Unroll completed for %s with # of Drops: %d", lg_path, n)
+
 def partition(pgt, pip_name, num_partitions, num_islands, algo='metis'):
     '''
     Partitions the Physical Graph Template `pgt` with the algorithm `algo`
@@ -143,6 +170,8 @@ def _add_output_options(parser):
                       help='Where the output should be written to (default: stdout)', default='-')
     parser.add_option('-f', '--format', action="store_true",
                       dest='format', help="Format JSON output (newline, 2-space indent)")
+    parser.add_option('-b', '--binary', action="store_true",
+                      dest='binary', help="Write the output in binary (msgpack) form instead of JSON", default=False)
 
 def _setup_logging(opts):
 
@@ -174,10 +203,36 @@ def _setup_logging(opts):
     logging.root.setLevel(level)
 
 
+def _dump_json_array(objects, f, indent=None):
+    # Writes the JSON array json.dump would, one element at a time
+    if indent is None:
+        sep, start, end, prefix = ', ', '[', ']', ''
+    else:
+        prefix = ' ' * indent
+        sep, start, end = ',\n', '[\n', '\n]'
+    first = True
+    for o in objects:
+        f.write(start if first else sep)
+        first = False
+        content = json.dumps(o, indent=indent)
+        if prefix:
+            content = '\n'.join(prefix + l for l in content.split('\n'))
+        f.write(content)
+    f.write('[]' if first else end)
+
 def _setup_output(opts):
     def dump(obj):
+        if opts.binary:
+            with _open_o(opts.output, 'wb') as f:
+                for chunk in utils.msgpack_array_chunks(obj):
+                    f.write(chunk)
+            return
+        indent = None if opts.format is None else 2
         with _open_o(opts.output) as f:
-            json.dump(obj, f, indent=None if opts.format is None else 2)
+            if isinstance(obj, (list, tuple, dict)):
+                json.dump(obj, f, indent=indent)
+            else:
+                _dump_json_array(obj, f, indent=indent)
     return dump
 
 
@@ -246,7 +301,7 @@ def dlg_unroll(parser, args):
     _setup_logging(opts)
     dump = _setup_output(opts)
 
-    dump(unroll(opts.lg_path, opts.oid_prefix, zerorun=opts.zerorun, app=apps[opts.app]))
+    dump(iter_unroll(opts.lg_path, opts.oid_prefix, zerorun=opts.zerorun, app=apps[opts.app]))
 
 def _add_partition_options(parser):
     parser.add_option("-N", "--partitions", action="store", type="int",
@@ -269,8 +324,7 @@ def dlg_partition(parser, args):
     dump = _setup_output(opts)
 
     pip_name = utils.fname_to_pipname(opts.pgt_path)
-    with _open_i(opts.pgt_path) as fi:
-        pgt = json.load(fi)
+    pgt = _load_graph(opts.pgt_path)
     dump(partition(pgt, pip_name, opts.partitions, opts.islands, opts.algo))
 
 @cmdwrap('unroll-and-partition', 'unroll + partition')
@@ -321,8 +375,7 @@ def dlg_map(parser, args):
     if n_nodes <= opts.islands:
         raise Exception("#nodes (%d) should be bigger than number of islands (%d)" % (n_nodes, opts.islands))
 
-    with _open_i(opts.pgt_path) as f:
-        pgt = json.load(f)
+    pgt = _load_graph(opts.pgt_path)
 
     pip_name = utils.fname_to_pipname(opts.pgt_path)
     dump(resource_map(pgt, nodes, pip_name, opts.islands))
@@ -347,9 +400,8 @@ def dlg_submit(parser, args):
                       help='Skip the deployment step (default: False)', default=False)
     (opts, args) = parser.parse_args(args)
 
-    with _open_i(opts.pg_path) as f:
-        submit(opts.host, opts.port, json.load(f),
-               skip_deploy=opts.skip_deploy, session_id=opts.session_id)
+    submit(opts.host, opts.port, _load_graph(opts.pg_path),
+           skip_deploy=opts.skip_deploy, session_id=opts.session_id)
 
 
 def print_usage(prgname):
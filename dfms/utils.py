@@ -23,12 +23,14 @@
 Module containing miscellaneous utility classes and functions.
 """
 
+import codecs
 import contextlib
 import errno
 import json
 import logging
 import math
 import os
+import re
 import socket
 import sys
 import time
@@ -37,9 +39,17 @@ import zlib
 
 import six
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 
 logger = logging.getLogger(__name__)
 
+# The content type used to exchange graphs in binary form
+MSGPACK_CONTENT_TYPE = 'application/x-msgpack'
+
 if sys.version_info[0] > 2:
     def b2s(b, enc='utf8'):
         return b.decode(enc)
@@ -602,4 +612,156 @@ class JSONStream(object):
             if not self.isiter:
                 break
 
-        return b''.join(response)
\ No newline at end of file
+        return b''.join(response)
+
+def iter_json_object(items, chunksize=65536):
+    """
+    Encodes the (key, value) pairs of ``items`` as a JSON object, yielding the
+    result in chunks of about ``chunksize`` bytes instead of building it all
+    in memory first. The first chunk is yielded as soon as the first member is
+    encoded, so any error coming from ``items`` itself surfaces early.
+    """
+    buf = [b'{']
+    buflen = 1
+    first = True
+    for k, v in items:
+        member = '%s%s: %s' % ('' if first else ', ', json.dumps(k), json.dumps(v))
+        member = member.encode('utf-8')
+        buf.append(member)
+        buflen += len(member)
+        if first or buflen >= chunksize:
+            yield b''.join(buf)
+            buf = []
+            buflen = 0
+        first = False
+    buf.append(b'}')
+    yield b''.join(buf)
+
+class ChunkedStream(object):
+    """
+    A file-like object whose read() method returns the bytes coming from the
+    ``chunks`` iterable
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buf = b''
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            data = self.buf + b''.join(self.chunks)
+            self.buf = b''
+            return data
+        while len(self.buf) < n:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buf += chunk
+        data, self.buf = self.buf[:n], self.buf[n:]
+        return data
+
+def msgpack_array_chunks(objects, chunksize=65536):
+    """
+    Encodes ``objects`` as a msgpack array, yielding the result in chunks of
+    about ``chunksize`` bytes
+    """
+    if not isinstance(objects, (list, tuple)):
+        objects = list(objects)
+    packer = msgpack.Packer(use_bin_type=True)
+    buf = [packer.pack_array_header(len(objects))]
+    buflen = len(buf[0])
+    for o in objects:
+        packed = packer.pack(o)
+        buf.append(packed)
+        buflen += len(packed)
+        if buflen >= chunksize:
+            yield b''.join(buf)
+            buf = []
+            buflen = 0
+    yield b''.join(buf)
+
+def iter_msgpack_array(stream, chunksize=65536):
+    """
+    Iterates over the elements of the msgpack array contained in ``stream``,
+    decoding them as the content is read rather than reading it all first.
+    """
+    unpacker = msgpack.Unpacker(stream, read_size=chunksize, raw=False)
+    for _ in range(unpacker.read_array_header()):
+        yield unpacker.unpack()
+
+def loads_graph(content):
+    """
+    Decodes a graph serialized either as JSON or as msgpack
+    """
+    if content.lstrip()[:1] in (b'[', b'{'):
+        return json.loads(b2s(content))
+    if msgpack is None:
+        raise ValueError("Content is not JSON, and msgpack is not available to decode it")
+    return msgpack.unpackb(content, raw=False)
+
+def gzip_chunks(chunks, level=6):
+    """
+    Compresses the byte ``chunks`` into the gzip format, yielding the
+    compressed data as it becomes available.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+_JSON_WS = re.compile(r'[ \t\n\r]*')
+
+def iter_json_array(stream, chunksize=65536):
+    """
+    Iterates over the elements of the JSON array contained in ``stream``,
+    parsing them as the content is read rather than reading it all first.
+    The elements of the array must be JSON objects or arrays, which can be
+    told apart from incomplete content.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    pos = 0
+    started = need_comma = False
+
+    while True:
+
+        pos = _JSON_WS.match(buf, pos).end()
+        incomplete = pos == len(buf)
+
+        if not incomplete:
+            c = buf[pos]
+            if not started:
+                if c != '[':
+                    raise ValueError("JSON content is not an array")
+                started = True
+                pos += 1
+                continue
+            if c == ']':
+                return
+            if c == ',':
+                if not need_comma:
+                    raise ValueError("Unexpected ',' at JSON array")
+                need_comma = False
+                pos += 1
+                continue
+            if need_comma:
+                raise ValueError("Missing ',' at JSON array")
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+                need_comma = True
+                yield obj
+                continue
+            except ValueError:
+                incomplete = True
+
+        # Read more content, dropping what we already consumed
+        data = stream.read(chunksize)
+        if not data:
+            raise ValueError("Unexpected end of JSON array")
+        if not isinstance(data, six.text_type):
+            data = utf8.decode(data)
+        buf = buf[pos:] + data
+        pos = 0
@@ -0,0 +1,4 @@
+version = '0.3.2'
+git_version = 'Unknown'
+full_version = '0.3.2'
+is_release = True
@@ -150,6 +150,8 @@ setup(
             "python-daemon",
             "pyzmq",
             "scp",
+            # selectors is part of the standard library only since python 3.4
+            "selectors34; python_version < '3.4'",
             # 1.10 contains an important race-condition fix on lazy-loaded modules
             'six>=1.10',
             # 0.19.0 requires netifaces < 0.10.5, exactly the opposite of what *we* need
@@ -174,7 +176,10 @@ setup(
         'drive-casa': ["drive-casa>0.7"],
 
         # MPI support (MPIApp drops and HPC experiemnts) requires mpi4py
-        'MPI': ['mpi4py']
+        'MPI': ['mpi4py'],
+
+        # msgpack enables the binary graph format, much faster than JSON
+        'msgpack': ['msgpack>=0.5.2']
       },
 
       test_suite="test",
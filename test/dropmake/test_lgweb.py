@@ -28,11 +28,13 @@ import unittest
 import pkg_resources
 
 from dfms import tool, utils
+from dfms.dropmake.pg_manager import PGManager
 from dfms.restutils import RestClient, RestClientException
 
 
 lg_dir = pkg_resources.resource_filename(__name__, '.')  # @UndefinedVariable
 lgweb_port = 8000
+pgt_params = {'num_par': 5, 'algo': 'metis', 'min_goal': 0, 'ptype': 0, 'max_load_imb': 100}
 
 class TestLGWeb(unittest.TestCase):
 
@@ -52,6 +54,11 @@ class TestLGWeb(unittest.TestCase):
     def _generate_pgt(self, c):
         c._GET('/gen_pgt?lg_name=logical_graphs/chiles_simple.json&num_par=5&algo=metis&min_goal=0&ptype=0&max_load_imb=100')
 
+    def _pgt_id(self):
+        with open(os.path.join(lg_dir, 'logical_graphs', 'chiles_simple.json'), 'rb') as f:
+            key = PGManager.pgt_key(f.read(), pgt_params)
+        return PGManager.pgt_id('logical_graphs/chiles_simple.json', key)
+
     def test_get_lgjson(self):
 
         c = RestClient('localhost', lgweb_port, 10)
@@ -104,6 +111,14 @@ class TestLGWeb(unittest.TestCase):
         # this should work now
         self._generate_pgt(c)
 
+        # the same translation is done only once
+        pgt_fname = os.path.join(self.temp_dir, self._pgt_id())
+        self.assertTrue(os.path.exists(pgt_fname))
+        mtime = os.path.getmtime(pgt_fname)
+        self._generate_pgt(c)
+        self.assertEqual(mtime, os.path.getmtime(pgt_fname))
+        self.assertEqual(1, len([f for f in os.listdir(os.path.dirname(pgt_fname)) if f.endswith('_pgt.json')]))
+
     def test_get_pgtjson(self):
 
         c = RestClient('localhost', lgweb_port, 10)
@@ -112,7 +127,7 @@ class TestLGWeb(unittest.TestCase):
         # doesn't exist
         self.assertRaises(RestClientException, c._get_json, '/pgt_jsonbody?pgt_name=unknown.json')
         # good!
-        c._get_json('/pgt_jsonbody?pgt_name=logical_graphs/chiles_simple1_pgt.json')
+        c._get_json('/pgt_jsonbody?pgt_name=' + self._pgt_id())
 
     def test_load_lgeditor(self):
 
@@ -135,7 +150,7 @@ class TestLGWeb(unittest.TestCase):
         # Defaults to first PGT
         c._GET('/pg_viewer')
         # also fine, PGT exists
-        c._GET('/pg_viewer?pgt_view_name=logical_graphs/chiles_simple1_pgt.json')
+        c._GET('/pg_viewer?pgt_view_name=' + self._pgt_id())
 
 
     def _test_pgt_action(self, path, unknown_fails):
@@ -150,7 +165,7 @@ class TestLGWeb(unittest.TestCase):
             c._GET('/' + path + '?pgt_id=unknown.json')
 
         # exists
-        c._GET('/' + path + '?pgt_id=logical_graphs/chiles_simple1_pgt.json')
+        c._GET('/' + path + '?pgt_id=' + self._pgt_id())
 
     def test_show_gantt_chart(self):
         self._test_pgt_action('show_gantt_chart', False)
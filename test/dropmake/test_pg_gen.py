@@ -21,6 +21,9 @@
 
 import unittest, pkg_resources
 
+import networkx as nx
+
+from dfms.dropmake.dag import CSRGraph
 from dfms.dropmake.pg_generator import LG, PGT, MetisPGTP, MySarkarPGTP,\
  MinNumPartsPGTP, GPGTNoNeedMergeException
 
@@ -53,6 +56,42 @@ class TestPGGen(unittest.TestCase):
         #lg.to_pg_tpl(input_dict)
         #pprint.pprint(dict(lg._drop_dict))
 
+    def test_iter_unroll(self):
+        lgnames = ['lofar_std.json', 'test_grpby_gather.json',
+                   'chiles_simple.json', 'cont_img.json']
+        def drops_by_oid(drop_list):
+            ret = dict()
+            for drop in drop_list:
+                drop = dict(drop)
+                # execution times are random
+                drop.pop('tw', None)
+                drop.pop('sleepTime', None)
+                ret[drop['oid']] = drop
+            return ret
+        for lgn in lgnames:
+            fp = get_lg_fname(lgn)
+            drop_list = LG(fp, ssid='1').unroll_to_tpl()
+            streamed = list(LG(fp, ssid='1').iter_unroll_to_tpl())
+            self.assertEqual(len(drop_list), len(streamed))
+            self.assertEqual(drops_by_oid(drop_list), drops_by_oid(streamed))
+
+    def test_freeze_hierarchy(self):
+        lgnames = ['lofar_std.json', 'test_grpby_gather.json',
+                   'chiles_simple.json', 'cont_img.json']
+        for lgn in lgnames:
+            lg = LG(get_lg_fname(lgn), ssid='1')
+            lgns = list(lg._done_dict.values())
+            thawed = [(n.h_level, n.group_hierarchy, n.dop) for n in lgns]
+            lg.freeze_hierarchy()
+            self.assertEqual(thawed, [(n.h_level, n.group_hierarchy, n.dop) for n in lgns])
+            for n in lgns:
+                self.assertEqual(n.dop, n._hcache['dop'])
+
+            # any change to the logical graph forgets everything
+            lgns[0].add_output(lgns[-1])
+            for n in lgns:
+                self.assertIsNone(n._hcache)
+
     def test_pgt_to_json(self):
         fp = get_lg_fname('lofar_std.json')
         lg = LG(fp)
@@ -102,6 +141,37 @@ class TestPGGen(unittest.TestCase):
             pg_spec = pgtp.to_pg_spec(node_list, num_islands=nb_islands)
             pgtp.result(lazy=False)
 
+    def test_metis_csr_input(self):
+        fp = get_lg_fname('lofar_std.json')
+        drop_list = LG(fp).unroll_to_tpl()
+        G = CSRGraph.from_drops(drop_list, multi_constraint=True)
+
+        # compare against an undirected graph built one edge at a time
+        key_dict = dict((drop['oid'], i) for i, drop in enumerate(drop_list))
+        H = nx.Graph()
+        for i, drop in enumerate(drop_list):
+            for oid in drop.get('consumers', []) + drop.get('outputs', []):
+                j = key_dict[oid]
+                dd = drop if drop['type'] == 'plain' else drop_list[j]
+                H.add_edge(i, j, weight=max(dd.get('dw', 1), 1))
+        self.assertEqual(len(drop_list), G.num_nodes)
+        self.assertEqual(H.number_of_edges(), G.num_edges)
+        self.assertEqual(2 * G.num_edges, G.xadj[-1])
+        self.assertEqual(2, G.ncon)
+        for i in range(G.num_nodes):
+            nbs = G.adjncy[G.xadj[i]:G.xadj[i + 1]].tolist()
+            wts = G.adjwgt[G.xadj[i]:G.xadj[i + 1]].tolist()
+            self.assertEqual(sorted(H.neighbors(i)) if i in H else [], nbs)
+            for j, w in zip(nbs, wts):
+                self.assertEqual(H[i][j]['weight'], w)
+
+        pgtp = MetisPGTP(drop_list, 3, merge_parts=True, multi_constraint=True)
+        pgtp.to_gojs_json(visual=False)
+        self.assertEqual(len(drop_list), len(pgtp._oid_gid_map))
+        self.assertEqual(3, pgtp._num_parts_done)
+        pgtp.merge_partitions(2)
+        self.assertEqual(set([0, 1]), set(pgtp._oid_gid_map.values()))
+
     def test_mysarkar_pgtp(self):
         lgnames = ['lofar_std.json', 'test_grpby_gather.json', 'chiles_simple.json']
         tgt_partnum = [15, 15, 10, 10, 5]
@@ -0,0 +1,96 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2017
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pkg_resources
+
+from dfms.dropmake.pg_generator import LG, MySarkarPGTP
+from dfms.dropmake.pg_manager import PGManager
+
+
+def get_lg_fname(lg_name):
+    return pkg_resources.resource_filename(__name__, 'logical_graphs/{0}'.format(lg_name))  # @UndefinedVariable
+
+class TestPGManager(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        unittest.TestCase.tearDown(self)
+
+    def test_pgt_key(self):
+        with open(get_lg_fname('chiles_simple.json'), 'rb') as f:
+            content = f.read()
+        key = PGManager.pgt_key(content, {'algo': 'metis', 'num_par': 5})
+        self.assertEqual(key, PGManager.pgt_key(content, {'num_par': '5', 'algo': 'metis'}))
+        self.assertNotEqual(key, PGManager.pgt_key(content, {'algo': 'metis', 'num_par': 4}))
+        self.assertNotEqual(key, PGManager.pgt_key(content + b' ', {'algo': 'metis', 'num_par': 5}))
+        self.assertEqual('lgs/chiles_simple_{0}_pgt.json'.format(key),
+                         PGManager.pgt_id('lgs/chiles_simple.json', key))
+
+    def test_cache(self):
+        # room for a single PGT in memory
+        pg_mgr = PGManager(self.temp_dir, max_cache_size=1)
+        pgt_ids = []
+        for i, lgn in enumerate(['chiles_simple.json', 'lofar_std.json']):
+            pgt = MySarkarPGTP(LG(get_lg_fname(lgn)).unroll_to_tpl())
+            pgt_id = pg_mgr.add_pgt(pgt, lgn, key=str(i))
+            self.assertTrue(os.path.exists(os.path.join(self.temp_dir, pgt_id)))
+            # callers get their own copies
+            cached = pg_mgr.get_pgt(pgt_id)
+            self.assertIsNot(pgt, cached)
+            self.assertIsNot(cached, pg_mgr.get_pgt(pgt_id))
+            self.assertEqual(pgt.json, cached.json)
+            pgt_ids.append((pgt_id, pgt))
+
+        # the first one was evicted from memory, and comes back from disk
+        pgt_id, pgt = pgt_ids[0]
+        restored = pg_mgr.get_pgt(pgt_id)
+        self.assertIsNotNone(restored)
+        self.assertIsNot(pgt, restored)
+        self.assertEqual(pgt.json, restored.json)
+        self.assertEqual(pgt.result(), restored.result())
+        self.assertEqual(pg_mgr.get_gantt_chart(pgt_id), PGManager(self.temp_dir).get_gantt_chart(pgt_id))
+
+        self.assertIsNone(pg_mgr.get_pgt('unknown_pgt.json'))
+
+    def test_invalid_pgt_ids(self):
+        # a pickle living outside the root directory is never loaded
+        outside = tempfile.mkdtemp()
+        try:
+            pgt = MySarkarPGTP(LG(get_lg_fname('chiles_simple.json')).unroll_to_tpl())
+            PGManager(outside).add_pgt(pgt, 'chiles_simple.json', key='0')
+            pg_mgr = PGManager(self.temp_dir)
+            rel = os.path.relpath(outside, self.temp_dir)
+            for pgt_id in (rel + '/chiles_simple_0_pgt.json',
+                           os.path.join(outside, 'chiles_simple_0_pgt.json'),
+                           '../chiles_simple_0_pgt.json', None):
+                self.assertIsNone(pg_mgr.get_pgt(pgt_id))
+        finally:
+            shutil.rmtree(outside)
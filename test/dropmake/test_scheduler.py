@@ -20,11 +20,16 @@
 #    MA 02111-1307  USA
 
 import os
+import random
 import unittest
 
+import networkx as nx
+import numpy as np
 import pkg_resources
 import psutil
 
+from dfms.dropmake.dag import (CompactDAG, CriticalPath, MaxWeightedAntichain,
+    Reachability)
 from dfms.dropmake.pg_generator import LG
 from dfms.dropmake.scheduler import (Scheduler, MySarkarScheduler, DAGUtil,
 Partition, MinNumPartsScheduler, PSOScheduler, SAScheduler, MCTSScheduler)
@@ -57,6 +62,94 @@ class TestScheduler(unittest.TestCase):
         r = DAGUtil.get_max_dop(part._dag)
         assert l == r, "l = {0}, r = {1}".format(l, r)
 
+    def test_compact_dag(self):
+        for lgn in ('cont_img.json', 'lofar_std.json', 'test_grpby_gather.json', 'chiles_simple.json'):
+            drop_list = LG(get_lg_fname(lgn)).unroll_to_tpl()
+            G = DAGUtil.build_dag_from_drops(drop_list)
+            cdag = CompactDAG.from_nx(G)
+            self.assertEqual(len(drop_list), cdag.num_nodes)
+            self.assertEqual(G.number_of_edges(), cdag.num_edges)
+            self.assertEqual(G.edges(), list(zip(cdag.node_ids[cdag.edge_src].tolist(),
+                                                 cdag.node_ids[cdag.edge_dst].tolist())))
+            topo = cdag.topo_order
+            pos = np.empty_like(topo)
+            pos[topo] = np.arange(len(topo))
+            self.assertTrue(np.all(pos[cdag.edge_src] < pos[cdag.edge_dst]))
+            self.assertEqual(DAGUtil.get_longest_path(G), cdag.longest_path())
+            self.assertEqual(DAGUtil.get_longest_path(G), DAGUtil.get_longest_path(cdag))
+
+            # zero half of the edges, both in G and in the edge weights array
+            ew = cdag.edge_weight.copy()
+            ew[::2] = 0
+            for u, v in zip(cdag.edge_src[::2], cdag.edge_dst[::2]):
+                G.edge[cdag.node_ids[u]][cdag.node_ids[v]]['weight'] = 0
+            self.assertEqual(DAGUtil.get_longest_path(G), cdag.longest_path(ew))
+            DAGUtil.label_schedule(G)
+            stt, edt = cdag.label_schedule(ew)
+            for i, n in enumerate(cdag.node_ids):
+                self.assertEqual(G.node[n]['stt'], stt[i])
+                self.assertEqual(G.node[n]['edt'], edt[i])
+
+    def test_critical_path(self):
+        drop_list = LG(get_lg_fname('lofar_std.json')).unroll_to_tpl()
+        cdag = CompactDAG.from_drops(drop_list)
+        ew = cdag.edge_weight.copy()
+        cp = CriticalPath(cdag, ew)
+        self.assertEqual(cdag.longest_path(ew, show_path=False)[1], cp.length)
+        for i, eid in enumerate(cdag.edges_by_weight()):
+            # probing must not change anything
+            new_w = ew[eid] + 7 if i % 5 == 0 else 0
+            probed = cp.probe_edge_weight(eid, new_w)
+            ew2 = ew.copy()
+            ew2[eid] = new_w
+            self.assertEqual(cdag.longest_path(ew2, show_path=False)[1], probed)
+            self.assertEqual(cdag.longest_path(ew, show_path=False)[1], cp.length)
+            ew[eid] = new_w
+            cp.set_edge_weight(eid, new_w)
+            self.assertEqual(cdag.longest_path(ew, show_path=False)[1], cp.length)
+
+    def test_max_weighted_antichain(self):
+
+        def brute_width(G, nodes, w):
+            tc = nx.transitive_closure(G).subgraph(nodes)
+            return max(sum(w[n] for n in ac) for ac in nx.antichains(tc))
+
+        rnd = random.Random(42)
+        for _ in range(50):
+            n = rnd.randint(2, 10)
+            G = nx.DiGraph()
+            G.add_nodes_from(range(n))
+            G.add_edges_from((u, v) for u in range(n) for v in range(u + 1, n) if rnd.random() < 0.25)
+            w = dict((i, rnd.randint(1, 4)) for i in range(n))
+            nodes = rnd.sample(range(n), n)
+            reach = Reachability(CompactDAG.from_nx(G))
+
+            # node by node, with some of them rejected
+            ac = MaxWeightedAntichain(reach)
+            kept = []
+            for i, node in enumerate(nodes):
+                ac.begin()
+                ac.add_nodes([(node, w[node])])
+                if (i % 3 == 2):
+                    ac.rollback()
+                else:
+                    ac.commit()
+                    kept.append(node)
+                self.assertEqual(brute_width(G, kept, w), ac.width)
+
+            # merging two of them
+            half = n // 2
+            ac1 = MaxWeightedAntichain(reach)
+            ac1.add_nodes([(node, w[node]) for node in nodes[:half]])
+            ac2 = MaxWeightedAntichain(reach)
+            ac2.add_nodes([(node, w[node]) for node in nodes[half:]])
+            self.assertEqual(brute_width(G, nodes, w), ac1.merge(ac2))
+            self.assertEqual(max(len(a) for a in nx.antichains(G)), DAGUtil.get_max_dop(G))
+
+    def test_compact_dag_cycle(self):
+        cdag = CompactDAG([1, 2, 3], [0, 1, 2], [1, 2, 0], [1, 1, 1])
+        self.assertRaises(nx.NetworkXUnfeasible, cdag.longest_path)
+
     def test_basic_scheduler(self):
         fp = get_lg_fname('lofar_std.json')
         lg = LG(fp)
@@ -72,7 +165,9 @@ class TestScheduler(unittest.TestCase):
             lg = LG(fp)
             drop_list = lg.unroll_to_tpl()
             mps = MinNumPartsScheduler(drop_list, deadline, max_dop=mdp, optimistic_factor=ofa)
-            mps.partition_dag()
+            _, lpl, _, _ = mps.partition_dag()
+            self.assertEqual(DAGUtil.get_longest_path(mps._dag, show_path=False)[1], lpl)
+            self.assertEqual(lpl, mps.critical_path.length)
 
     def test_mysarkar_scheduler(self):
         lgs = {'cont_img.json': 20, 'lofar_std.json': 15, 'test_grpby_gather.json': 10, 'chiles_simple.json': 5}
@@ -92,6 +187,19 @@ class TestScheduler(unittest.TestCase):
                 """
             #mys.merge_partitions(numparts)
 
+    def test_multi_start_schedulers(self):
+        drop_list = LG(get_lg_fname('chiles_simple.json')).unroll_to_tpl()
+        for num_workers in (1, 2):
+            sa = SAScheduler(drop_list, max_dop=4, max_iter=50, num_starts=3, num_workers=num_workers)
+            num_parts, lpl, _, parts = sa.partition_dag()
+            self.assertEqual(len(parts), num_parts)
+            self.assertEqual(DAGUtil.get_longest_path(sa._dag, show_path=False)[1], lpl)
+            self.assertTrue(len(sa._sspace_dict) > 1)
+
+            mcts = MCTSScheduler(drop_list, max_dop=4, max_calc_time=0.01, num_starts=2, num_workers=num_workers)
+            num_parts, lpl, _, parts = mcts.partition_dag()
+            self.assertEqual(len(parts), num_parts)
+
     @unittest.skipIf(skip_long_tests, "Skipping because they take too long. Chen to eventually shorten them")
     def test_pso_scheduler(self):
         lgs = {'cont_img.json': 540, 'lofar_std.json': 450, 'test_grpby_gather.json': 70, 'chiles_simple.json': 160}
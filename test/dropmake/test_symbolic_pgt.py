@@ -0,0 +1,97 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2017
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+
+import json
+import unittest
+
+import pkg_resources
+
+from dfms.dropmake.pg_generator import LG
+from dfms.dropmake.symbolic_pgt import SymbolicPGT
+
+
+def get_lg_fname(lg_name):
+    return pkg_resources.resource_filename(__name__, 'logical_graphs/{0}'.format(lg_name))  # @UndefinedVariable
+
+def drops_by_oid(drop_list):
+    ret = dict()
+    for drop in drop_list:
+        drop = dict(drop)
+        # execution times are random
+        drop.pop('tw', None)
+        drop.pop('sleepTime', None)
+        if ('command' in drop):
+            drop['command'] = str(drop['command'])
+        ret[drop['oid']] = drop
+    return ret
+
+class TestSymbolicPGT(unittest.TestCase):
+
+    lgnames = ['lofar_std.json', 'test_grpby_gather.json',
+               'chiles_simple.json', 'cont_img.json']
+
+    def test_expand(self):
+        for lgn in self.lgnames:
+            fp = get_lg_fname(lgn)
+            drop_list = LG(fp, ssid='1').unroll_to_tpl()
+            spgt = SymbolicPGT.from_file(fp, ssid='1')
+            self.assertEqual(len(drop_list), spgt.num_drops)
+            self.assertEqual(drops_by_oid(drop_list), drops_by_oid(spgt.expand()))
+
+    def test_partition_and_map(self):
+        node_list = ['island0', 'island1', 'node0', 'node1', 'node2', 'node3']
+        for lgn in self.lgnames:
+            fp = get_lg_fname(lgn)
+            drop_list = LG(fp, ssid='1').unroll_to_tpl()
+            spgt = SymbolicPGT.from_file(fp, ssid='1')
+            spgt.partition(4)
+            spgt.map(node_list, num_islands=2)
+
+            # goes through its compressed form
+            spgt = SymbolicPGT.from_json(json.loads(json.dumps(spgt.to_json())))
+            expanded = []
+            for p in range(spgt.num_partitions):
+                part_drops = list(spgt.expand(spgt.ranges(p)))
+                for drop in part_drops:
+                    self.assertEqual(node_list[2 + p], drop['node'])
+                    self.assertEqual(node_list[p // 2], drop['island'])
+                expanded += part_drops
+
+            expanded = drops_by_oid(expanded)
+            for drop in expanded.values():
+                del drop['node']
+                del drop['island']
+            self.assertEqual(drops_by_oid(drop_list), expanded)
+
+    def test_locate(self):
+        node_list = ['island0', 'node0', 'node1', 'node2']
+        for lgn in self.lgnames:
+            spgt = SymbolicPGT.from_file(get_lg_fname(lgn), ssid='1')
+            spgt.partition(3)
+            spgt.map(node_list)
+            for p in range(spgt.num_partitions):
+                peer_nodes = {}
+                for drop in spgt.expand(spgt.ranges(p), peer_nodes=peer_nodes):
+                    self.assertEqual(p, spgt.locate(drop['oid']))
+                for oid, node in peer_nodes.items():
+                    self.assertEqual(node, node_list[1 + spgt.locate(oid)])
+            self.assertIsNone(spgt.locate('2_-1_0'))
+            self.assertIsNone(spgt.locate('1_lala_0'))
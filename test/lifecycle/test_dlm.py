@@ -32,9 +32,14 @@ import time
 import unittest
 
 from dfms.ddap_protocol import DROPStates, DROPPhases
-from dfms.drop import FileDROP, DirectoryContainer, BarrierAppDROP
+from dfms import droputils
+from dfms.ddap_protocol import AppDROPStates
+from dfms.drop import FileDROP, DirectoryContainer, BarrierAppDROP, InMemoryDROP
 from dfms.droputils import DROPWaiterCtx
 from dfms.lifecycle import dlm
+from dfms.lifecycle.hsm.manager import HierarchicalStorageManager
+from dfms.lifecycle.hsm.store import DirectoryStore
+from dfms.manager.session import SessionStates
 
 
 class TestDataLifecycleManager(unittest.TestCase):
@@ -68,7 +73,8 @@ class TestDataLifecycleManager(unittest.TestCase):
             self._writeAndClose(drop)
 
             # The call to close() should have turned it into a SOLID object
-            # because the DLM replicated it
+            # because the DLM replicated it (in the background)
+            self.assertTrue(manager.waitForReplications(5))
             self.assertEqual(DROPPhases.SOLID, drop.phase)
             self.assertEqual(2, len(manager.getDropUids(drop)))
 
@@ -76,9 +82,116 @@ class TestDataLifecycleManager(unittest.TestCase):
             drop = FileDROP('oid:B', 'uid:B1', expectedSize=1, precious=False)
             manager.addDrop(drop)
             self._writeAndClose(drop)
+            self.assertTrue(manager.waitForReplications(5))
             self.assertEqual(DROPPhases.GAS, drop.phase)
             self.assertEqual(1, len(manager.getDropUids(drop)))
 
+            status = manager.getReplicationStatus()
+            self.assertEqual(1, status['completed'])
+            self.assertEqual(0, status['failed'])
+            self.assertEqual(1, status['bytes'])
+
+    def _directoryStore(self, size):
+        dirName = tempfile.mkdtemp()
+        self._dirs.append(dirName)
+        DirectoryStore.prepareDirectory(dirName, size)
+        return DirectoryStore(dirName)
+
+    def test_storeSelectionAndMigration(self):
+        """
+        Replicas go to the slowest tier with enough space, and cold DROPs are
+        moved down the hierarchy
+        """
+        self._dirs = []
+        try:
+            fast = self._directoryStore(100)
+            tiny = self._directoryStore(5)
+            slow = self._directoryStore(100)
+            hsm = HierarchicalStorageManager([fast, tiny])
+            hsm.addStore(slow, tier=1)
+
+            with dlm.DataLifecycleManager(hsm=hsm, checkPeriod=0.5, movePeriod=0.5, coldAfter=0.5) as manager:
+                drop = FileDROP('oid:A', 'uid:A1', expectedSize=10, dirname=self._dirs[0])
+                manager.addDrop(drop)
+                drop.write(b'0123456789')
+                self.assertTrue(manager.waitForReplications(5))
+
+                # The replica doesn't fit in the tiny store
+                uids = set(manager.getDropUids(drop))
+                self.assertEqual(2, len(uids))
+                replica = manager._drops[(uids - set([drop.uid])).pop()]
+                self.assertIs(slow, hsm.getStoreOf(replica))
+                self.assertEqual(90, fast.getAvailableSpace())
+                self.assertEqual(90, slow.getAvailableSpace())
+
+                # Reading the DROP records an access; after a while without
+                # further accesses it is moved into the slow tier
+                desc = drop.open()
+                drop.close(desc)
+                time.sleep(1.5)
+                self.assertTrue(manager.waitForReplications(5))
+                self.assertEqual(DROPStates.DELETED, drop.status)
+                self.assertEqual(3, len(manager.getDropUids(drop)))
+                self.assertEqual(100, fast.getAvailableSpace())
+                self.assertEqual(80, slow.getAvailableSpace())
+                self.assertEqual(5, tiny.getAvailableSpace())
+        finally:
+            for dirName in self._dirs:
+                shutil.rmtree(dirName, True)
+
+    def _readAfterMoveCycle(self, manager, drop):
+        self.assertEqual(b'0123456789', droputils.allDropContents(drop))
+        time.sleep(1.5)
+        self.assertTrue(manager.waitForReplications(5))
+        self.assertEqual(DROPStates.COMPLETED, drop.status)
+        self.assertEqual(b'0123456789', droputils.allDropContents(drop))
+
+    def test_noMigrationByDefault(self):
+        """
+        Cold DROPs are not moved unless asked to
+        """
+        with dlm.DataLifecycleManager(checkPeriod=0.5, movePeriod=0.5) as manager:
+            drop = InMemoryDROP('oid:A', 'uid:A1', expectedSize=10, precious=False)
+            manager.addDrop(drop)
+            drop.write(b'0123456789')
+            self._readAfterMoveCycle(manager, drop)
+
+    def test_noMigrationOfDropsInUse(self):
+        """
+        DROPs with unfinished consumers, or belonging to a session that is still
+        running, are not moved
+        """
+
+        class FakeSession(object):
+            status = SessionStates.RUNNING
+
+        with dlm.DataLifecycleManager(checkPeriod=0.5, movePeriod=0.5, coldAfter=0.5) as manager:
+
+            session = FakeSession()
+            drop = InMemoryDROP('oid:A', 'uid:A1', expectedSize=10, precious=False)
+            manager.addDrop(drop, session)
+            drop.write(b'0123456789')
+            self._readAfterMoveCycle(manager, drop)
+
+            # The consumer waits also for a DROP that never completes
+            drop = InMemoryDROP('oid:B', 'uid:B1', expectedSize=10, precious=False)
+            other = InMemoryDROP('oid:D', 'uid:D1', precious=False)
+            consumer = BarrierAppDROP('oid:C', 'uid:C1')
+            drop.addConsumer(consumer)
+            other.addConsumer(consumer)
+            manager.addDrop(drop)
+            manager.addDrop(consumer)
+            drop.write(b'0123456789')
+            self._readAfterMoveCycle(manager, drop)
+
+            # Once not in use anymore they are moved
+            session.status = SessionStates.FINISHED
+            consumer.execStatus = AppDROPStates.FINISHED
+            time.sleep(1.5)
+            self.assertTrue(manager.waitForReplications(5))
+            self.assertEqual(DROPStates.DELETED, manager._drops['uid:A1'].status)
+            self.assertEqual(DROPStates.DELETED, drop.status)
+
     def test_expiringNormalDrop(self):
 
         with dlm.DataLifecycleManager(checkPeriod=0.5) as manager:
@@ -93,6 +206,16 @@ class TestDataLifecycleManager(unittest.TestCase):
 
             self.assertEqual(DROPStates.EXPIRED, drop.status)
 
+    def test_expiringCompletedDrop(self):
+        """
+        DROPs that are already COMPLETED when added to the DLM also expire
+        """
+        with dlm.DataLifecycleManager(checkPeriod=0.5) as manager:
+            drop = FileDROP('oid:A', 'uid:A1', expectedSize=1, lifespan=0.5, precious=False)
+            self._writeAndClose(drop)
+            manager.addDrop(drop)
+            time.sleep(1)
+            self.assertEqual(DROPStates.EXPIRED, drop.status)
 
     def test_lostDrop(self):
         with dlm.DataLifecycleManager(checkPeriod=0.5) as manager:
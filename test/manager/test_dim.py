@@ -30,9 +30,11 @@ import pkg_resources
 
 from dfms import droputils, tool
 from dfms import utils
-from dfms.ddap_protocol import DROPStates
+from dfms.ddap_protocol import DROPStates, DROPRel, DROPLinkType
+from dfms.dropmake.symbolic_pgt import SymbolicPGT
+from dfms.exceptions import SubManagerException
 from dfms.manager import constants
-from dfms.manager.composite_manager import DataIslandManager
+from dfms.manager.composite_manager import DataIslandManager, CompositeSession
 from dfms.manager.node_manager import NodeManager
 from dfms.manager.rest import NMRestServer
 from dfms.manager.session import SessionStates
@@ -137,6 +139,126 @@ class TestDIM(unittest.TestCase):
 
         self.assertEqual(data, droputils.allDropContents(c))
 
+    def test_deployGraphInSeveralParts(self):
+        """
+        Drops appended in different parts end up in the same node, and are
+        linked directly instead of through proxies
+        """
+
+        sessionId = 'lalo'
+        part1 = [{'oid':'A', 'type':'plain', 'storage':'memory', 'node':hostname, 'consumers':['B']},
+                 {'oid':'B', 'type':'app', 'app':'test.graphsRepository.SleepAndCopyApp', 'sleepTime':0, 'node':hostname}]
+        part2 = [{'oid':'C', 'type':'plain', 'storage':'memory', 'node':hostname, 'producers':['B']}]
+        self.dim.createSession(sessionId)
+        self.dim.addGraphSpec(sessionId, part1)
+        self.dim.addGraphSpec(sessionId, part2)
+        self.dim.deploySession(sessionId)
+
+        a, b, c = [self.dm._sessions[sessionId].drops[x] for x in ('A', 'B', 'C')]
+        self.assertEqual([c], b.outputs)
+        self.assertEqual([b], c.producers)
+
+        data = os.urandom(10)
+        with droputils.DROPWaiterCtx(self, c, 3):
+            a.write(data)
+            a.setCompleted()
+
+        self.assertEqual(data, droputils.allDropContents(c))
+
+    def test_destroySession(self):
+        """
+        The index of the drops of a session is freed when destroying it
+        """
+        sessionId = 'lalo'
+        self.createSessionAndAddTypicalGraph(sessionId)
+        self.assertEqual(3, len(self.dim._sessions[sessionId].index))
+        self.assertEqual(hostname, self.dim._sessions[sessionId].index['B'])
+        self.dim.destroySession(sessionId)
+        self.assertNotIn(sessionId, self.dim._sessions)
+        self.assertEqual(0, len(self.dm.getSessionIds()))
+
+    def test_evictFinishedSessions(self):
+        """
+        Finished sessions are destroyed after the retention period, and their
+        memory footprint is reported while they are kept
+        """
+        sessionId = 'lalo'
+        self.createSessionAndAddTypicalGraph(sessionId)
+        info = self.dim.getSessionsInfo()[sessionId]
+        self.assertEqual(3, info['drops'])
+        self.assertGreater(info['memory'], 0)
+        self.assertIsNone(info['finished'])
+
+        self.dim._sessionRetention = 0.1
+        self.dim.deploySession(sessionId)
+        self.dim.evictFinishedSessions()
+        self.assertIn(sessionId, self.dim._sessions)
+
+        a, c = [self.dm._sessions[sessionId].drops[x] for x in ('A', 'C')]
+        with droputils.DROPWaiterCtx(self, c, 3):
+            a.write(b'x')
+            a.setCompleted()
+        time.sleep(0.1)
+
+        self.dim.evictFinishedSessions()
+        self.assertIsNotNone(self.dim.getSessionsInfo()[sessionId]['finished'])
+        time.sleep(0.2)
+        self.dim.evictFinishedSessions()
+        self.assertNotIn(sessionId, self.dim._sessions)
+        self.assertEqual(0, len(self.dm.getSessionIds()))
+
+    def test_statusCache(self):
+        """
+        Concurrent requests for the status of a graph result in a single
+        request to the DMs, and statuses are reused for a while
+        """
+        sessionId = 'lalo'
+        self.createSessionAndAddTypicalGraph(sessionId)
+        self.dim.deploySession(sessionId)
+
+        calls = []
+        orig = self.dim._getGraphStatus
+        def getGraphStatus(*args):
+            calls.append(1)
+            time.sleep(0.2)
+            return orig(*args)
+        self.dim._getGraphStatus = getGraphStatus
+        self.dim._statusCache.ttl = 0.5
+
+        statuses = []
+        threads = [threading.Thread(target=lambda: statuses.append(self.dim.getGraphStatus(sessionId))) for _ in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(1, len(calls))
+        self.assertEqual(10, len(statuses))
+        self.assertEqual(set(['A', 'B', 'C']), set(statuses[0]))
+
+        self.dim.getGraphStatus(sessionId)
+        self.assertEqual(1, len(calls))
+        time.sleep(0.5)
+        self.dim.getGraphStatus(sessionId)
+        self.assertEqual(2, len(calls))
+
+    def test_deployGraphInBatches(self):
+        """
+        Drops are sent to the DMs in batches, and relationships between drops
+        of different batches are established at deployment time
+        """
+        sessionId = 'lalo'
+        self.dim._graphBatchSize = 1
+        self.createSessionAndAddTypicalGraph(sessionId)
+        self.dim.deploySession(sessionId)
+        a, c = [self.dm._sessions[sessionId].drops[x] for x in ('A', 'C')]
+
+        data = os.urandom(10)
+        with droputils.DROPWaiterCtx(self, c, 3):
+            a.write(data)
+            a.setCompleted()
+
+        self.assertEqual(data, droputils.allDropContents(c))
+
     def test_deployGraphWithCompletedDOs(self):
         self._test_deployGraphWithCompletedDOs('lalo')
 
@@ -157,6 +279,28 @@ class TestDIM(unittest.TestCase):
 
         self.assertEqual(DROPStates.COMPLETED, c.status)
 
+    def test_addGraphTemplate(self):
+
+        sessionId = 'lalo'
+        lg = pkg_resources.resource_filename('test.dropmake', 'logical_graphs/test_grpby_gather.json')  # @UndefinedVariable
+        spgt = SymbolicPGT.from_file(lg, ssid=sessionId)
+        spgt.partition(2)
+
+        # Not mapped yet
+        self.dim.createSession(sessionId)
+        self.assertRaises(Exception, self.dim.addGraphTemplate, sessionId, spgt.to_json())
+
+        # OK, the drops are expanded in the DM
+        spgt.map([hostname, hostname])
+        self.assertEqual(spgt.num_drops, self.dim.addGraphTemplate(sessionId, spgt.to_json()))
+        self.assertEqual(spgt.num_drops, self.dm.getGraphSize(sessionId))
+
+        # Completed drops are located via the template
+        first = next(spgt.expand(spgt.ranges(0)))
+        self.assertRaises(Exception, self.dim.deploySession, sessionId, completedDrops=['lala'])
+        self.dim.deploySession(sessionId, completedDrops=[first['oid']])
+        self.assertEqual(spgt.num_drops, len(self.dm._sessions[sessionId].drops))
+
     def test_sessionStatus(self):
 
         def assertSessionStatus(sessionId, status):
@@ -218,6 +362,53 @@ class TestDIM(unittest.TestCase):
             a.setCompleted()
         assertGraphStatus(sessionId, DROPStates.COMPLETED)
 
+    def test_replicatePartialFailure(self):
+        """
+        Errors and timeouts in some hosts don't prevent the results of the
+        rest from being collected, and are all reported together
+        """
+        dim = DataIslandManager([hostname], dmCommandTimeout=1)
+        try:
+            # All "hosts" are served by our NM
+            dim.ensureDM = lambda host, port=None, timeout=10: None
+            dim.dmAt = lambda host, port=None: self.dim.dmAt(hostname, port)
+
+            def f(dm, host, sessionId):
+                if host == 'bad':
+                    raise Exception("bad host")
+                elif host == 'slow':
+                    time.sleep(2)
+                return {host: len(dm.sessions())}
+
+            collect = {}
+            hosts = ['a', 'bad', 'b', 'slow']
+            with self.assertRaises(SubManagerException) as cm:
+                dim.replicate('lala', f, "testing", collect=collect, iterable=hosts)
+            self.assertEqual({'a': 0, 'b': 0}, collect)
+            self.assertEqual(set(['bad', 'slow']), set(cm.exception.args[1]))
+        finally:
+            dim.shutdown()
+
+class TestCompositeSession(unittest.TestCase):
+
+    def test_downstreamNodes(self):
+        """
+        Events flow from A (node1) to B (node2) to C (node3), while D (node4)
+        is only the parent of A, and E (node5) is an input for C
+        """
+        session = CompositeSession('lala')
+        for uid, node in (('A', 'node1'), ('B', 'node2'), ('C', 'node3'), ('D', 'node4'), ('E', 'node5')):
+            session.index.add(uid, uid, node)
+        session.addRelationship(DROPRel('B', DROPLinkType.CONSUMER, 'A'))
+        session.addRelationship(DROPRel('C', DROPLinkType.OUTPUT, 'B'))
+        session.addRelationship(DROPRel('D', DROPLinkType.CHILD, 'A'))
+        session.addRelationship(DROPRel('E', DROPLinkType.INPUT, 'C'))
+
+        downstream = session.downstreamNodes(['node1', 'node3', 'node4', 'node5'])
+        self.assertEqual(set(['node1', 'node2', 'node3']), downstream['node1'])
+        self.assertEqual(set(['node3']), downstream['node3'])
+        self.assertEqual(set(['node4']), downstream['node4'])
+        self.assertEqual(set(['node5', 'node3']), downstream['node5'])
 
 class TestREST(unittest.TestCase):
 
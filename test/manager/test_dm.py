@@ -22,9 +22,12 @@
 import threading
 import unittest
 
+import pkg_resources
+
 from dfms import droputils
 from dfms.ddap_protocol import DROPStates, DROPRel, DROPLinkType
 from dfms.drop import BarrierAppDROP, dropdict
+from dfms.dropmake.symbolic_pgt import SymbolicPGT
 from dfms.manager.node_manager import NodeManager
 
 
@@ -306,4 +309,69 @@ class TestDM(unittest.TestCase):
             drop = dm2._sessions[sessionId].drops["B%d" % (i,)]
             self.assertEqual(DROPStates.COMPLETED, drop.status)
         dm1.destroySession(sessionId)
-        dm2.destroySession(sessionId)
\ No newline at end of file
+        dm2.destroySession(sessionId)
+
+    def test_graph_template(self):
+        """
+        Each DM receives the same graph template, and expands only its own
+        partitions out of it. The relationships between the drops of both DMs
+        are worked out by the DMs themselves
+        """
+
+        dm1, dm2 = [self._start_dm() for _ in range(2)]
+
+        sessionId = 's1'
+        lg = pkg_resources.resource_filename('test.dropmake', 'logical_graphs/test_grpby_gather.json')  # @UndefinedVariable
+        spgt = SymbolicPGT.from_file(lg, ssid=sessionId)
+        spgt.partition(4)
+        spgt.map(['localhost', nm_conninfo(0), nm_conninfo(1)])
+        template = spgt.to_json()
+
+        counts = []
+        for i, dm in enumerate((dm1, dm2)):
+            dm.createSession(sessionId)
+            counts.append(dm.addGraphTemplate(sessionId, template, [i, i + 2]))
+        self.assertEqual(spgt.num_drops, sum(counts))
+
+        for dm in (dm1, dm2):
+            dm.deploySession(sessionId)
+        for dm, n in zip((dm1, dm2), counts):
+            self.assertEqual(n, len(dm._sessions[sessionId].drops))
+            # drops in one DM are related to drops in the other
+            self.assertTrue(dm._sessions[sessionId]._proxyinfo)
+
+        dm1.destroySession(sessionId)
+        dm2.destroySession(sessionId)
+
+    def test_rpc_server_stats(self):
+        """
+        Remote drops are accessed through RPC requests; those calling drop
+        methods are served by a pool of workers and accounted for.
+        """
+
+        dm1, dm2 = [self._start_dm(rpc_workers=2) for _ in range(2)]
+
+        sessionId = 's1'
+        g1 = [{"oid":"A", "type":"plain", "storage": "memory"}]
+        g2 = [{"oid":"B", "type":"app", "app":"dfms.apps.crc.CRCApp"},
+              {"oid":"C", "type":"plain", "storage": "memory", "producers":["B"]}]
+
+        rels = [DROPRel('B', DROPLinkType.CONSUMER, 'A')]
+        quickDeploy(dm1, sessionId, g1, {nm_conninfo(1): rels})
+        quickDeploy(dm2, sessionId, g2, {nm_conninfo(0): rels})
+
+        a = dm1._sessions[sessionId].drops['A']
+        c = dm2._sessions[sessionId].drops['C']
+        with droputils.DROPWaiterCtx(self, c, 1):
+            a.write(b'a')
+            a.setCompleted()
+
+        # B opened, read and closed A remotely
+        stats = dm1.get_rpc_server_stats()
+        self.assertEqual(2, stats['workers'])
+        self.assertEqual(0, stats['pending'])
+        self.assertGreaterEqual(stats['pooled_requests'], 3)
+        self.assertGreater(stats['max_latency'], 0)
+
+        dm1.destroySession(sessionId)
+        dm2.destroySession(sessionId)
@@ -19,16 +19,23 @@
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
 #    MA 02111-1307  USA
 #
+import json
+import os
+import socket
 import tempfile
 import threading
 import unittest
+import zlib
 
-from dfms import exceptions
-from dfms.manager import constants
+import six.moves.http_client as httplib  # @UnresolvedImport
+
+from dfms import exceptions, utils
+from dfms.manager import constants, client
 from dfms.manager.client import NodeManagerClient, DataIslandManagerClient
 from dfms.manager.node_manager import NodeManager
 from dfms.manager.rest import NMRestServer, CompositeManagerRestServer
-from dfms.restutils import RestClient
+from dfms.restutils import RestClient, RestServer, RestClientException, \
+    connection_pool
 from dfms.manager.composite_manager import DataIslandManager
 from dfms.exceptions import InvalidGraphException
 
@@ -67,6 +74,229 @@ class TestRest(unittest.TestCase):
             c._GET('/')
             c._GET('/session')
 
+    def test_keepAlive(self):
+
+        # Connections are given back to the pool after each request and picked
+        # up again by the next one, even from a different client
+        port = constants.NODE_DEFAULT_REST_PORT
+        connection_pool.clear()
+        with NodeManagerClient(hostname) as c:
+            c.create_session('keepalive')
+            self.assertEqual(['keepalive'], [s['sessionId'] for s in c.sessions()])
+        self.assertTrue(connection_pool.has_connections(hostname, port))
+        conn, reused = connection_pool.get(hostname, port, 10)
+        self.assertTrue(reused)
+        sock = conn.sock
+        connection_pool.put(conn)
+
+        with NodeManagerClient(hostname) as c:
+            c.session_status('keepalive')
+            self.assertIs(sock, c._conn.sock)
+
+        # Errors don't spoil the connections either
+        with NodeManagerClient(hostname) as c:
+            self.assertRaises(exceptions.NoSessionException, c.session_status, 'nope')
+            c.session_status('keepalive')
+            self.assertIs(sock, c._conn.sock)
+
+    def test_noResentRequests(self):
+
+        # A server that answers only the first request of each connection,
+        # and closes it after reading the second one
+        requests = []
+        listener = socket.socket()
+        listener.bind((hostname, 0))
+        listener.listen(5)
+        port = listener.getsockname()[1]
+        def serve(s):
+            f = s.makefile('rb')
+            for n in range(2):
+                method = f.readline().split(b' ')[0].decode('ascii')
+                length = 0
+                for line in iter(f.readline, b'\r\n'):
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':')[1])
+                f.read(length)
+                requests.append(method)
+                if n == 0:
+                    s.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+            f.close()
+            s.close()
+        def accept():
+            while True:
+                try:
+                    s = listener.accept()[0]
+                except socket.error:
+                    return
+                threading.Thread(target=serve, args=(s,)).start()
+        accept_t = threading.Thread(target=accept)
+        accept_t.start()
+
+        connection_pool.clear()
+        try:
+            # POSTs that reached the server are not sent again...
+            with RestClient(hostname, port, 10) as c:
+                self.assertEqual('ok', c._GET('/').read())
+                self.assertRaises(Exception, c._POST, '/', 'content')
+            self.assertEqual(['GET', 'POST'], requests)
+
+            # ... but idempotent requests are
+            del requests[:]
+            with RestClient(hostname, port, 10) as c:
+                self.assertEqual('ok', c._GET('/').read())
+                self.assertEqual('ok', c._GET('/').read())
+            self.assertEqual(['GET', 'GET', 'GET'], requests)
+        finally:
+            connection_pool.clear()
+            listener.shutdown(socket.SHUT_RDWR)
+            listener.close()
+            accept_t.join()
+
+    def test_streamedGraph(self):
+
+        sid = 'lala'
+        graph = [{'oid': 'A', 'type': 'plain', 'storage': 'memory', 'node': hostname, 'consumers': ['B']},
+                 {'oid': 'B', 'type': 'app', 'app': 'dfms.apps.simple.SleepApp', 'node': hostname}]
+        with DataIslandManagerClient(hostname) as c:
+            c.createSession(sid)
+            c.addGraphSpec(sid, graph)
+            c.deploySession(sid)
+            self.assertEqual(set(['A', 'B']), set(c.getGraph(sid)))
+            self.assertEqual(set(['A', 'B']), set(c.getGraphStatus(sid)))
+
+            # Graphs are gzip-compressed when clients accept it
+            for port in (constants.NODE_DEFAULT_REST_PORT, constants.ISLAND_DEFAULT_REST_PORT):
+                conn = httplib.HTTPConnection(hostname, port, timeout=10)
+                conn.request('GET', '/api/sessions/%s/graph' % sid, headers={'Accept-Encoding': 'gzip'})
+                resp = conn.getresponse()
+                self.assertEqual('gzip', resp.getheader('Content-Encoding'))
+                content = zlib.decompress(resp.read(), 16 + zlib.MAX_WBITS)
+                self.assertEqual(set(['A', 'B']), set(json.loads(content.decode('utf8'))))
+                conn.close()
+
+            # Errors are still reported properly
+            self.assertRaises(exceptions.NoSessionException, c.getGraph, 'nope')
+
+    def test_pooledServer(self):
+
+        port = 9876
+        evt = threading.Event()
+        server = RestServer(backend='pool', workers=1, max_queued=0)
+        server.app.get('/block', callback=lambda: 'blocked' if evt.wait(10) else 'timeout')
+        server.app.get('/quick', callback=lambda: 'quick')
+        server_t = threading.Thread(target=server.start, args=(hostname, port))
+        server_t.start()
+        try:
+            # The socket is listening as soon as the server is created
+            for _ in range(500):
+                if server._server:
+                    break
+                evt.wait(0.01)
+
+            # The only worker is busy, so requests are rejected
+            results = []
+            def block():
+                with RestClient(hostname, port, 10) as c:
+                    results.append(c._GET('/block').read())
+            block_t = threading.Thread(target=block)
+            block_t.start()
+            for _ in range(500):
+                if server._server.server._pending:
+                    break
+                evt.wait(0.01)
+
+            conn = httplib.HTTPConnection(hostname, port, timeout=10)
+            conn.request('GET', '/quick')
+            resp = conn.getresponse()
+            self.assertEqual(503, resp.status)
+            self.assertEqual('1', resp.getheader('Retry-After'))
+            conn.close()
+            with RestClient(hostname, port, 10) as c:
+                self.assertRaises(exceptions.DaliugeException, c._GET, '/quick')
+
+            evt.set()
+            block_t.join()
+            self.assertEqual(['blocked'], results)
+
+            # Idle connections don't hold the worker, and are reused
+            with RestClient(hostname, port, 10) as c:
+                self.assertEqual('quick', c._GET('/quick').read())
+                sock = c._conn.sock
+            with RestClient(hostname, port, 10) as c:
+                self.assertEqual('quick', c._GET('/quick').read())
+                self.assertIs(sock, c._conn.sock)
+        finally:
+            evt.set()
+            server.stop()
+            server_t.join()
+
+    def test_pooledServerHighFds(self):
+
+        # Idle connections with descriptors beyond FD_SETSIZE are watched too
+        try:
+            import resource
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if soft < 2048:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (min(2048, hard), hard))
+        except (ImportError, ValueError):
+            self.skipTest("Can't open enough file descriptors")
+        fds = []
+        port = 9876
+        server = RestServer(backend='pool', workers=1)
+        server.app.get('/quick', callback=lambda: 'quick')
+        server_t = threading.Thread(target=server.start, args=(hostname, port))
+        server_t.start()
+        try:
+            try:
+                while len(fds) < 1100:
+                    fds.append(os.open(os.devnull, os.O_RDONLY))
+            except OSError:
+                self.skipTest("Can't open enough file descriptors")
+            for _ in range(500):
+                if server._server:
+                    break
+                threading.Event().wait(0.01)
+
+            conn = httplib.HTTPConnection(hostname, port, timeout=10)
+            for _ in range(3):
+                conn.request('GET', '/quick')
+                resp = conn.getresponse()
+                self.assertEqual(200, resp.status)
+                self.assertEqual(b'quick', resp.read())
+            conn.close()
+        finally:
+            for fd in fds:
+                os.close(fd)
+            server.stop()
+            server_t.join()
+
+    def test_graphFormats(self):
+
+        graph = [{'oid': 'A', 'type': 'plain', 'storage': 'memory', 'node': hostname, 'consumers': ['B']},
+                 {'oid': 'B', 'type': 'app', 'app': 'dfms.apps.simple.SleepApp', 'node': hostname}]
+        formats = ['json']
+        if utils.msgpack:
+            formats.append('msgpack')
+
+        # Graphs can be appended in any format, both to NMs and DIMs
+        orig_format = client.graph_format
+        try:
+            for graph_format in formats:
+                client.graph_format = graph_format
+                for c in (NodeManagerClient(hostname), DataIslandManagerClient(hostname)):
+                    with c:
+                        c.createSession(graph_format)
+                        c.addGraphSpec(graph_format, graph)
+                        self.assertEqual(set(['A', 'B']), set(c.getGraph(graph_format)))
+                        c.destroySession(graph_format)
+        finally:
+            client.graph_format = orig_format
+
+        # Other formats are not accepted
+        with RestClient(hostname, constants.NODE_DEFAULT_REST_PORT, 10) as c:
+            c._POST('/api/sessions', b'{"sessionId": "lala"}', content_type='application/json')
+            self.assertRaises(RestClientException, c._POST, '/api/sessions/lala/graph/append', b'[]', content_type='text/plain')
+
     def test_errtype(self):
 
         sid = 'lala'
@@ -180,4 +180,46 @@ class TestUtils(unittest.TestCase):
         for obj in (1, {'a': 2}, 'b', {'sessionId': sessionId}):
             stream = utils.JSONStream(obj)
             self.assertEqual(obj, json.loads(stream.read(100).decode('latin1')))
-            self.assertEqual(0, len(stream.read(100).decode('latin1')))
\ No newline at end of file
+            self.assertEqual(0, len(stream.read(100).decode('latin1')))
+
+    def test_iter_json_array(self):
+
+        objects = [{'oid': str(i), 'name': u'é' * i, 'l': [1, {'a': '[],{}'}]} for i in range(100)]
+        content = json.dumps(objects, ensure_ascii=False).encode('utf8')
+
+        # Objects are read correctly regardless of where the content is split
+        for chunksize in (1, 7, 100, 65536):
+            read = list(utils.iter_json_array(six.BytesIO(content), chunksize))
+            self.assertEqual(objects, read)
+
+        self.assertEqual([], list(utils.iter_json_array(six.BytesIO(b' [ ] '))))
+        for content in (b'{}', b'[{},,{}]', b'[{} {}]', b'[{}'):
+            self.assertRaises(ValueError, list, utils.iter_json_array(six.BytesIO(content)))
+
+    @unittest.skipIf(utils.msgpack is None, "msgpack not available")
+    def test_msgpack_graphs(self):
+
+        objects = [{'oid': str(i), 'type': 'plain', 'name': u'é' * i, 'l': [1, {'a': 2}]} for i in range(100)]
+        for chunksize in (1, 100, 65536):
+            content = b''.join(utils.msgpack_array_chunks(objects, chunksize))
+            self.assertEqual(objects, utils.loads_graph(content))
+            stream = utils.ChunkedStream(utils.msgpack_array_chunks(iter(objects), chunksize))
+            self.assertEqual(objects, list(utils.iter_msgpack_array(stream, chunksize)))
+
+        # Binary graphs are much smaller than their JSON counterparts
+        content = b''.join(utils.msgpack_array_chunks(objects))
+        self.assertLess(len(content), len(json.dumps(objects)))
+        self.assertEqual(objects, utils.loads_graph(json.dumps(objects).encode('utf8')))
+
+    def test_iter_json_object(self):
+
+        obj = {str(i): {'status': i, 'name': u'é' * i} for i in range(100)}
+        for chunksize in (1, 100, 65536):
+            chunks = list(utils.iter_json_object(six.iteritems(obj), chunksize))
+            self.assertEqual(obj, json.loads(b''.join(chunks).decode('utf8')))
+        self.assertEqual({}, json.loads(b''.join(utils.iter_json_object([])).decode('utf8')))
+
+        # Compressed chunks can be decompressed back in one go
+        chunks = utils.gzip_chunks(utils.iter_json_object(six.iteritems(obj), 100))
+        content = zlib.decompress(b''.join(chunks), 16 + zlib.MAX_WBITS)
+        self.assertEqual(obj, json.loads(content.decode('utf8')))